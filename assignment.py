@@ -0,0 +1,86 @@
+"""Распределение участников «Тайного Санты» без самоподарков."""
+import os
+import random
+from typing import List, Optional, Sequence, Tuple
+
+# Один большой цикл: A → B → C → … → A
+MODE_CYCLE = "cycle"
+# Любое распределение без самоподарков (равновероятно среди всех таких)
+MODE_DERANGEMENT = "derangement"
+MODES = (MODE_CYCLE, MODE_DERANGEMENT)
+
+ASSIGNMENT_MODE = os.getenv("ASSIGNMENT_MODE", MODE_DERANGEMENT)
+
+
+def new_seed() -> int:
+    """Случайный seed, который стоит записать в лог для последующей проверки."""
+    return random.SystemRandom().getrandbits(64)
+
+
+def sattolo_cycle(n: int, rng: random.Random) -> List[int]:
+    """Алгоритм Саттоло: случайная перестановка из одного цикла длины n за O(n)."""
+    perm = list(range(n))
+    # int(random() * i) заметно быстрее randrange(i); смещение пренебрежимо мало
+    rnd = rng.random
+    for i in range(n - 1, 0, -1):
+        j = int(rnd() * i)
+        perm[i], perm[j] = perm[j], perm[i]
+    return perm
+
+
+def random_derangement(n: int, rng: random.Random) -> List[int]:
+    """Равновероятная перестановка без неподвижных точек за ожидаемое O(n).
+
+    Алгоритм Martínez, Panholzer, Prodinger (2008). Вероятность закрыть
+    цикл считается через d(k) = D(k) / k!, чтобы не работать с огромными
+    числами беспорядков D(k).
+    """
+    if n < 2:
+        raise ValueError("Для распределения нужно минимум 2 участника")
+
+    # d(k) = sum((-1)^i / i!, i = 0..k)
+    d = [1.0, 0.0]
+    term = -1.0
+    for k in range(2, n + 1):
+        term = -term / k
+        d.append(d[-1] + term)
+
+    perm = list(range(n))
+    marked = [False] * n
+    rnd = rng.random
+    i = n - 1
+    unmarked = n
+    while unmarked >= 2:
+        if not marked[i]:
+            j = int(rnd() * i)
+            while marked[j]:
+                j = int(rnd() * i)
+            perm[i], perm[j] = perm[j], perm[i]
+            if rnd() < d[unmarked - 2] / (unmarked * d[unmarked]):
+                marked[j] = True
+                unmarked -= 1
+            unmarked -= 1
+        i -= 1
+    return perm
+
+
+def make_assignments(
+    user_ids: Sequence[int],
+    mode: str = ASSIGNMENT_MODE,
+    seed: Optional[int] = None,
+) -> List[Tuple[int, int]]:
+    """Построить пары (даритель, получатель) без самоподарков.
+
+    При одинаковых user_ids, mode и seed результат воспроизводится.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим распределения: {mode}")
+    if len(user_ids) < 2:
+        raise ValueError("Для распределения нужно минимум 2 участника")
+
+    rng = random.Random(seed)
+    if mode == MODE_CYCLE:
+        perm = sattolo_cycle(len(user_ids), rng)
+    else:
+        perm = random_derangement(len(user_ids), rng)
+    return list(zip(user_ids, map(user_ids.__getitem__, perm)))
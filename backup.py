@@ -0,0 +1,218 @@
+"""Резервные копии базы SQLite: онлайн-копирование, ротация и восстановление.
+
+Копия снимается через sqlite3 backup API из отдельного потока и отдельного
+соединения порциями по BACKUP_PAGES страниц с паузой между ними. На время
+копирования соединение держит открытую транзакцию чтения: в режиме WAL она
+не мешает записи, а копия получается согласованным снимком на момент
+начала — без этого каждая запись бота перезапускала бы копирование с
+первой страницы.
+"""
+import asyncio
+import gzip
+import logging
+import os
+import re
+import shutil
+import sqlite3
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import List, Optional
+
+from telegram.ext import ContextTypes
+
+from database import DB_PATH, SCHEMA_VERSION
+
+logger = logging.getLogger(__name__)
+
+# Каталог копий; по умолчанию backups рядом с файлом базы
+BACKUP_DIR = os.getenv("BACKUP_DIR") or os.path.join(os.path.dirname(os.path.abspath(DB_PATH)), "backups")
+# Как часто снимать копию по расписанию, с; 0 — только по /backup
+BACKUP_INTERVAL = float(os.getenv("BACKUP_INTERVAL", "21600"))
+# Сколько последних копий хранить
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+# Сжимать копии gzip
+BACKUP_GZIP = os.getenv("BACKUP_GZIP", "1") == "1"
+# Страниц за один шаг копирования и пауза между шагами, с
+BACKUP_PAGES = int(os.getenv("BACKUP_PAGES", "256"))
+BACKUP_SLEEP = float(os.getenv("BACKUP_SLEEP", "0.005"))
+
+# Больше файла бот отправить не может
+BACKUP_SEND_MAX_BYTES = 50 * 1024 * 1024
+
+SNAPSHOT_PREFIX = "secret_santa-"
+SNAPSHOT_SUFFIXES = (".db", ".db.gz")
+# Имя копии: время снятия, метка и номер, если за секунду снято несколько копий
+SNAPSHOT_NAME = re.compile(rf"^{SNAPSHOT_PREFIX}(\d{{8}}-\d{{6}})(.*?)(?:-(\d+))?\.db(?:\.gz)?$")
+
+_lock = asyncio.Lock()
+
+
+@dataclass
+class BackupResult:
+    """Снятая копия: файл, размер и ход копирования."""
+
+    path: str
+    size: int
+    pages: int
+    steps: int
+    seconds: float
+
+
+def list_backups(directory: str = BACKUP_DIR) -> List[str]:
+    """Копии в каталоге, от новых к старым."""
+    if not os.path.isdir(directory):
+        return []
+    names = [
+        name for name in os.listdir(directory)
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith(SNAPSHOT_SUFFIXES)
+    ]
+    paths = [os.path.join(directory, name) for name in names]
+    return sorted(paths, key=_snapshot_order, reverse=True)
+
+
+def _snapshot_order(path: str):
+    """Ключ сортировки копий по времени снятия.
+
+    Сравнивать имена строками нельзя: «…-2.db» меньше «….db», хотя снята
+    позже. Время и номер берутся из имени, при равенстве — время изменения.
+    """
+    match = SNAPSHOT_NAME.match(os.path.basename(path))
+    stamp, number = (match.group(1), int(match.group(3) or 1)) if match else ("", 0)
+    return stamp, number, os.path.getmtime(path)
+
+
+def latest_backup(directory: str = BACKUP_DIR) -> Optional[str]:
+    """Последняя копия или None."""
+    backups = list_backups(directory)
+    return backups[0] if backups else None
+
+
+def rotate(directory: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> List[str]:
+    """Удалить копии сверх keep последних. Возвращает удалённые файлы."""
+    removed = list_backups(directory)[max(keep, 1):]
+    for path in removed:
+        os.remove(path)
+    return removed
+
+
+def _snapshot_path(directory: str, label: str) -> str:
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime())
+    base = os.path.join(directory, f"{SNAPSHOT_PREFIX}{stamp}{label}")
+    path, number = f"{base}.db", 1
+    while any(os.path.exists(path + suffix) for suffix in ("", ".gz")):
+        number += 1
+        path = f"{base}-{number}.db"
+    return path
+
+
+def make_backup(
+    db_path: str = DB_PATH,
+    directory: str = BACKUP_DIR,
+    compress: bool = BACKUP_GZIP,
+    pages: int = BACKUP_PAGES,
+    sleep: float = BACKUP_SLEEP,
+    keep: int = BACKUP_KEEP,
+    label: str = "",
+) -> BackupResult:
+    """Снять копию базы, проверить её и удалить старые копии (блокирующий вызов)."""
+    started = time.perf_counter()
+    os.makedirs(directory, exist_ok=True)
+    path = _snapshot_path(directory, label)
+    partial = f"{path}.part"
+    steps = 0
+    total = 0
+
+    def progress(status: int, remaining: int, pagecount: int):
+        nonlocal steps, total
+        steps += 1
+        total = pagecount
+        # Пауза между шагами: backup(sleep=...) ждёт, только если база занята
+        # (SQLITE_BUSY/LOCKED), а между успешными шагами не останавливается
+        if remaining and sleep > 0:
+            time.sleep(sleep)
+
+    source = sqlite3.connect(db_path, isolation_level=None)
+    target = sqlite3.connect(partial, isolation_level=None)
+    try:
+        # Снимок на момент начала: страницы читаются из одной транзакции
+        source.execute("BEGIN")
+        source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        source.backup(target, pages=pages, progress=progress)
+        source.execute("COMMIT")
+        # Копия — один самостоятельный файл, без -wal и -shm
+        target.execute("PRAGMA journal_mode = DELETE")
+        check = target.execute("PRAGMA quick_check").fetchone()[0]
+        if check != "ok":
+            raise RuntimeError(f"Копия базы повреждена: {check}")
+    except BaseException:
+        target.close()
+        os.remove(partial)
+        raise
+    finally:
+        source.close()
+    target.close()
+
+    if compress:
+        path += ".gz"
+        with open(partial, "rb") as raw, gzip.open(f"{path}.part", "wb", compresslevel=6) as packed:
+            shutil.copyfileobj(raw, packed, 1024 * 1024)
+        os.remove(partial)
+        partial = f"{path}.part"
+    os.replace(partial, path)
+
+    for removed in rotate(directory, keep):
+        logger.info(f"Резервная копия удалена по ротации: {removed}")
+    return BackupResult(path, os.path.getsize(path), total, steps, time.perf_counter() - started)
+
+
+def restore_backup(snapshot: str, db_path: str = DB_PATH) -> int:
+    """Заменить содержимое базы db_path копией snapshot. Возвращает число страниц.
+
+    Копия сначала проверяется (quick_check, версия схемы), затем
+    записывается в базу через тот же backup API, поэтому журнал WAL
+    базы остаётся согласованным. Бот на время восстановления нужно
+    остановить.
+    """
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(db_path))) as workdir:
+        if snapshot.endswith(".gz"):
+            unpacked = os.path.join(workdir, "snapshot.db")
+            with gzip.open(snapshot, "rb") as packed, open(unpacked, "wb") as raw:
+                shutil.copyfileobj(packed, raw, 1024 * 1024)
+            snapshot = unpacked
+        source = sqlite3.connect(f"file:{snapshot}?mode=ro", uri=True)
+        try:
+            check = source.execute("PRAGMA quick_check").fetchone()[0]
+            if check != "ok":
+                raise ValueError(f"Копия повреждена: {check}")
+            version = source.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise ValueError(f"Схема копии версии {version} новее поддерживаемой ({SCHEMA_VERSION})")
+            pages = source.execute("PRAGMA page_count").fetchone()[0]
+            target = sqlite3.connect(db_path)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+        finally:
+            source.close()
+    return pages
+
+
+async def backup_now(**kwargs) -> BackupResult:
+    """Снять копию в отдельном потоке; одновременно снимается только одна."""
+    async with _lock:
+        return await asyncio.to_thread(make_backup, **kwargs)
+
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: копия по расписанию."""
+    try:
+        result = await backup_now()
+    except Exception:
+        logger.exception("Не удалось снять резервную копию базы")
+        return
+    logger.info(
+        f"Резервная копия {result.path}: {result.size // 1024} КБ, "
+        f"{result.pages} страниц за {result.steps} шагов, {result.seconds:.2f} с"
+    )
@@ -0,0 +1,60 @@
+"""Микро-бенчмарк распределения: старый shuffle-and-retry против assignment.py.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_assignment.py
+"""
+import os
+import random
+import statistics
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from assignment import MODE_CYCLE, MODE_DERANGEMENT, make_assignments  # noqa: E402
+
+SIZES = (10, 1_000, 10_000, 100_000)
+
+
+def legacy_assignments(user_ids):
+    """Прежний алгоритм из assign(): до 100 перемешиваний, затем сдвиг на 1."""
+    assignments = []
+    valid = False
+    for _ in range(100):
+        receivers = user_ids.copy()
+        random.shuffle(receivers)
+        assignments = []
+        valid = True
+        for i, giver_id in enumerate(user_ids):
+            receiver_id = receivers[i]
+            if giver_id == receiver_id:
+                valid = False
+                break
+            assignments.append((giver_id, receiver_id))
+        if valid:
+            break
+    if not valid or len(assignments) != len(user_ids):
+        receivers = user_ids[1:] + user_ids[:1]
+        assignments = list(zip(user_ids, receivers))
+    return assignments
+
+
+def median_of(func, repeat: int) -> float:
+    # Медиана, а не минимум: у старого алгоритма время зависит от числа повторов
+    return statistics.median(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def main():
+    print(f"{'n':>8} | {'legacy, мс':>11} | {'cycle, мс':>10} | {'derangement, мс':>16}")
+    print("-" * 55)
+    for n in SIZES:
+        user_ids = list(range(1, n + 1))
+        repeat = 20 if n <= 10_000 else 5
+        legacy = median_of(lambda: legacy_assignments(user_ids), repeat)
+        cycle = median_of(lambda: make_assignments(user_ids, MODE_CYCLE, seed=1), repeat)
+        derangement = median_of(lambda: make_assignments(user_ids, MODE_DERANGEMENT, seed=1), repeat)
+        print(f"{n:>8} | {legacy * 1000:>11.2f} | {cycle * 1000:>10.2f} | {derangement * 1000:>16.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""Задержка записи во время онлайн-копирования базы SQLite.
+
+Заполняет базу участниками и пишет в неё новые регистрации так же, как
+бот (AsyncDatabase, один поток базы), пока в другом потоке снимается
+копия через backup.backup_now. Сравниваются задержки записи без копии и
+во время копии. Согласованность копии, восстановление и ротацию проверяет
+tests/test_backup.py.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_backup.py
+    python benchmarks/bench_backup.py --participants 300000 --pages 64
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import backup  # noqa: E402
+from database import DEFAULT_GAME_ID, AsyncDatabase, Database  # noqa: E402
+
+USER_ID_OFFSET = 1_000_000
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def describe(label: str, latencies, seconds: float):
+    print(
+        f"{label:<22} записей {len(latencies):>6} ({len(latencies) / seconds:>7.0f}/с)  "
+        f"p50 {statistics.median(latencies) * 1000:6.2f} мс  p99 {percentile(latencies, 0.99) * 1000:6.2f} мс  "
+        f"макс {max(latencies) * 1000:7.2f} мс"
+    )
+
+
+async def write_while(db, next_id, until) -> list:
+    """Регистрировать участников, пока until() истинно; вернуть задержки."""
+    latencies = []
+    while until():
+        user_id = next(next_id)
+        started = time.perf_counter()
+        await db.register_participant(DEFAULT_GAME_ID, user_id, None, f"Участник {user_id}", "Подарок")
+        latencies.append(time.perf_counter() - started)
+        # Пауза, как между обновлениями от разных пользователей
+        await asyncio.sleep(0)
+    return latencies
+
+
+async def main_async(args):
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "santa.db")
+        async with AsyncDatabase(Database(path)) as db:
+            await db.import_participants(DEFAULT_GAME_ID, [
+                (USER_ID_OFFSET + i, None, f"Участник {USER_ID_OFFSET + i}", "Подарок для участника " * 4)
+                for i in range(args.participants)
+            ])
+            size = os.path.getsize(path) + os.path.getsize(f"{path}-wal")
+            print(f"База: {args.participants} участников, {size // (1024 * 1024)} МБ\n")
+            next_id = iter(range(USER_ID_OFFSET * 10, USER_ID_OFFSET * 20))
+
+            deadline = time.perf_counter() + args.baseline
+            baseline = await write_while(db, next_id, lambda: time.perf_counter() < deadline)
+            describe("без копии", baseline, args.baseline)
+
+            started = time.perf_counter()
+            task = asyncio.ensure_future(backup.backup_now(
+                db_path=path, directory=os.path.join(workdir, "backups"), pages=args.pages, sleep=args.sleep,
+                compress=True,
+            ))
+            during = await write_while(db, next_id, lambda: not task.done())
+            result = await task
+            describe("во время копии", during, time.perf_counter() - started)
+            print(
+                f"\nКопия: {result.size // 1024} КБ (gzip), {result.pages} страниц за {result.steps} шагов, "
+                f"{result.seconds:.2f} с"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--participants", type=int, default=100_000)
+    parser.add_argument("--baseline", type=float, default=2.0, help="сколько секунд писать без копии")
+    parser.add_argument("--pages", type=int, default=backup.BACKUP_PAGES, help="страниц за шаг копирования")
+    parser.add_argument("--sleep", type=float, default=backup.BACKUP_SLEEP, help="пауза между шагами, с")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""Бенчмарк обработчиков bot.py на заранее заполненных базах.
+
+Обработчики вызываются напрямую с настоящими объектами Update и Bot, но
+запросы к Bot API перехватывает заглушка — сеть и токен не нужны. Для
+каждой базы (10, 1k, 10k и 100k участников) измеряются задержка p50/p99,
+число SQL-запросов на вызов и пиковая память Python (tracemalloc).
+
+Запуск из корня репозитория:
+    python benchmarks/bench_handlers.py --output results.json
+    python benchmarks/bench_handlers.py --sizes 10 1000 --compare results.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+ADMIN_ID = 1
+USER_ID_OFFSET = 1_000_000
+
+# Окружение задаётся до импорта bot.py: config.py читает его при импорте,
+# а лимиты рассылки не должны превращать бенчмарк /assign в ожидание
+_WORKDIR = tempfile.mkdtemp(prefix="bench_handlers_")
+os.environ.update({
+    "BOT_TOKEN": "123:fake",
+    "ADMIN_USER_ID": str(ADMIN_ID),
+    "DB_PATH": os.path.join(_WORKDIR, "import.db"),
+    "SEND_RATE": "1000000000",
+    "SEND_PER_CHAT_INTERVAL": "0",
+    # Бенчмарки шлют команды одного пользователя подряд — защита от флуда их бы отбросила
+    "FLOOD_LIMITS": "",
+})
+
+import telegram  # noqa: E402
+from telegram import Update  # noqa: E402
+from telegram.ext import ApplicationBuilder, CallbackContext  # noqa: E402
+from telegram.request import BaseRequest  # noqa: E402
+
+import bot  # noqa: E402
+from cache import CachedDatabase  # noqa: E402
+from database import DEFAULT_GAME_ID, AsyncDatabase, Database  # noqa: E402
+
+SIZES = (10, 1_000, 10_000, 100_000)
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Santa", "username": "fake_santa_bot"}
+
+
+class FakeRequest(BaseRequest):
+    """Заглушка HTTP-слоя Bot API: отвечает на запросы бота без сети."""
+
+    def __init__(self):
+        self.message_ids = itertools.count(1)
+        self.calls = 0
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        self.calls += 1
+        endpoint = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        if endpoint == "getMe":
+            result = BOT_USER
+        elif endpoint in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0))
+            result = {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": BOT_USER,
+                "text": params.get("text", ""),
+            }
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class QueryCounter:
+    """Считает SQL-выражения, выполненные соединением потока базы.
+
+    executemany считается построчно — столько выражений выполняет SQLite.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, statement: str):
+        self.count += 1
+
+
+def seed_database(path: str, size: int):
+    """Создать базу с size участниками игры по умолчанию."""
+    database = Database(path)
+    with database.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO participants (game_id, user_id, username, full_name, wish) VALUES (?, ?, ?, ?, ?)",
+            (
+                (DEFAULT_GAME_ID, user_id, f"user{user_id}", f"Участник {user_id}", f"Подарок для {user_id}")
+                for user_id in range(USER_ID_OFFSET, USER_ID_OFFSET + size)
+            ),
+        )
+    database.close()
+
+
+class Bench:
+    """Обработчики bot.py поверх одной заполненной базы."""
+
+    def __init__(self, application, path: str, size: int, use_cache: bool):
+        self.application = application
+        self.size = size
+        self.database = Database(path)
+        async_db = AsyncDatabase(self.database)
+        self.async_db = async_db
+        bot.db = CachedDatabase(async_db) if use_cache else async_db
+        self.counter = QueryCounter()
+        self.update_ids = itertools.count(1)
+        self.user_ids = itertools.cycle(range(USER_ID_OFFSET, USER_ID_OFFSET + size))
+
+    async def setup(self):
+        await self.async_db.run(
+            lambda: self.database.get_connection().set_trace_callback(self.counter)
+        )
+
+    async def close(self):
+        await self.async_db.close()
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Update:
+        data = {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+            },
+        }
+        return Update.de_json(data, self.application.bot)
+
+    def callback(self, user_id: int, data: str) -> Update:
+        payload = {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": "bench",
+                "data": data,
+                "message": {
+                    "message_id": 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": BOT_USER,
+                    "text": "menu",
+                },
+            },
+        }
+        return Update.de_json(payload, self.application.bot)
+
+    def context(self, update: Update, args=None) -> CallbackContext:
+        context = CallbackContext.from_update(update, self.application)
+        context.args = args or []
+        return context
+
+    # Сценарии: подготовка (не измеряется) и вызов обработчика
+
+    def scenario_start(self):
+        update = self.message(next(self.user_ids), "/start")
+        return bot.start, update, self.context(update)
+
+    def scenario_register_wish(self):
+        user_id = next(self.user_ids)
+        update = self.message(user_id, f"Новый подарок для {user_id}")
+        context = self.context(update)
+        context.user_data.update({"full_name": f"Участник {user_id}", "game_id": DEFAULT_GAME_ID})
+        return bot.register_wish, update, context
+
+    def scenario_status_user(self):
+        update = self.message(next(self.user_ids), "/status")
+        return bot.status, update, self.context(update)
+
+    def scenario_status_admin(self):
+        update = self.message(ADMIN_ID, "/status")
+        return bot.status, update, self.context(update)
+
+    def scenario_status_page(self):
+        # «Вперёд» со страницы, которая заканчивается на очередном участнике
+        update = self.callback(ADMIN_ID, f"stp:{DEFAULT_GAME_ID}:n:{next(self.user_ids)}:")
+        return bot.status_page, update, self.context(update)
+
+    def scenario_export(self):
+        update = self.message(ADMIN_ID, "/export")
+        return bot.export, update, self.context(update)
+
+    def scenario_assign(self):
+        update = self.message(ADMIN_ID, "/assign")
+        return bot.assign, update, self.context(update)
+
+    def scenario_help_button(self):
+        update = self.callback(next(self.user_ids), "help_status")
+        return bot.help_button, update, self.context(update)
+
+    async def before_assign(self):
+        # /assign выполняется один раз за игру — флаг сбрасывается перед каждым замером
+        await bot.db.reset_assignment_flag(DEFAULT_GAME_ID)
+
+
+SCENARIOS = ("start", "register_wish", "status_user", "status_admin", "status_page", "export", "assign",
+             "help_button")
+# Обработчики, которые обходят всех участников: на больших базах их прогоняют реже
+HEAVY = {"status_admin", "export", "assign"}
+
+
+def percentile(values, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def measure(bench: Bench, name: str, repeat: int) -> dict:
+    make = getattr(bench, f"scenario_{name}")
+    before = getattr(bench, f"before_{name}", None)
+    latencies = []
+    queries = 0
+    for _ in range(repeat):
+        if before is not None:
+            await before()
+        handler, update, context = make()
+        bench.counter.count = 0
+        started = time.perf_counter()
+        await handler(update, context)
+        latencies.append(time.perf_counter() - started)
+        queries += bench.counter.count
+
+    # Память — отдельным прогоном: под tracemalloc замеры времени искажаются
+    if before is not None:
+        await before()
+    handler, update, context = make()
+    tracemalloc.start()
+    await handler(update, context)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "repeat": repeat,
+        "p50_ms": round(statistics.median(latencies) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "queries_per_call": round(queries / repeat, 2),
+        "peak_memory_kb": round(peak / 1024, 1),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def print_comparison(results: dict, baseline: dict):
+    """Вывести отношение p50 к результатам другого прогона."""
+    print(f"\nСравнение с {baseline.get('commit', '?')} (p50, текущий / прежний):")
+    for size, handlers in results["sizes"].items():
+        old_handlers = baseline.get("sizes", {}).get(size, {})
+        for name, stats in handlers.items():
+            old = old_handlers.get(name)
+            if old and old["p50_ms"]:
+                ratio = stats["p50_ms"] / old["p50_ms"]
+                mark = "  ⚠️" if ratio > 1.2 else ""
+                print(f"{size:>8} {name:<14} {old['p50_ms']:>10.3f} → {stats['p50_ms']:>10.3f} мс  ×{ratio:.2f}{mark}")
+
+
+async def run(args) -> dict:
+    request = FakeRequest()
+    application = (
+        ApplicationBuilder().token(os.environ["BOT_TOKEN"])
+        .request(request).get_updates_request(FakeRequest())
+        .updater(None).build()
+    )
+    await application.bot.initialize()
+    # Логи обработчиков (seed распределения и т. п.) не нужны в выводе
+    logging.disable(logging.INFO)
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "python_telegram_bot": telegram.__version__,
+        "cache": not args.no_cache,
+        "sizes": {},
+    }
+    # База, созданная при импорте bot.py, не нужна
+    await bot.db.close()
+
+    handlers = args.handlers or SCENARIOS
+    print(f"{'n':>8} | {'handler':<14} | {'p50, мс':>9} | {'p99, мс':>9} | {'запросов':>8} | {'пик, КБ':>9}")
+    print("-" * 72)
+    for size in args.sizes:
+        path = os.path.join(args.db_dir, f"bench_{size}.db")
+        if not os.path.exists(path):
+            seed_database(path, size)
+        bench = Bench(application, path, size, use_cache=not args.no_cache)
+        await bench.setup()
+        size_results = {}
+        for name in handlers:
+            repeat = args.repeat
+            if name in HEAVY and size > 1_000:
+                repeat = max(3, args.repeat * 1_000 // size)
+            stats = await measure(bench, name, repeat)
+            size_results[name] = stats
+            print(
+                f"{size:>8} | {name:<14} | {stats['p50_ms']:>9.3f} | {stats['p99_ms']:>9.3f} | "
+                f"{stats['queries_per_call']:>8} | {stats['peak_memory_kb']:>9.1f}"
+            )
+        results["sizes"][str(size)] = size_results
+        await bench.close()
+
+    results["bot_api_calls"] = request.calls
+    await application.bot.shutdown()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(SIZES))
+    parser.add_argument("--handlers", nargs="+", choices=SCENARIOS, help="какие обработчики измерять")
+    parser.add_argument("--repeat", type=int, default=50, help="вызовов на обработчик")
+    parser.add_argument("--db-dir", default=_WORKDIR, help="где хранить заполненные базы (переиспользуются)")
+    parser.add_argument("--no-cache", action="store_true", help="обращаться к базе без CachedDatabase")
+    parser.add_argument("--output", help="записать результаты в JSON-файл")
+    parser.add_argument("--compare", help="JSON-файл прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\nРезультаты записаны в {args.output}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Время запуска бота: от старта процесса до ответа на первое обновление.
+
+Бот запускается отдельным процессом в режиме webhook против заглушки
+Bot API из tools/fake_telegram.py. Как только бот установил вебхук, ему
+отправляется /start; замеряется время до установки вебхука и до ответа.
+Первый запуск идёт на пустой базе (миграции, публикация меню), следующие —
+на той же базе. Заглушка может добавлять задержку к каждому запросу, чтобы
+изобразить сетевую задержку до api.telegram.org.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_startup.py --boots 3 --api-latency 0.1
+    python benchmarks/bench_startup.py --root /путь/к/другой/версии   # сравнить с другой версией бота
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+from http.server import ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "tools"))
+
+from fake_telegram import FakeBotApi, UpdateFactory, make_handler, post_update  # noqa: E402
+
+SECRET = "secret"
+USER_ID = 1_000_000
+
+
+class SlowBotApi(FakeBotApi):
+    """Заглушка Bot API с задержкой ответа на каждый запрос бота."""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+
+    def handle(self, method: str, params: dict):
+        if self.latency:
+            time.sleep(self.latency)
+        return super().handle(method, params)
+
+
+def post_when_listening(url: str, update: dict, timeout: float):
+    """Отправить обновление, как только сервер вебхука начнёт принимать соединения.
+
+    PTB вызывает setWebhook до запуска HTTP-сервера, поэтому первые
+    попытки могут получить отказ в соединении.
+    """
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            post_update(url, SECRET, update)
+            return
+        except urllib.error.URLError:
+            if time.perf_counter() > deadline:
+                raise
+            time.sleep(0.005)
+
+
+def boot(api: SlowBotApi, args, env: dict, factory: UpdateFactory) -> dict:
+    """Запустить бота, дождаться ответа на /start и остановить его."""
+    api.webhook_ready.clear()
+    api.calls.clear()
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "bot.py"], cwd=args.root, env=env,
+        stdout=subprocess.DEVNULL if not args.verbose else None, stderr=subprocess.STDOUT,
+    )
+    try:
+        if not api.webhook_ready.wait(args.timeout):
+            raise TimeoutError("Бот не установил вебхук")
+        webhook = time.perf_counter() - started
+        replied = api.wait_for_reply(USER_ID)
+        post_when_listening(api.webhook_url, factory.text(USER_ID, "/start"), args.timeout)
+        if not replied.wait(args.timeout):
+            raise TimeoutError("Бот не ответил на /start")
+        first_reply = time.perf_counter() - started
+        # Фоновая публикация меню администраторов успевает завершиться
+        time.sleep(args.settle)
+        calls = dict(api.calls)
+    finally:
+        process.terminate()
+        process.wait(30)
+    return {"webhook": webhook, "first_reply": first_reply, "set_my_commands": calls.get("setMyCommands", 0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--boots", type=int, default=3, help="сколько раз запустить бота на одной базе")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Bot API, с")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--webhook-port", type=int, default=8443)
+    parser.add_argument("--root", default=ROOT, help="каталог с bot.py")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--settle", type=float, default=1.0, help="пауза после ответа перед остановкой, с")
+    parser.add_argument("--verbose", action="store_true", help="показывать лог бота")
+    args = parser.parse_args()
+
+    api = SlowBotApi(args.api_latency)
+    server = ThreadingHTTPServer(("127.0.0.1", args.api_port), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    factory = UpdateFactory()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(
+        os.environ,
+        BOT_TOKEN="123:fake",
+        ADMIN_USER_ID="1",
+        DB_PATH=os.path.join(workdir, "startup.db"),
+        STORAGE_BACKEND="sqlite",
+        BOT_API_BASE_URL=f"http://127.0.0.1:{args.api_port}/bot",
+        UPDATE_MODE="webhook",
+        WEBHOOK_URL=f"http://127.0.0.1:{args.webhook_port}",
+        WEBHOOK_PORT=str(args.webhook_port),
+        WEBHOOK_SECRET=SECRET,
+        METRICS_PORT="0",
+    )
+
+    print(f"Задержка Bot API: {args.api_latency * 1000:.0f} мс\n")
+    print(f"{'запуск':<8} | {'вебхук, с':>9} | {'первый ответ, с':>15} | {'setMyCommands':>13}")
+    print("-" * 55)
+    results = []
+    for number in range(1, args.boots + 1):
+        result = boot(api, args, env, factory)
+        results.append(result)
+        label = "пустая" if number == 1 else str(number)
+        print(f"{label:<8} | {result['webhook']:>9.3f} | {result['first_reply']:>15.3f} | "
+              f"{result['set_my_commands']:>13}")
+    if len(results) > 1:
+        repeated = [result["first_reply"] for result in results[1:]]
+        print(f"\nПовторные запуски: первый ответ, медиана {statistics.median(repeated):.3f} с")
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
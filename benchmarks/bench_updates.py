@@ -0,0 +1,187 @@
+"""Параллельная обработка обновлений: порядок шагов и задержка лёгких команд.
+
+Приложение собирается из bot.build_application со всеми обработчиками,
+обновления кладутся в update_queue разом. Пользователи одновременно
+проходят регистрацию (/register → ФИО → подарок) и шлют /start, а
+администратор параллельно запускает тяжёлые /export на заполненной
+базе. Запросы к Bot API перехватывает заглушка.
+
+Обработчик в группе -2 с небольшой случайной задержкой записывает порядок,
+в котором обработка дошла до обновлений каждого (чат, пользователь), —
+без сериализации по пользователю шаги перемешиваются. Прогоняются три
+режима:
+    sequential — обработка по одному обновлению (как без concurrent_updates)
+    unordered  — параллельно без очередей по пользователю (SimpleUpdateProcessor)
+    ordered    — OrderedUpdateProcessor из update_processor.py
+
+Для ordered нарушений порядка быть не должно, а все регистрации должны
+завершиться с верными данными; порядок обработки OrderedUpdateProcessor
+проверяет tests/test_update_processor.py.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_updates.py
+    python benchmarks/bench_updates.py --users 500 --size 100000 --modes ordered
+"""
+import argparse
+import asyncio
+import collections
+import logging
+import os
+import random
+import statistics
+import time
+
+# bench_handlers задаёт окружение и путь к корню репозитория до импорта bot.py
+from bench_handlers import ADMIN_ID, FakeRequest, percentile, seed_database
+
+import bot
+from cache import CachedDatabase
+from database import DEFAULT_GAME_ID, AsyncDatabase, Database
+from telegram import Update
+from telegram.ext import SimpleUpdateProcessor, TypeHandler
+from update_processor import HEAVY_UPDATE_CONCURRENCY, UPDATE_CONCURRENCY, OrderedUpdateProcessor
+
+MODES = ("sequential", "unordered", "ordered")
+USER_ID_OFFSET = 5_000_000
+
+
+def make_processor(mode: str):
+    if mode == "sequential":
+        return SimpleUpdateProcessor(1)
+    if mode == "unordered":
+        return SimpleUpdateProcessor(UPDATE_CONCURRENCY + HEAVY_UPDATE_CONCURRENCY)
+    return OrderedUpdateProcessor(bot.HEAVY_COMMANDS)
+
+
+def message(update_id: int, user_id: int, text: str) -> dict:
+    data = {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "text": text,
+        },
+    }
+    if text.startswith("/"):
+        # CommandHandler распознаёт команду по сущности bot_command
+        data["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return data
+
+
+def make_updates(users: int, heavy: int, burst: int = 8) -> list:
+    """Шаги регистрации и /start небольших групп пользователей вперемешку.
+
+    Шаги одного пользователя идут через burst обновлений — они попадают
+    в обработку одновременно. Тяжёлые команды распределены равномерно.
+    """
+    user_ids = list(range(USER_ID_OFFSET, USER_ID_OFFSET + users))
+    steps = ("/register", "Участник номер {}", "Подарок для {}", "/start")
+    payloads = []
+    for first in range(0, users, burst):
+        for step in steps:
+            payloads.extend((user_id, step.format(user_id)) for user_id in user_ids[first:first + burst])
+    spacing = len(payloads) // (heavy + 1)
+    for i in range(heavy, 0, -1):
+        payloads.insert(i * spacing, (ADMIN_ID, "/export"))
+    return [message(update_id, user_id, text) for update_id, (user_id, text) in enumerate(payloads, 1)]
+
+
+async def run_mode(mode: str, args, path: str) -> dict:
+    database = Database(path)
+    async_db = AsyncDatabase(database)
+    bot.db = CachedDatabase(async_db)
+    application = bot.build_application(make_processor(mode), FakeRequest())
+    heavy_commands = {f"/{command}" for command in bot.HEAVY_COMMANDS}
+
+    seen = collections.defaultdict(list)
+    received = {}
+    latencies = {"light": [], "heavy": []}
+    rng = random.Random(args.seed)
+
+    async def record_start(update: Update, context):
+        # Небольшая задержка перемешивает одновременные обработки
+        await asyncio.sleep(rng.random() * args.jitter)
+        seen[(update.effective_chat.id, update.effective_user.id)].append(update.update_id)
+
+    async def record_end(update: Update, context):
+        kind = "heavy" if update.message.text.split()[0] in heavy_commands else "light"
+        latencies[kind].append(time.perf_counter() - received[update.update_id])
+
+    application.add_handler(TypeHandler(Update, record_start), group=-2)
+    application.add_handler(TypeHandler(Update, record_end), group=2)
+
+    updates = [Update.de_json(data, application.bot) for data in make_updates(args.users, args.heavy)]
+    await application.initialize()
+    await application.start()
+    started = time.perf_counter()
+    for update in updates:
+        received[update.update_id] = time.perf_counter()
+        await application.update_queue.put(update)
+    await application.update_queue.join()
+    total = time.perf_counter() - started
+    await application.stop()
+    await application.shutdown()
+
+    violations = sum(1 for ids in seen.values() if ids != sorted(ids))
+    registered = 0
+    for user_id in range(USER_ID_OFFSET, USER_ID_OFFSET + args.users):
+        participant = await async_db.get_participant(DEFAULT_GAME_ID, user_id)
+        if participant and participant.full_name == f"Участник номер {user_id}" \
+                and participant.wish == f"Подарок для {user_id}":
+            registered += 1
+    await async_db.close()
+
+    def stats(values):
+        return (round(statistics.median(values) * 1000, 1), round(percentile(values, 0.99) * 1000, 1))
+
+    return {
+        "total_s": round(total, 2),
+        "light": stats(latencies["light"]),
+        "heavy": stats(latencies["heavy"]),
+        "violations": violations,
+        "registered": registered,
+    }
+
+
+async def main_async(args):
+    # Логи обработчиков не нужны в выводе
+    logging.disable(logging.INFO)
+    # База, созданная при импорте bot.py, не нужна
+    await bot.db.close()
+
+    print(f"{args.users} пользователей, {args.heavy} тяжёлых команд, база {args.size} участников, "
+          f"UPDATE_CONCURRENCY={UPDATE_CONCURRENCY}, HEAVY_UPDATE_CONCURRENCY={HEAVY_UPDATE_CONCURRENCY}\n")
+    print(f"{'режим':<11} | {'всего, с':>8} | {'лёгкие p50/p99, мс':>19} | {'тяжёлые p50/p99, мс':>20} | "
+          f"{'нарушений порядка':>17} | {'регистраций':>11}")
+    print("-" * 104)
+    for mode in args.modes:
+        path = os.path.join(args.db_dir, f"updates_{mode}.db")
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        seed_database(path, args.size)
+        result = await run_mode(mode, args, path)
+        print(
+            f"{mode:<11} | {result['total_s']:>8} | {'%s / %s' % result['light']:>19} | "
+            f"{'%s / %s' % result['heavy']:>20} | {result['violations']:>17} | "
+            f"{result['registered']:>5} из {args.users}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="сколько пользователей регистрируются одновременно")
+    parser.add_argument("--heavy", type=int, default=8, help="сколько тяжёлых команд администратора")
+    parser.add_argument("--size", type=int, default=10_000, help="участников в заполненной базе")
+    parser.add_argument("--jitter", type=float, default=0.005, help="случайная задержка перед обработкой, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--db-dir", default=os.path.dirname(os.environ["DB_PATH"]),
+                        help="каталог для баз (по умолчанию временный)")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
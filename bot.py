@@ -1,31 +1,76 @@
 """Telegram-бот для игры 'Тайный Санта'."""
-import random
+import asyncio
+import functools
 import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
+import os
+import time
+from typing import Dict, List, Optional
+from telegram import Chat, Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ChatMemberStatus
+from telegram.error import BadRequest
+from telegram.request import BaseRequest
 from telegram.ext import (
     Application,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     filters,
     ContextTypes,
     CallbackQueryHandler,
+    TypeHandler,
 )
-from config import BOT_TOKEN, ADMIN_USER_ID
-from database import Database
+import config
+from config import (
+    BOT_TOKEN,
+    ADMIN_USER_ID,
+    BOT_API_BASE_URL,
+    UPDATE_MODE,
+    WEBHOOK_URL,
+    WEBHOOK_LISTEN,
+    WEBHOOK_PORT,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    METRICS_HOST,
+    METRICS_PORT,
+    STATUS_PAGE_SIZE,
+    STATUS_NAME_LIMIT,
+)
+from assignment import ASSIGNMENT_MODE, make_assignments, new_seed
+from cache import CachedDatabase
+from database import BROADCAST_AUDIENCES, DEFAULT_GAME_ID
+import backup
+import broadcast
+import exporter
+import importer
+import menu
+import metrics
+import outbox
+from flood import FloodGuard
+from notifier import SEND_RATE, Notifier, SharedTokenBucket, shared_notifier
+from persistence import StoragePersistence
+from storage import create_storage
+from update_processor import HEAVY_COMMANDS, OrderedUpdateProcessor
+from validation import FULL_NAME_MIN_LENGTH, WISH_MIN_LENGTH, full_name_error, wish_error
 
 # Настройка логирования
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
     level=logging.INFO
 )
+# Каждая порция /broadcast — отдельная задача планировщика, их запуск не нужен в логе
+logging.getLogger("apscheduler").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+# Отсчёт времени запуска (после импорта библиотек): этапы старта — в startup_timings
+STARTED_AT = time.monotonic()
+startup_timings: Dict[str, float] = {}
+
 # Состояния для ConversationHandler
 FULL_NAME, WISH = range(2)
 
-# Инициализация базы данных
-db = Database()
+# Инициализация хранилища (SQLite или PostgreSQL, см. STORAGE_BACKEND)
+db = CachedDatabase(create_storage())
 
 # Описание активности
 ABOUT_TEXT = """Тсс… Санта уже в пути! 🎅
@@ -37,22 +82,81 @@ ABOUT_TEXT = """Тсс… Санта уже в пути! 🎅
 Подарок — от 1500 ₽. Главное — дарить с душой!"""
 
 
+def is_group_chat(update: Update) -> bool:
+    """Пришло ли обновление из группового чата."""
+    return update.effective_chat.type in (Chat.GROUP, Chat.SUPERGROUP)
+
+
+async def get_game_id(update: Update) -> int:
+    """Определить игру обновления: в группе — игра этой группы, в личке — выбранная пользователем."""
+    if is_group_chat(update):
+        return update.effective_chat.id
+    return await db.get_user_game(update.effective_user.id)
+
+
+async def resolve_game(update: Update) -> Optional[dict]:
+    """Получить игру обновления. Если в группе игры нет — подсказать, как её создать."""
+    game = await db.get_game(await get_game_id(update))
+    if game is None:
+        text = (
+            "В этом чате ещё нет игры «Тайный Санта».\n"
+            "Администратор группы может создать её командой /newgame"
+        )
+        if update.callback_query:
+            await update.callback_query.edit_message_text(text)
+        else:
+            await update.effective_message.reply_text(text)
+    return game
+
+
+async def has_admin_rights(game_id: int, user_id: int) -> bool:
+    """Администратор бота управляет всеми играми, администратор игры — своей."""
+    return user_id == ADMIN_USER_ID or await db.is_game_admin(game_id, user_id)
+
+
+def game_link(bot_username: str, game_id: int) -> str:
+    """Ссылка, по которой участник выбирает игру в личном чате с ботом."""
+    return f"https://t.me/{bot_username}?start=g{game_id}"
+
+
+def parse_game_payload(payload: str) -> Optional[int]:
+    """Разобрать параметр /start вида g<game_id>."""
+    if not payload.startswith("g"):
+        return None
+    try:
+        return int(payload[1:])
+    except ValueError:
+        return None
+
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /start."""
+    """Обработчик команды /start (в том числе по ссылке-приглашению в игру)."""
     user = update.effective_user
     
-    if db.is_registered(user.id):
-        participant = db.get_participant(user.id)
+    # /start g<game_id> — выбрать игру по ссылке-приглашению
+    if context.args and not is_group_chat(update):
+        invited_game_id = parse_game_payload(context.args[0])
+        if invited_game_id is not None and await db.get_game(invited_game_id):
+            await db.set_user_game(user.id, invited_game_id)
+    
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
+    
+    if await db.is_registered(game_id, user.id):
+        participant = await db.get_participant(game_id, user.id)
         await update.message.reply_text(
-            f"Привет, {participant['full_name']}! 👋\n\n"
-            "Ты уже зарегистрирован в игре «Тайный Санта».\n\n"
-            f"Твоё имя: {participant['full_name']}\n"
-            f"Твой желаемый подарок: {participant['wish']}\n\n"
+            f"Привет, {participant.full_name}! 👋\n\n"
+            f"Ты уже зарегистрирован в игре «{game['title']}».\n\n"
+            f"Твоё имя: {participant.full_name}\n"
+            f"Твой желаемый подарок: {participant.wish}\n\n"
             "Если хочешь обновить данные, начни регистрацию заново командой /register"
         )
     else:
+        game_header = f"🎄 Игра: {game['title']}\n\n" if game_id != DEFAULT_GAME_ID else ""
         await update.message.reply_text(
-            f"{ABOUT_TEXT}\n\n"
+            f"{game_header}{ABOUT_TEXT}\n\n"
             "Для участия в игре нужно зарегистрироваться.\n"
             "Введи команду /register чтобы начать регистрацию."
         )
@@ -63,11 +167,105 @@ async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(ABOUT_TEXT)
 
 
+async def new_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Создать игру для группового чата: /newgame [название]."""
+    user = update.effective_user
+    chat = update.effective_chat
+    
+    if not is_group_chat(update):
+        await update.message.reply_text(
+            "Новую игру можно создать в групповом чате: добавь бота в группу "
+            "и отправь там /newgame"
+        )
+        return
+    
+    # Создать игру может администратор группы
+    if user.id != ADMIN_USER_ID:
+        member = await context.bot.get_chat_member(chat.id, user.id)
+        if member.status not in (ChatMemberStatus.ADMINISTRATOR, ChatMemberStatus.OWNER):
+            await update.message.reply_text("❌ Создать игру может только администратор группы.")
+            return
+    
+    title = " ".join(context.args) if context.args else (chat.title or "Тайный Санта")
+    link = game_link(context.bot.username, chat.id)
+    
+    if not await db.create_game(chat.id, title, user.id):
+        await update.message.reply_text(
+            f"⚠️ В этой группе игра уже создана.\n\nСсылка для участников:\n{link}"
+        )
+        return
+    
+    await update.message.reply_text(
+        f"🎄 Игра «{title}» создана!\n\n"
+        f"Чтобы участвовать, перейдите по ссылке и зарегистрируйтесь в личке с ботом:\n{link}"
+    )
+    await menu.publish_admin_menu(context.bot, user.id)
+
+
+async def game_info(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показать текущую игру и ссылку-приглашение."""
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
+    
+    participant_count = await db.get_participant_count(game_id)
+    await update.message.reply_text(
+        f"🎄 Игра: {game['title']}\n"
+        f"Участников: {participant_count}\n\n"
+        f"Ссылка для участников:\n{game_link(context.bot.username, game_id)}"
+    )
+
+
+async def add_admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Административная команда: /addadmin <user_id> — назначить администратора игры."""
+    user = update.effective_user
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
+    
+    # Проверка прав администратора
+    if not await has_admin_rights(game_id, user.id):
+        await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
+        return
+    
+    # Можно указать ID или ответить командой на сообщение пользователя
+    reply = update.message.reply_to_message
+    if reply and reply.from_user:
+        new_admin_id = reply.from_user.id
+    elif context.args and context.args[0].lstrip("-").isdigit():
+        new_admin_id = int(context.args[0])
+    else:
+        await update.message.reply_text(
+            "Использование: /addadmin <user_id> или ответь этой командой на сообщение пользователя"
+        )
+        return
+    
+    await db.add_game_admin(game_id, new_admin_id)
+    await update.message.reply_text(f"✅ Пользователь {new_admin_id} теперь администратор игры «{game['title']}».")
+    await menu.publish_admin_menu(context.bot, new_admin_id)
+
+
 async def register_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начать процесс регистрации."""
     user = update.effective_user
+    game = await resolve_game(update)
+    if game is None:
+        return ConversationHandler.END
+    game_id = game["game_id"]
     
-    if db.is_registered(user.id):
+    # Пожелания не должны быть видны всей группе — регистрация только в личке
+    if is_group_chat(update):
+        await update.message.reply_text(
+            "Регистрация проходит в личных сообщениях с ботом:\n"
+            f"{game_link(context.bot.username, game_id)}"
+        )
+        return ConversationHandler.END
+    
+    context.user_data["game_id"] = game_id
+    
+    if await db.is_registered(game_id, user.id):
         await update.message.reply_text(
             "Ты уже зарегистрирован! Если хочешь обновить данные, "
             "продолжай — твои данные будут обновлены.\n\n"
@@ -86,9 +284,9 @@ async def register_full_name(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """Получить ФИО и запросить желаемый подарок."""
     full_name = update.message.text.strip()
     
-    if len(full_name) < 3:
+    if full_name_error(full_name):
         await update.message.reply_text(
-            "ФИО слишком короткое. Пожалуйста, введи полное имя (минимум 3 символа):"
+            f"ФИО слишком короткое. Пожалуйста, введи полное имя (минимум {FULL_NAME_MIN_LENGTH} символа):"
         )
         return FULL_NAME
     
@@ -104,17 +302,22 @@ async def register_wish(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получить желаемый подарок и завершить регистрацию."""
     wish = update.message.text.strip()
     
-    if len(wish) < 5:
+    if wish_error(wish):
         await update.message.reply_text(
-            "Описание подарка слишком короткое. Пожалуйста, опиши подробнее (минимум 5 символов):"
+            f"Описание подарка слишком короткое. Пожалуйста, опиши подробнее (минимум {WISH_MIN_LENGTH} символов):"
         )
         return WISH
     
     user = update.effective_user
     full_name = context.user_data.get("full_name")
+    # Игра, в которой регистрация была начата
+    game_id = context.user_data.get("game_id")
+    if game_id is None:
+        game_id = await get_game_id(update)
     
     # Сохранить в базу данных
-    db.register_participant(
+    await db.register_participant(
+        game_id=game_id,
         user_id=user.id,
         username=user.username or "",
         full_name=full_name,
@@ -143,130 +346,102 @@ async def register_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def assign(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Административная команда для распределения участников."""
     user = update.effective_user
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
     
     # Проверка прав администратора
-    if user.id != ADMIN_USER_ID:
+    if not await has_admin_rights(game_id, user.id):
         await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
         return
     
-    # Проверка, выполнено ли уже распределение
-    if db.is_assignment_done():
-        await update.message.reply_text(
-            "⚠️ Распределение уже выполнено. Повторное распределение невозможно."
-        )
-        return
-    
-    # Проверка количества участников
-    participant_count = db.get_participant_count()
-    if participant_count < 2:
-        await update.message.reply_text(
-            f"❌ Недостаточно участников для распределения. "
-            f"Сейчас зарегистрировано: {participant_count}. Нужно минимум 2."
-        )
-        return
-    
-    # Получить всех участников
-    participants = db.get_all_participants()
-    user_ids = [p["user_id"] for p in participants]
-    
-    # Генерация случайного распределения без самоподарков
-    # Используем алгоритм, который гарантирует отсутствие самоподарков
-    assignments = []
-    max_attempts = 100
-    
-    for attempt in range(max_attempts):
-        receivers = user_ids.copy()
-        random.shuffle(receivers)
-        assignments = []
-        valid = True
+    # Два администратора не запустят распределение одновременно (с PostgreSQL — и на разных репликах)
+    async with db.try_lock(f"assign:{game_id}") as acquired:
+        if not acquired:
+            await update.message.reply_text("⏳ Распределение уже выполняется другим администратором.")
+            return
         
-        for i, giver_id in enumerate(user_ids):
-            receiver_id = receivers[i]
-            if giver_id == receiver_id:
-                valid = False
-                break
-            assignments.append((giver_id, receiver_id))
+        # Проверка, выполнено ли уже распределение
+        if await db.is_assignment_done(game_id):
+            await update.message.reply_text(
+                "⚠️ Распределение уже выполнено. Повторное распределение невозможно."
+            )
+            return
         
-        if valid:
-            break
-    
-    # Если не удалось найти валидное распределение за max_attempts попыток,
-    # используем детерминированный алгоритм
-    if not valid or len(assignments) != len(user_ids):
-        assignments = []
-        receivers = user_ids.copy()
-        # Сдвигаем список на 1 позицию
-        receivers = receivers[1:] + receivers[:1]
-        for i, giver_id in enumerate(user_ids):
-            assignments.append((giver_id, receivers[i]))
-    
-    # Сохранить распределения
-    db.save_assignments(assignments)
-    db.mark_assignment_done()
-    
-    # Отправить сообщения участникам
-    sent_count = 0
-    failed_count = 0
-    
-    for giver_id, receiver_id in assignments:
-        receiver = next(p for p in participants if p["user_id"] == receiver_id)
+        # Проверка количества участников
+        participant_count = await db.get_participant_count(game_id)
+        if participant_count < 2:
+            await update.message.reply_text(
+                f"❌ Недостаточно участников для распределения. "
+                f"Сейчас зарегистрировано: {participant_count}. Нужно минимум 2."
+            )
+            return
         
-        try:
-            await context.bot.send_message(
-                chat_id=giver_id,
-                text=f"🎁 Ты — Тайный Санта для: {receiver['full_name']}\n\n"
-                     f"Он(а) хочет: {receiver['wish']}\n\n"
-                     f"Удачи! 🎁"
+        # Распределению нужны только ID: они читаются из индекса, без строк участников
+        user_ids = await db.get_participant_ids(game_id)
+        
+        # Генерация случайного распределения без самоподарков за O(n).
+        # Seed пишется в лог, чтобы распределение можно было воспроизвести при проверке.
+        seed = new_seed()
+        assignments = make_assignments(user_ids, seed=seed)
+        logger.info(f"Распределение: режим {ASSIGNMENT_MODE}, участников {len(user_ids)}, seed {seed}")
+        
+        # Пары и флаг сохраняются одной транзакцией; флаг проверяется ещё раз
+        # под блокировкой записи — на случай второго процесса с той же базой
+        if not await db.commit_assignment_round(game_id, assignments):
+            await update.message.reply_text(
+                "⚠️ Распределение уже выполнено. Повторное распределение невозможно."
             )
-            sent_count += 1
-        except Exception as e:
-            logger.error(f"Не удалось отправить сообщение пользователю {giver_id}: {e}")
-            failed_count += 1
+            return
     
-    await update.message.reply_text(
-        f"✅ Распределение выполнено!\n\n"
-        f"Участников: {participant_count}\n"
-        f"Сообщений отправлено: {sent_count}\n"
-        f"Ошибок: {failed_count}"
-    )
+    # Уведомления уже записаны в outbox вместе с парами. Их отправит воркер
+    # очереди — и после перезапуска бота, если рассылка не успеет закончиться
+    status_message = await update.message.reply_text(outbox.PROGRESS_TITLE)
+    worker = context.bot_data.get("outbox")
+    if worker is not None:
+        worker.watch(game_id, status_message)
+        context.job_queue.run_once(worker, 0, name="outbox:assign")
 
 
 async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать статус игры."""
     user = update.effective_user
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
     
-    participant_count = db.get_participant_count()
-    is_assigned = db.is_assignment_done()
-    
-    if user.id == ADMIN_USER_ID:
-        status_text = (
-            f"📊 Статус игры:\n\n"
-            f"Зарегистрировано участников: {participant_count}\n"
-            f"Распределение выполнено: {'Да' if is_assigned else 'Нет'}\n\n"
-        )
-        
-        if participant_count > 0:
-            participants = db.get_all_participants()
-            status_text += "Участники:\n"
-            for p in participants:
-                status_text += f"• {p['full_name']}\n"
-        
-        await update.message.reply_text(status_text)
+    if await has_admin_rights(game_id, user.id):
+        # /status текст — поиск участников по имени; /status без текста его сбрасывает
+        search = " ".join(context.args or ()).strip() or None
+        # Ключ — строка: user_data сохраняется в JSON, где ключи словарей только строки
+        # Запись создаётся только при сохранении поиска, чтобы /status без текста не
+        # добавлял пустой словарь в user_data каждого администратора
+        if search:
+            context.user_data.setdefault("status_search", {})[str(game_id)] = search
+        elif str(game_id) in context.user_data.get("status_search", {}):
+            searches = context.user_data["status_search"]
+            del searches[str(game_id)]
+            if not searches:
+                del context.user_data["status_search"]
+        text, reply_markup = await render_status(game_id, None, False, search)
+        await update.message.reply_text(text, reply_markup=reply_markup)
     else:
-        if db.is_registered(user.id):
-            participant = db.get_participant(user.id)
-            assignment = db.get_assignment(user.id)
+        if await db.is_registered(game_id, user.id):
+            participant = await db.get_participant(game_id, user.id)
+            assignment = await db.get_assignment(game_id, user.id)
             
             status_text = (
                 f"Твоя регистрация:\n"
-                f"Имя: {participant['full_name']}\n"
-                f"Желаемый подарок: {participant['wish']}\n\n"
+                f"Имя: {participant.full_name}\n"
+                f"Желаемый подарок: {participant.wish}\n\n"
             )
             
             if assignment:
                 status_text += (
-                    f"🎁 Ты даришь подарок: {assignment['full_name']}\n"
-                    f"Он(а) хочет: {assignment['wish']}"
+                    f"🎁 Ты даришь подарок: {assignment.receiver_name}\n"
+                    f"Он(а) хочет: {assignment.receiver_wish}"
                 )
             else:
                 status_text += "Распределение ещё не выполнено."
@@ -278,70 +453,312 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
 
 
+def short_name(name: str) -> str:
+    """Имя для списка участников, обрезанное до STATUS_NAME_LIMIT символов."""
+    name = " ".join(name.split())
+    return name if len(name) <= STATUS_NAME_LIMIT else name[:STATUS_NAME_LIMIT - 1] + "…"
+
+
+async def render_status_page(game_id: int, anchor_id: Optional[int], backward: bool, search: Optional[str]):
+    """Страница списка участников: (строки, кнопки). None — опорного участника уже нет."""
+    rows = await db.get_participants_page(game_id, anchor_id, backward, STATUS_PAGE_SIZE, search)
+    more = len(rows) > STATUS_PAGE_SIZE
+    if backward:
+        rows = rows[-STATUS_PAGE_SIZE:]
+        has_prev, has_next = more, True
+    else:
+        rows = rows[:STATUS_PAGE_SIZE]
+        has_prev, has_next = anchor_id is not None, more
+    if anchor_id is not None and not rows:
+        return None
+    
+    lines = "".join(f"• {short_name(p.full_name)}\n" for p in rows)
+    flag = "s" if search else ""
+    buttons = []
+    if has_prev:
+        buttons.append(InlineKeyboardButton("◀️ Назад", callback_data=f"stp:{game_id}:p:{rows[0].user_id}:{flag}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("Вперёд ▶️", callback_data=f"stp:{game_id}:n:{rows[-1].user_id}:{flag}"))
+    return lines, InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+async def render_status(game_id: int, anchor_id: Optional[int], backward: bool, search: Optional[str]):
+    """Текст и кнопки административного /status; страницы кэшируются до изменения участников."""
+    page = await db.get_rendered_page(
+        (game_id, anchor_id, backward, search),
+        lambda: render_status_page(game_id, anchor_id, backward, search),
+    )
+    if page is None:
+        # Участник, с которого начиналась страница, удалён — показать начало списка
+        page = await db.get_rendered_page(
+            (game_id, None, False, search),
+            lambda: render_status_page(game_id, None, False, search),
+        )
+    lines, reply_markup = page
+    
+    participant_count = await db.get_participant_count(game_id)
+    is_assigned = await db.is_assignment_done(game_id)
+    text = (
+        f"📊 Статус игры:\n\n"
+        f"Зарегистрировано участников: {participant_count}\n"
+        f"Распределение выполнено: {'Да' if is_assigned else 'Нет'}\n\n"
+    )
+    if search:
+        text += f"Участники, имя содержит «{short_name(search)}»:\n" + (lines or "никого не найдено\n")
+    elif lines:
+        text += "Участники:\n" + lines
+    return text, reply_markup
+
+
+async def status_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки листания списка участников в /status."""
+    query = update.callback_query
+    _, game_id, direction, anchor_id, flag = query.data.split(":")
+    game_id = int(game_id)
+    
+    if not await has_admin_rights(game_id, query.from_user.id):
+        await query.answer("❌ Нет прав", show_alert=True)
+        return
+    
+    search = context.user_data.get("status_search", {}).get(str(game_id))
+    if bool(flag) != bool(search):
+        await query.answer("Список устарел, повтори /status", show_alert=True)
+        return
+    await query.answer()
+    
+    text, reply_markup = await render_status(game_id, int(anchor_id), direction == "p", search)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest as e:
+        # Повторное нажатие на ту же страницу: сообщение не изменилось
+        if "not modified" not in str(e).lower():
+            raise
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Административная команда: счётчики игры и регистрации по часам."""
+    user = update.effective_user
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
+    
+    if not await has_admin_rights(game_id, user.id):
+        await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
+        return
+    
+    game_stats = await db.get_stats(game_id)
+    assigned, notified = game_stats["assigned"], game_stats["notified"]
+    text = (
+        f"📈 Статистика игры «{game['title']}»:\n\n"
+        f"Участников: {game_stats['participants']}\n"
+        f"Назначений: {assigned}\n"
+        f"Уведомлено: {notified}"
+        + (f" ({notified / assigned:.0%})" if assigned else "")
+        + "\n"
+    )
+    if assigned:
+        queue = await db.get_outbox_stats(game_id)
+        if queue["pending"] or queue["sending"]:
+            text += f"Уведомлений в очереди: {queue['pending'] + queue['sending']}\n"
+        if queue["failed"]:
+            text += f"Не доставлено: {queue['failed']} (повторить — /resend)\n"
+    if game_stats["hours"]:
+        peak = max(count for _, count in game_stats["hours"])
+        text += "\nРегистрации по часам (UTC):\n"
+        for hour, count in game_stats["hours"]:
+            text += f"{hour[5:]} {'▇' * max(1, round(count / peak * 12))} {count}\n"
+    await update.message.reply_text(text)
+
+
+async def resend(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Административная команда: вернуть в очередь неотправленные уведомления о назначении."""
+    user = update.effective_user
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
+    
+    if not await has_admin_rights(game_id, user.id):
+        await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
+        return
+    
+    requeued = await db.requeue_failed_outbox(game_id)
+    stats = await db.get_outbox_stats(game_id)
+    if not requeued:
+        await update.message.reply_text(
+            "✅ Неотправленных уведомлений нет.\n\n"
+            f"Отправлено: {stats['sent']}, в очереди: {stats['pending'] + stats['sending']}"
+        )
+        return
+    
+    status_message = await update.message.reply_text(
+        f"🔁 Повторно отправляю уведомлений: {requeued}\n\n"
+        "Если бот упал во время рассылки, часть из них могла дойти — такие участники получат уведомление ещё раз."
+    )
+    worker = context.bot_data.get("outbox")
+    if worker is not None:
+        worker.watch(game_id, status_message)
+        context.job_queue.run_once(worker, 0, name="outbox:resend")
+
+
 async def export(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Административная команда для выгрузки таблицы участников."""
+    """Административная команда для выгрузки таблицы участников.
+
+    /export — текстом для небольших игр, иначе CSV-файлом;
+    /export csv | xlsx | text — выбрать формат явно.
+    """
     user = update.effective_user
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
     
     # Проверка прав администратора
-    if user.id != ADMIN_USER_ID:
+    if not await has_admin_rights(game_id, user.id):
         await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
         return
     
-    participants = db.get_all_participants()
+    # В выгрузке есть пары дарителей — в группе её увидели бы все
+    if is_group_chat(update):
+        await update.message.reply_text(
+            "Выгрузка доступна только в личных сообщениях с ботом:\n"
+            f"{game_link(context.bot.username, game_id)}"
+        )
+        return
+    
+    export_format = context.args[0].lower() if context.args else None
+    if export_format is not None and export_format not in exporter.FORMATS:
+        await update.message.reply_text(
+            "❌ Неизвестный формат. Используй: /export, /export csv, /export xlsx или /export text"
+        )
+        return
     
-    if not participants:
+    participant_count = await db.get_participant_count(game_id)
+    if not participant_count:
         await update.message.reply_text("❌ Нет зарегистрированных участников.")
         return
     
-    # Формируем таблицу
-    table_text = "📋 ВЫГРУЗКА УЧАСТНИКОВ\n\n"
-    table_text += "┌" + "─" * 58 + "┐\n"
-    table_text += f"│ {'№':<3} │ {'ФИО':<25} │ {'Желаемый подарок':<25} │\n"
-    table_text += "├" + "─" * 58 + "┤\n"
+    if export_format is None:
+        export_format = (
+            exporter.FORMAT_TEXT if participant_count <= exporter.EXPORT_TEXT_MAX_ROWS else exporter.FORMAT_CSV
+        )
+    if export_format == exporter.FORMAT_XLSX and not exporter.xlsx_available():
+        await update.message.reply_text("⚠️ XLSX недоступен на сервере, отправляю CSV.")
+        export_format = exporter.FORMAT_CSV
     
-    for idx, p in enumerate(participants, 1):
-        full_name = p['full_name'][:24] if len(p['full_name']) > 24 else p['full_name']
-        wish = p['wish'][:24] if len(p['wish']) > 24 else p['wish']
-        table_text += f"│ {idx:<3} │ {full_name:<25} │ {wish:<25} │\n"
+    if export_format == exporter.FORMAT_TEXT:
+        # Участники вместе с получателями — одним запросом
+        rows = await db.get_export_rows(game_id)
+        for message in exporter.split_pre_messages(exporter.build_text_lines(rows)):
+            await update.message.reply_text(message, parse_mode="HTML")
+        return
     
-    table_text += "└" + "─" * 58 + "┘\n"
-    table_text += f"\n📊 Всего участников: {len(participants)}\n"
+    # Строки читаются порциями и сразу пишутся в файл, не собираясь в список
+    document = exporter.builder(export_format)
+    async for row in db.iter_export_rows(game_id):
+        document.add(row)
+    await update.message.reply_document(
+        document=document.finish(),
+        filename=f"secret_santa.{export_format}",
+        caption=f"📋 Выгрузка участников\n📊 Всего участников: {document.count}",
+    )
+
+
+IMPORT_USAGE = (
+    "📥 Импорт участников\n\n"
+    "Пришли боту в личные сообщения файл CSV или XLSX. Первая строка — заголовок с колонками:\n"
+    "• user_id — Telegram ID участника\n"
+    "• username — необязательно\n"
+    "• full_name — ФИО (минимум 3 символа)\n"
+    "• wish — желаемый подарок (минимум 5 символов)\n\n"
+    "Подходит и файл /export. Уже зарегистрированные участники обновляются, "
+    "строки с ошибками пропускаются и перечисляются в отчёте. "
+    "Уведомление о назначении дойдёт только тем, кто хотя бы раз писал боту."
+)
+# Сколько отклонённых строк перечислять в отчёте об импорте
+IMPORT_REPORT_ROWS = 20
+
+
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Административная команда: как загрузить участников из файла."""
+    game = await resolve_game(update)
+    if game is None:
+        return
+    if not await has_admin_rights(game["game_id"], update.effective_user.id):
+        await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
+        return
+    text = IMPORT_USAGE
+    if not importer.xlsx_available():
+        text += "\n\n⚠️ XLSX недоступен на сервере — используй CSV."
+    await update.message.reply_text(text)
+
+
+async def import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Загрузить участников из CSV/XLSX, присланного администратором в личку."""
+    user = update.effective_user
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
     
-    # Если распределение выполнено, добавляем информацию о парах
-    if db.is_assignment_done():
-        table_text += "\n\n🎁 РАСПРЕДЕЛЕНИЕ ПОДАРКОВ:\n"
-        table_text += "┌" + "─" * 58 + "┐\n"
-        table_text += f"│ {'Даритель':<28} │ {'Получатель':<28} │\n"
-        table_text += "├" + "─" * 58 + "┤\n"
-        
-        for p in participants:
-            assignment = db.get_assignment(p['user_id'])
-            if assignment:
-                giver_name = p['full_name'][:27] if len(p['full_name']) > 27 else p['full_name']
-                receiver_name = assignment['full_name'][:27] if len(assignment['full_name']) > 27 else assignment['full_name']
-                table_text += f"│ {giver_name:<28} │ {receiver_name:<28} │\n"
-        
-        table_text += "└" + "─" * 58 + "┘\n"
+    if not await has_admin_rights(game_id, user.id):
+        await update.message.reply_text("❌ Загружать участников из файла может только администратор игры.")
+        return
     
-    # Отправляем таблицу (разбиваем на части, если слишком длинная)
-    max_length = 4096  # Максимальная длина сообщения в Telegram
-    if len(table_text) <= max_length:
-        await update.message.reply_text(f"<pre>{table_text}</pre>", parse_mode="HTML")
-    else:
-        # Отправляем первую часть
-        first_part = table_text[:max_length]
-        await update.message.reply_text(f"<pre>{first_part}</pre>", parse_mode="HTML")
-        # Отправляем вторую часть, если есть
-        if len(table_text) > max_length:
-            second_part = table_text[max_length:]
-            await update.message.reply_text(f"<pre>{second_part}</pre>", parse_mode="HTML")
+    document = update.message.document
+    file_format = importer.file_format(document.file_name)
+    if file_format == importer.FORMAT_XLSX and not importer.xlsx_available():
+        await update.message.reply_text("⚠️ XLSX недоступен на сервере, пришли CSV.")
+        return
+    if document.file_size and document.file_size > importer.IMPORT_MAX_BYTES:
+        await update.message.reply_text(
+            f"❌ Файл больше {importer.IMPORT_MAX_BYTES // (1024 * 1024)} МБ."
+        )
+        return
+    
+    file = await document.get_file()
+    data = bytes(await file.download_as_bytearray())
+    try:
+        # Разбор большого файла не должен останавливать обработку других обновлений
+        result = await asyncio.to_thread(importer.parse_file, data, file_format)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}\n\n{IMPORT_USAGE}")
+        return
+    
+    if result.rows:
+        result.inserted, result.updated = await db.import_participants(game_id, result.rows)
+    logger.info(
+        f"Импорт в игру {game_id} от {user.id}: добавлено {result.inserted}, "
+        f"обновлено {result.updated}, отклонено {len(result.rejected)}"
+    )
+    
+    text = (
+        f"📥 Импорт в игру «{game['title']}»:\n\n"
+        f"Добавлено: {result.inserted}\n"
+        f"Обновлено: {result.updated}\n"
+        f"Отклонено строк: {len(result.rejected)}\n"
+    )
+    if result.rejected:
+        text += "\n"
+        for line, reason in result.rejected[:IMPORT_REPORT_ROWS]:
+            text += f"• строка {line}: {reason}\n"
+        if len(result.rejected) > IMPORT_REPORT_ROWS:
+            text += f"…и ещё {len(result.rejected) - IMPORT_REPORT_ROWS}\n"
+    if result.inserted and await db.is_assignment_done(game_id):
+        text += "\n⚠️ Распределение уже выполнено — новые участники в него не попали."
+    await update.message.reply_text(text)
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать меню помощи с командами."""
     try:
         user = update.effective_user
-        is_admin = user.id == ADMIN_USER_ID
+        game = await resolve_game(update)
+        if game is None:
+            return
+        game_id = game["game_id"]
+        is_admin = await has_admin_rights(game_id, user.id)
         
         help_text = "📚 МЕНЮ КОМАНД\n\n"
         help_text += "Доступные команды:\n\n"
@@ -350,16 +767,23 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         help_text += "🔹 /about - Описание игры и правил\n"
         help_text += "🔹 /register - Зарегистрироваться в игре\n"
         help_text += "🔹 /status - Показать статус регистрации\n"
+        help_text += "🔹 /game - Текущая игра и ссылка-приглашение\n"
         help_text += "🔹 /help - Показать это меню\n"
         help_text += "🔹 /cancel - Отменить текущую регистрацию\n"
+        help_text += "🔹 /newgame - Создать игру для группы (в групповом чате)\n"
         
         if is_admin:
             help_text += "\n\n👑 АДМИНИСТРАТОРСКИЕ КОМАНДЫ:\n\n"
             help_text += "🔹 /assign - Запустить распределение участников\n"
             help_text += "🔹 /export - Выгрузить таблицу участников и подарков\n"
+            help_text += "🔹 /import - Загрузить участников из CSV/XLSX\n"
             help_text += "🔹 /status - Показать общий статус игры\n"
+            help_text += "🔹 /stats - Статистика регистраций и уведомлений\n"
+            help_text += "🔹 /resend - Повторить неотправленные уведомления о назначении\n"
+            help_text += "🔹 /broadcast - Разослать сообщение участникам\n"
             help_text += "🔹 /reset_assignments - Сбросить распределение (начать заново)\n"
             help_text += "🔹 /reset - Полный сброс (удалить всех участников)\n"
+            help_text += "🔹 /addadmin - Назначить администратора игры\n"
         
         help_text += "\n\n💡 Подсказка: Используй команды с символом / в начале сообщения."
         
@@ -397,17 +821,21 @@ async def help_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user = query.from_user
-    is_admin = user.id == ADMIN_USER_ID
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
+    is_admin = await has_admin_rights(game_id, user.id)
     
     if query.data == "help_about":
         await query.edit_message_text(ABOUT_TEXT)
     elif query.data == "help_register":
-        if db.is_registered(user.id):
-            participant = db.get_participant(user.id)
+        if await db.is_registered(game_id, user.id):
+            participant = await db.get_participant(game_id, user.id)
             text = (
                 f"Ты уже зарегистрирован!\n\n"
-                f"Имя: {participant['full_name']}\n"
-                f"Желаемый подарок: {participant['wish']}\n\n"
+                f"Имя: {participant.full_name}\n"
+                f"Желаемый подарок: {participant.wish}\n\n"
                 "Чтобы обновить данные, используй /register"
             )
         else:
@@ -419,8 +847,8 @@ async def help_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         await query.edit_message_text(text)
     elif query.data == "help_status":
-        participant_count = db.get_participant_count()
-        is_assigned = db.is_assignment_done()
+        participant_count = await db.get_participant_count(game_id)
+        is_assigned = await db.is_assignment_done(game_id)
         
         if is_admin:
             text = (
@@ -430,16 +858,16 @@ async def help_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "Используй /status для подробной информации"
             )
         else:
-            if db.is_registered(user.id):
-                participant = db.get_participant(user.id)
-                assignment = db.get_assignment(user.id)
+            if await db.is_registered(game_id, user.id):
+                participant = await db.get_participant(game_id, user.id)
+                assignment = await db.get_assignment(game_id, user.id)
                 text = (
                     f"Твоя регистрация:\n"
-                    f"Имя: {participant['full_name']}\n"
-                    f"Подарок: {participant['wish']}\n\n"
+                    f"Имя: {participant.full_name}\n"
+                    f"Подарок: {participant.wish}\n\n"
                 )
                 if assignment:
-                    text += f"🎁 Ты даришь: {assignment['full_name']}"
+                    text += f"🎁 Ты даришь: {assignment.receiver_name}"
                 else:
                     text += "Распределение ещё не выполнено."
             else:
@@ -451,9 +879,14 @@ async def help_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 "👑 АДМИНИСТРАТОРСКИЕ КОМАНДЫ:\n\n"
                 "🔹 /assign - Запустить распределение участников\n"
                 "🔹 /export - Выгрузить таблицу участников и подарков\n"
+                "🔹 /import - Загрузить участников из CSV/XLSX\n"
                 "🔹 /status - Показать общий статус игры\n"
+                "🔹 /stats - Статистика регистраций и уведомлений\n"
+                "🔹 /resend - Повторить неотправленные уведомления о назначении\n"
+                "🔹 /broadcast - Разослать сообщение участникам\n"
                 "🔹 /reset_assignments - Сбросить распределение (начать заново)\n"
-                "🔹 /reset - Полный сброс (удалить всех участников)\n\n"
+                "🔹 /reset - Полный сброс (удалить всех участников)\n"
+                "🔹 /addadmin - Назначить администратора игры\n\n"
                 "Используй эти команды для управления игрой."
             )
         else:
@@ -461,20 +894,89 @@ async def help_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text(text)
 
 
+async def cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Административная команда: счётчики попаданий и промахов кэша."""
+    user = update.effective_user
+    
+    # Проверка прав администратора
+    if user.id != ADMIN_USER_ID:
+        await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
+        return
+    
+    text = "🗄 Кэш участников:\n\n"
+    for name, stats in db.stats().items():
+        total = stats["hits"] + stats["misses"]
+        hit_rate = stats["hits"] / total * 100 if total else 0.0
+        text += (
+            f"• {name}: попаданий {stats['hits']}, промахов {stats['misses']} "
+            f"({hit_rate:.1f}%), записей {stats['size']}\n"
+        )
+    await update.message.reply_text(text)
+
+
+async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Административная команда: прислать последнюю резервную копию базы.
+
+    /backup now — сначала снять новую копию. Копия содержит данные всех
+    игр, поэтому доступна только администратору бота и отправляется ему
+    в личные сообщения.
+    """
+    user = update.effective_user
+    
+    if user.id != ADMIN_USER_ID:
+        await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
+        return
+    if config.STORAGE_BACKEND != "sqlite":
+        await update.message.reply_text("ℹ️ Копии PostgreSQL снимаются средствами сервера базы (pg_dump).")
+        return
+    
+    path = backup.latest_backup()
+    if path is None or context.args[:1] == ["now"]:
+        status_message = await update.message.reply_text("⏳ Снимаю резервную копию...")
+        try:
+            result = await backup.backup_now()
+        except Exception as e:
+            logger.exception("Не удалось снять резервную копию базы")
+            await status_message.edit_text(f"❌ Не удалось снять резервную копию: {e}")
+            return
+        path = result.path
+    
+    size = os.path.getsize(path)
+    if size > backup.BACKUP_SEND_MAX_BYTES:
+        await update.message.reply_text(
+            f"⚠️ Копия занимает {size // (1024 * 1024)} МБ — больше, чем бот может отправить. "
+            f"Она сохранена на сервере: {path}"
+        )
+        return
+    with open(path, "rb") as document:
+        await context.bot.send_document(
+            chat_id=user.id,
+            document=document,
+            filename=os.path.basename(path),
+            caption=f"🗄 Резервная копия базы, {size // 1024} КБ",
+        )
+    if update.effective_chat.id != user.id:
+        await update.message.reply_text("🗄 Резервная копия отправлена в личные сообщения.")
+
+
 async def reset_assignments(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Административная команда для сброса распределения (начать заново)."""
     user = update.effective_user
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
     
     # Проверка прав администратора
-    if user.id != ADMIN_USER_ID:
+    if not await has_admin_rights(game_id, user.id):
         await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
         return
     
     # Сбросить флаг распределения и очистить распределения
-    db.clear_assignments()
-    db.reset_assignment_flag()
+    await db.clear_assignments(game_id)
+    await db.reset_assignment_flag(game_id)
     
-    participant_count = db.get_participant_count()
+    participant_count = await db.get_participant_count(game_id)
     
     await update.message.reply_text(
         f"✅ Распределение сброшено!\n\n"
@@ -487,10 +989,14 @@ async def reset_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Административная команда для полного сброса (удалить всех участников)."""
     try:
         user = update.effective_user
+        game = await resolve_game(update)
+        if game is None:
+            return
+        game_id = game["game_id"]
         logger.info(f"Команда /reset вызвана пользователем {user.id} ({user.username})")
         
         # Проверка прав администратора
-        if user.id != ADMIN_USER_ID:
+        if not await has_admin_rights(game_id, user.id):
             await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
             return
         
@@ -503,7 +1009,7 @@ async def reset_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        participant_count = db.get_participant_count()
+        participant_count = await db.get_participant_count(game_id)
         
         await update.message.reply_text(
             f"⚠️ ВНИМАНИЕ! Полный сброс удалит:\n\n"
@@ -525,15 +1031,19 @@ async def reset_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     user = query.from_user
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
     
     # Проверка прав администратора
-    if user.id != ADMIN_USER_ID:
+    if not await has_admin_rights(game_id, user.id):
         await query.edit_message_text("❌ У тебя нет прав для выполнения этой команды.")
         return
     
     if query.data == "reset_confirm":
         # Полный сброс
-        db.reset_all()
+        await db.reset_all(game_id)
         await query.edit_message_text(
             "✅ Полный сброс выполнен!\n\n"
             "Все участники, распределения и настройки удалены.\n"
@@ -543,24 +1053,273 @@ async def reset_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("❌ Сброс отменён.")
 
 
+BROADCAST_USAGE = (
+    "Использование: /broadcast [кому] текст\n\n"
+    "Кому:\n"
+    "• all — всем участникам (по умолчанию)\n"
+    "• unassigned — участникам без назначения\n"
+    "• unnotified — тем, кому не дошло уведомление о назначении"
+)
+
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Административная команда: разослать сообщение участникам игры."""
+    user = update.effective_user
+    game = await resolve_game(update)
+    if game is None:
+        return
+    game_id = game["game_id"]
+    
+    if not await has_admin_rights(game_id, user.id):
+        await update.message.reply_text("❌ У тебя нет прав для выполнения этой команды.")
+        return
+    
+    if game_id in broadcast.get_broadcasts(context):
+        await update.message.reply_text("⏳ В этой игре уже идёт рассылка. Дождись её окончания или отмени.")
+        return
+    
+    # Текст берётся из сообщения целиком, чтобы сохранить переносы строк
+    parts = update.message.text.split(maxsplit=1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    audience = "all"
+    words = text.split(maxsplit=1)
+    if words and words[0].lower() in BROADCAST_AUDIENCES:
+        audience = words[0].lower()
+        text = words[1].strip() if len(words) > 1 else ""
+    if not text:
+        await update.message.reply_text(BROADCAST_USAGE)
+        return
+    
+    recipients = await db.get_broadcast_recipients(game_id, audience)
+    if not recipients:
+        await update.message.reply_text("❌ Нет участников, подходящих под условие рассылки.")
+        return
+    
+    # Пока шёл запрос к базе, рассылку мог запустить другой администратор —
+    # в том числе на другой реплике: игру занимает блокировка хранилища
+    job = broadcast.Broadcast(game_id, f"📢 {game['title']}\n\n{text}", recipients, None, db)
+    if not await job.acquire():
+        await update.message.reply_text("⏳ В этой игре уже идёт рассылка. Дождись её окончания или отмени.")
+        return
+    broadcast.get_broadcasts(context)[game_id] = job
+    logger.info(f"Рассылка в игре {game_id}: {audience}, получателей {len(recipients)}")
+    try:
+        job.progress_message = await update.message.reply_text(job.render(), reply_markup=job.keyboard())
+    except Exception:
+        broadcast.get_broadcasts(context).pop(game_id, None)
+        await job.release()
+        raise
+    job.schedule(context.job_queue)
+
+
+async def broadcast_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки паузы, продолжения и отмены рассылки."""
+    query = update.callback_query
+    action, _, game_id = query.data.partition(":")
+    game_id = int(game_id)
+    
+    if not await has_admin_rights(game_id, query.from_user.id):
+        await query.answer("❌ Нет прав", show_alert=True)
+        return
+    
+    job = broadcast.get_broadcasts(context).get(game_id)
+    if job is None:
+        # Рассылку может вести другая реплика: команда передаётся ей через хранилище
+        if await broadcast.request_control(db, game_id, action.removeprefix("bc_")):
+            await query.answer("⏳ Команда передана, прогресс скоро обновится")
+        else:
+            await query.answer("Рассылка уже завершена")
+        return
+    await query.answer()
+    
+    if action == "bc_pause":
+        await broadcast.pause(context, job)
+    elif action == "bc_resume":
+        await broadcast.resume(context, job)
+    elif action == "bc_cancel":
+        await broadcast.cancel(context, job)
+
+
+def mark_startup(phase: str):
+    """Запомнить, через сколько секунд после запуска пройден этап старта."""
+    if phase not in startup_timings:
+        startup_timings[phase] = time.monotonic() - STARTED_AT
+        logger.info(f"Запуск: {phase} через {startup_timings[phase]:.3f} с")
+
+
+async def first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Отметить время до первого обновления (остальные проходят мимо)."""
+    if "first_update" not in startup_timings:
+        mark_startup("first_update")
+
+
+async def publish_admin_menus(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: обновить меню администраторов, если оно изменилось."""
+    await menu.publish_admin_menus(context.bot, db, [ADMIN_USER_ID])
+
+
+async def refresh_registration(register_handler: ConversationHandler, update: Update,
+                               context: ContextTypes.DEFAULT_TYPE):
+    """Несколько реплик: до обработки перечитать состояние регистрации, если его изменила другая реплика."""
+    if update.effective_chat is None or update.effective_user is None:
+        return
+    # Ключ диалога ConversationHandler (per_chat и per_user): чат и пользователь.
+    # Публичного доступа к текущим диалогам у ConversationHandler нет
+    key = (update.effective_chat.id, update.effective_user.id)
+    await context.application.persistence.refresh_conversation(
+        register_handler.name, key, register_handler._conversations
+    )
+
+
+async def save_state(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Несколько реплик: записать состояние диалогов и user_data сразу после обработки обновления.
+
+    Следующее обновление пользователя может получить другая реплика, поэтому
+    ждать PERSISTENCE_INTERVAL нельзя.
+    """
+    if update.effective_user is not None:
+        context.application.mark_data_for_update_persistence(user_ids=update.effective_user.id)
+    await context.application.update_persistence()
+    await context.application.persistence.flush()
+
+
+def apply_change(application: Application, change: Optional[str]):
+    """Уведомление об изменении данных в PostgreSQL: сбросить кэш и перечитать состояние диалогов."""
+    db.apply_change(change)
+    application.persistence.apply_change(change)
+
+
 async def post_init(application: Application) -> None:
-    """Установить команды меню бота."""
-    commands = [
-        BotCommand("start", "Начать работу с ботом"),
-        BotCommand("about", "Описание игры и правил"),
-        BotCommand("register", "Зарегистрироваться в игре"),
-        BotCommand("status", "Показать статус регистрации"),
-        BotCommand("help", "Показать меню с командами"),
-        BotCommand("cancel", "Отменить текущую регистрацию"),
-    ]
-    await application.bot.set_my_commands(commands)
-    logger.info("Команды меню установлены")
+    """Опубликовать изменившиеся меню команд, запустить фоновые задачи и эндпоинт метрик."""
+    # Меню участников публикуется, только если изменилось с прошлого запуска
+    await menu.publish_default_menu(application.bot, db)
+    # Меню администраторов — после старта, в фоне: это запрос на каждого администратора
+    application.job_queue.run_once(publish_admin_menus, 0, name="publish_admin_menus")
+    
+    if config.STORAGE_BACKEND == "postgres":
+        # Реплики узнают об изменениях друг друга и делят лимит рассылки:
+        # лимит Telegram — на бота, а не на процесс
+        await db.listen_changes(functools.partial(apply_change, application))
+        application.bot_data["notifier"] = Notifier(application.bot, bucket=SharedTokenBucket(db, SEND_RATE))
+    
+    # Воркер очереди уведомлений сразу продолжает рассылку, прерванную перезапуском
+    worker = outbox.OutboxWorker(db, application.bot, shared_notifier(application.bot_data, application.bot))
+    application.bot_data["outbox"] = worker
+    if config.STORAGE_BACKEND == "sqlite":
+        # С SQLite работает один процесс: всё, что осталось в отправке, прервано его остановкой
+        await db.fail_stale_outbox(0)
+    application.job_queue.run_repeating(worker, outbox.OUTBOX_INTERVAL, first=0, name="outbox")
+    
+    if config.STORAGE_BACKEND == "sqlite" and backup.BACKUP_INTERVAL > 0:
+        application.job_queue.run_repeating(
+            backup.backup_job, backup.BACKUP_INTERVAL, first=backup.BACKUP_INTERVAL, name="backup"
+        )
+    
+    if METRICS_PORT:
+        application.bot_data["metrics_server"] = await metrics.start_server(METRICS_HOST, METRICS_PORT)
+    mark_startup("initialized")
 
 
-def main():
-    """Запуск бота."""
-    # Создать приложение
-    application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+async def post_shutdown(application: Application) -> None:
+    """Остановить эндпоинт метрик и закрыть соединения с базой данных."""
+    server = application.bot_data.pop("metrics_server", None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    await db.close()
+
+
+def iter_handlers(application: Application):
+    """Все зарегистрированные обработчики, включая вложенные в ConversationHandler."""
+    def visit(handler):
+        yield handler
+        if isinstance(handler, ConversationHandler):
+            for state_handlers in handler.states.values():
+                for nested in state_handlers:
+                    yield from visit(nested)
+            for nested in handler.entry_points + handler.fallbacks:
+                yield from visit(nested)
+    
+    for group_handlers in application.handlers.values():
+        for handler in group_handlers:
+            yield from visit(handler)
+
+
+def collect_allowed_updates(application: Application) -> List[str]:
+    """Типы обновлений, которые обрабатывают зарегистрированные обработчики.
+
+    Telegram не будет присылать остальные типы (редактирования сообщений,
+    изменения участников чата и т. п.), что экономит трафик и CPU.
+    """
+    allowed = set()
+    for handler in iter_handlers(application):
+        if isinstance(handler, CallbackQueryHandler):
+            allowed.add(Update.CALLBACK_QUERY)
+        elif isinstance(handler, (CommandHandler, MessageHandler)):
+            allowed.add(Update.MESSAGE)
+    return sorted(allowed)
+
+
+def instrument_handlers(application: Application):
+    """Обернуть callback каждого обработчика замером времени для метрик."""
+    for handler in iter_handlers(application):
+        if not isinstance(handler, ConversationHandler):
+            handler.callback = metrics.timed_handler(handler.callback)
+
+
+def register_gauges(register_handler: ConversationHandler, processor: BaseUpdateProcessor):
+    """Метрики, которые вычисляются в момент запроса /metrics."""
+    state_names = {FULL_NAME: "full_name", WISH: "wish"}
+    
+    def conversation_states():
+        # Публичного доступа к текущим диалогам у ConversationHandler нет
+        counts = {(name,): 0 for name in state_names.values()}
+        for state in getattr(register_handler, "_conversations", {}).values():
+            if state in state_names:
+                counts[(state_names[state],)] += 1
+        return counts
+    
+    def cache_entries():
+        return {
+            (cache, counter): value
+            for cache, stats in db.stats().items()
+            for counter, value in stats.items()
+        }
+    
+    metrics.gauge("santa_conversations", "Незавершённые регистрации по текущему шагу",
+                  conversation_states, ["state"])
+    metrics.gauge("santa_db_pending", "Вызовы базы в очереди или в работе",
+                  lambda: {(): db.database.pending})
+    metrics.gauge("santa_cache", "Попадания, промахи и размер кэшей", cache_entries, ["cache", "counter"])
+    metrics.gauge("santa_startup_seconds", "Время от запуска до этапов старта", lambda: {
+        (phase,): seconds for phase, seconds in startup_timings.items()
+    }, ["phase"])
+    if isinstance(processor, OrderedUpdateProcessor):
+        metrics.gauge("santa_updates", "Обновления в работе и в очереди", lambda: {
+            ("running",): processor.running,
+            ("running_heavy",): processor.running_heavy,
+            ("waiting",): processor.waiting,
+        }, ["state"])
+
+
+def build_application(processor: BaseUpdateProcessor, request: Optional[BaseRequest] = None) -> Application:
+    """Собрать приложение со всеми обработчиками.
+    
+    request подменяет HTTP-слой Bot API (бенчмарки работают без сети).
+    """
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(processor)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .persistence(StoragePersistence(db, shared=config.STORAGE_BACKEND == "postgres"))
+    )
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(BOT_API_BASE_URL)
+    if request is not None:
+        builder = builder.request(request)
+    application = builder.build()
     
     # Обработчик регистрации
     register_handler = ConversationHandler(
@@ -570,25 +1329,79 @@ def main():
             WISH: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_wish)],
         },
         fallbacks=[CommandHandler("cancel", register_cancel)],
+        # Состояние регистрации переживает перезапуск бота
+        name="registration",
+        persistent=True,
     )
     
     # Добавить обработчики
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("about", about))
+    application.add_handler(CommandHandler("newgame", new_game))
+    application.add_handler(CommandHandler("game", game_info))
+    application.add_handler(CommandHandler("addadmin", add_admin))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("menu", help_command))  # Альтернативная команда для меню
     application.add_handler(register_handler)
     application.add_handler(CommandHandler("assign", assign))
     application.add_handler(CommandHandler("status", status))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("resend", resend))
     application.add_handler(CommandHandler("export", export))
+    application.add_handler(CommandHandler("import", import_command))
+    application.add_handler(MessageHandler(
+        filters.ChatType.PRIVATE
+        & (filters.Document.FileExtension("csv") | filters.Document.FileExtension("xlsx")),
+        import_document,
+    ))
     application.add_handler(CommandHandler("reset_assignments", reset_assignments))
+    application.add_handler(CommandHandler("cache_stats", cache_stats))
+    application.add_handler(CommandHandler("backup", backup_command))
+    application.add_handler(CommandHandler("broadcast", broadcast_command))
     application.add_handler(CommandHandler("reset", reset_all))
     application.add_handler(CallbackQueryHandler(help_button, pattern="^help_"))
     application.add_handler(CallbackQueryHandler(reset_button, pattern="^reset_"))
+    application.add_handler(CallbackQueryHandler(broadcast_button, pattern="^bc_"))
+    application.add_handler(CallbackQueryHandler(status_page, pattern="^stp:"))
     
-    # Запустить бота (long polling)
-    logger.info("Бот запущен...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    instrument_handlers(application)
+    # Защита от флуда — раньше всех обработчиков. Добавляется после замеров:
+    # ApplicationHandlerStop останавливает обработку и ошибкой не считается
+    flood_guard = FloodGuard(HEAVY_COMMANDS)
+    if flood_guard.enabled:
+        application.add_handler(TypeHandler(Update, flood_guard), group=-1)
+    application.add_handler(TypeHandler(Update, first_update), group=-10)
+    if application.persistence.shared:
+        # Несколько реплик: состояние регистрации читается до обработчиков и пишется сразу после них
+        application.add_handler(
+            TypeHandler(Update, functools.partial(refresh_registration, register_handler)), group=-5
+        )
+        application.add_handler(TypeHandler(Update, save_state), group=100)
+    register_gauges(register_handler, processor)
+    return application
+
+
+def main():
+    """Запуск бота."""
+    config.validate()
+    # Обновления разных пользователей обрабатываются параллельно
+    application = build_application(OrderedUpdateProcessor(HEAVY_COMMANDS))
+    allowed_updates = collect_allowed_updates(application)
+    
+    if UPDATE_MODE == "webhook":
+        # Встроенный HTTP-сервер: обновление приходит за один сетевой переход
+        logger.info(f"Бот запущен (webhook {WEBHOOK_URL}/{WEBHOOK_PATH})...")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=allowed_updates,
+        )
+    else:
+        logger.info("Бот запущен...")
+        application.run_polling(allowed_updates=allowed_updates)
 
 
 if __name__ == "__main__":
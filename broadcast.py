@@ -0,0 +1,227 @@
+"""Рассылка сообщения участникам игры через JobQueue порциями."""
+import logging
+import os
+import time
+from contextlib import AsyncExitStack
+from typing import Dict, List, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes, JobQueue
+
+from notifier import PROGRESS_INTERVAL, shared_notifier
+
+logger = logging.getLogger(__name__)
+
+# Сообщений в секунду: меньше общего лимита SEND_RATE, который рассылка делит
+# с уведомлениями о назначении, чтобы бот успевал отвечать остальным
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+# Как часто отправляется очередная порция, с
+BROADCAST_INTERVAL = float(os.getenv("BROADCAST_INTERVAL", "1.0"))
+
+RUNNING = "running"
+PAUSED = "paused"
+CANCELLED = "cancelled"
+DONE = "done"
+
+# Настройка игры, через которую кнопки на других репликах передают команду
+# (pause, resume или cancel) реплике, которая ведёт рассылку
+CONTROL_SETTING = "broadcast_control"
+
+STATUS_TITLES = {
+    RUNNING: "⏳ Рассылка идёт",
+    PAUSED: "⏸ Рассылка на паузе",
+    CANCELLED: "⛔ Рассылка отменена",
+    DONE: "✅ Рассылка завершена",
+}
+
+
+class Broadcast:
+    """Рассылка одной игры: получатели, позиция и счётчики.
+
+    Каждая порция — отдельная задача JobQueue, следующая планируется после
+    завершения текущей, поэтому рассылка не занимает обработчики обновлений
+    и её можно приостановить между порциями. Рассылку ведёт реплика, которая
+    её запустила: перед каждой порцией (и раз в interval на паузе) она
+    проверяет команды, переданные кнопками на других репликах.
+    """
+
+    def __init__(self, game_id: int, text: str, recipients: List[int], progress_message, storage,
+                 rate: float = BROADCAST_RATE, interval: float = BROADCAST_INTERVAL):
+        self.game_id = game_id
+        self.storage = storage
+        self.text = text
+        self.recipients = recipients
+        self.progress_message = progress_message
+        self.interval = interval
+        self.batch_size = max(1, int(rate * interval))
+        self.status = RUNNING
+        self.position = 0
+        self.sent = 0
+        self.failed = 0
+        self._job = None
+        self._sending = False
+        self._last_edit = 0.0
+        # Блокировка игры на время рассылки (storage.try_lock)
+        self._lock: Optional[AsyncExitStack] = None
+
+    @property
+    def total(self) -> int:
+        return len(self.recipients)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (CANCELLED, DONE)
+
+    def render(self) -> str:
+        return (
+            f"{STATUS_TITLES[self.status]}\n\n"
+            f"Отправлено: {self.sent} из {self.total}\n"
+            f"Ошибок: {self.failed}"
+        )
+
+    def keyboard(self) -> Optional[InlineKeyboardMarkup]:
+        if self.finished:
+            return None
+        toggle = ("⏸ Пауза", "bc_pause") if self.status == RUNNING else ("▶️ Продолжить", "bc_resume")
+        return InlineKeyboardMarkup([[
+            InlineKeyboardButton(toggle[0], callback_data=f"{toggle[1]}:{self.game_id}"),
+            InlineKeyboardButton("⛔ Отменить", callback_data=f"bc_cancel:{self.game_id}"),
+        ]])
+
+    async def show_progress(self, force: bool = False):
+        """Обновить сообщение с прогрессом (не чаще PROGRESS_INTERVAL)."""
+        now = time.monotonic()
+        if not force and now - self._last_edit < PROGRESS_INTERVAL:
+            return
+        self._last_edit = now
+        try:
+            await self.progress_message.edit_text(self.render(), reply_markup=self.keyboard())
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки: {e}")
+
+    async def acquire(self) -> bool:
+        """Занять игру: пока рассылка идёт, другую в ней не запустить ни на одной реплике."""
+        stack = AsyncExitStack()
+        if not await stack.enter_async_context(self.storage.try_lock(f"broadcast:{self.game_id}")):
+            await stack.aclose()
+            return False
+        self._lock = stack
+        # Команда, не доставленная прошлой рассылке, к этой не относится
+        await self.storage.set_setting(self.game_id, CONTROL_SETTING, "")
+        return True
+
+    async def release(self):
+        stack, self._lock = self._lock, None
+        if stack is not None:
+            await stack.aclose()
+
+    def schedule(self, job_queue: JobQueue, delay: float = 0):
+        """Запланировать следующую порцию (на паузе — проверку команд), если она ещё не запланирована."""
+        if self._job is None and not self._sending and not self.finished:
+            if self.status == PAUSED:
+                delay = max(delay, self.interval)
+            self._job = job_queue.run_once(
+                send_batch, delay, data=self, name=f"broadcast:{self.game_id}"
+            )
+
+    def unschedule(self):
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+
+
+def get_broadcasts(context: ContextTypes.DEFAULT_TYPE) -> Dict[int, Broadcast]:
+    """Активные рассылки по играм."""
+    return context.bot_data.setdefault("broadcasts", {})
+
+
+async def request_control(storage, game_id: int, action: str) -> bool:
+    """Передать команду рассылке, которую ведёт другая реплика. False, если рассылки нет."""
+    async with storage.try_lock(f"broadcast:{game_id}") as acquired:
+        if acquired:
+            return False
+        await storage.set_setting(game_id, CONTROL_SETTING, action)
+        return True
+
+
+async def apply_control(context: ContextTypes.DEFAULT_TYPE, broadcast: Broadcast):
+    """Выполнить команду, переданную кнопкой на другой реплике."""
+    try:
+        action = await broadcast.storage.get_setting(broadcast.game_id, CONTROL_SETTING)
+        if action:
+            await broadcast.storage.set_setting(broadcast.game_id, CONTROL_SETTING, "")
+    except Exception as e:
+        logger.warning(f"Не удалось проверить команды рассылки в игре {broadcast.game_id}: {e}")
+        return
+    if action == "pause":
+        await pause(context, broadcast)
+    elif action == "resume":
+        await resume(context, broadcast)
+    elif action == "cancel":
+        await cancel(context, broadcast)
+
+
+async def send_batch(context: ContextTypes.DEFAULT_TYPE):
+    """Задача JobQueue: отправить очередную порцию и запланировать следующую."""
+    broadcast: Broadcast = context.job.data
+    broadcast._job = None
+    await apply_control(context, broadcast)
+    if broadcast.status != RUNNING:
+        broadcast.schedule(context.job_queue)
+        return
+
+    started = time.monotonic()
+    batch = broadcast.recipients[broadcast.position:broadcast.position + broadcast.batch_size]
+    broadcast._sending = True
+    try:
+        result = await shared_notifier(context.bot_data, context.bot).send_all(
+            ((chat_id, broadcast.text) for chat_id in batch), total=len(batch)
+        )
+    finally:
+        broadcast._sending = False
+    broadcast.position += len(batch)
+    broadcast.sent += result.sent
+    broadcast.failed += result.failed
+
+    if broadcast.status == RUNNING and broadcast.position >= broadcast.total:
+        broadcast.status = DONE
+    if broadcast.finished:
+        await finish(context, broadcast)
+        return
+    await broadcast.show_progress()
+    broadcast.schedule(context.job_queue, max(0.0, broadcast.interval - (time.monotonic() - started)))
+
+
+async def finish(context: ContextTypes.DEFAULT_TYPE, broadcast: Broadcast):
+    """Убрать рассылку из активных и показать итог."""
+    broadcast.unschedule()
+    get_broadcasts(context).pop(broadcast.game_id, None)
+    await broadcast.release()
+    logger.info(
+        f"Рассылка в игре {broadcast.game_id}: {broadcast.status}, "
+        f"отправлено {broadcast.sent} из {broadcast.total}, ошибок {broadcast.failed}"
+    )
+    await broadcast.show_progress(force=True)
+
+
+async def pause(context: ContextTypes.DEFAULT_TYPE, broadcast: Broadcast):
+    if broadcast.status == RUNNING:
+        broadcast.status = PAUSED
+        broadcast.unschedule()
+        broadcast.schedule(context.job_queue)
+    await broadcast.show_progress(force=True)
+
+
+async def resume(context: ContextTypes.DEFAULT_TYPE, broadcast: Broadcast):
+    if broadcast.status == PAUSED:
+        broadcast.status = RUNNING
+        broadcast.unschedule()
+        broadcast.schedule(context.job_queue)
+    await broadcast.show_progress(force=True)
+
+
+async def cancel(context: ContextTypes.DEFAULT_TYPE, broadcast: Broadcast):
+    broadcast.status = CANCELLED
+    # Идущая порция допишется и завершит рассылку сама
+    if not broadcast._sending:
+        await finish(context, broadcast)
@@ -0,0 +1,263 @@
+"""Кэш данных участников перед базой данных."""
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+# Сколько секунд запись считается актуальной
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+# Максимум записей в каждом кэше
+CACHE_SIZE = int(os.getenv("CACHE_SIZE", "10000"))
+
+_MISSING = object()
+
+
+class LRUCache:
+    """LRU-кэш с ограничением по времени жизни записей и счётчиками попаданий."""
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # Увеличивается при каждой инвалидации: значение, прочитанное из базы
+        # до инвалидации, не должно попасть в кэш после неё
+        self.generation = 0
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = _MISSING) -> Any:
+        item = self._data.get(key)
+        if item is not None:
+            value, expires_at = item
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+class CachedDatabase:
+    """Read-through кэш перед AsyncDatabase с тем же набором методов.
+
+    Кэшируются записи участников, назначения, число участников, флаг
+    распределения, данные игр, выбранная игра, права администратора и
+    готовые страницы списка участников.
+    Методы, изменяющие данные, сбрасывают затронутые кэши; остальные
+    вызовы передаются в базу без изменений. Изменения, сделанные другими
+    репликами, сбрасывает apply_change.
+    """
+
+    def __init__(self, database, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.database = database
+        self.participants = LRUCache(maxsize, ttl)
+        self.assignments = LRUCache(maxsize, ttl)
+        # Число участников, флаг распределения и данные игр
+        self.games = LRUCache(maxsize, ttl)
+        # Выбранная игра пользователя и права администратора
+        self.users = LRUCache(maxsize, ttl)
+        # Отрисованные страницы /status
+        self.pages = LRUCache(maxsize, ttl)
+
+    def __getattr__(self, name: str):
+        return getattr(self.database, name)
+
+    async def _cached(self, cache: LRUCache, key: Hashable, loader: Callable[[], Awaitable[Any]]) -> Any:
+        value = cache.get(key)
+        if value is not _MISSING:
+            return value
+        generation = cache.generation
+        value = await loader()
+        if cache.generation == generation:
+            cache.set(key, value)
+        return value
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Счётчики попаданий и промахов по каждому кэшу."""
+        return {
+            "participants": self.participants.stats(),
+            "assignments": self.assignments.stats(),
+            "games": self.games.stats(),
+            "users": self.users.stats(),
+            "pages": self.pages.stats(),
+        }
+
+    # Чтение
+
+    async def get_game(self, game_id: int):
+        return await self._cached(
+            self.games, (game_id, "game"), lambda: self.database.get_game(game_id)
+        )
+
+    async def is_game_admin(self, game_id: int, user_id: int) -> bool:
+        return await self._cached(
+            self.users, (user_id, "admin", game_id), lambda: self.database.is_game_admin(game_id, user_id)
+        )
+
+    async def get_user_game(self, user_id: int) -> int:
+        return await self._cached(
+            self.users, (user_id, "game"), lambda: self.database.get_user_game(user_id)
+        )
+
+    async def get_participant(self, game_id: int, user_id: int):
+        return await self._cached(
+            self.participants, (game_id, user_id), lambda: self.database.get_participant(game_id, user_id)
+        )
+
+    async def is_registered(self, game_id: int, user_id: int) -> bool:
+        return await self.get_participant(game_id, user_id) is not None
+
+    async def get_assignment(self, game_id: int, giver_id: int):
+        return await self._cached(
+            self.assignments, (game_id, giver_id), lambda: self.database.get_assignment(game_id, giver_id)
+        )
+
+    async def get_participant_count(self, game_id: int) -> int:
+        return await self._cached(
+            self.games, (game_id, "count"), lambda: self.database.get_participant_count(game_id)
+        )
+
+    async def is_assignment_done(self, game_id: int) -> bool:
+        return await self._cached(
+            self.games, (game_id, "assignment_done"), lambda: self.database.is_assignment_done(game_id)
+        )
+
+    async def get_rendered_page(self, key: Hashable, render: Callable[[], Awaitable[Any]]) -> Any:
+        """Страница списка участников, отрисованная render; сбрасывается при изменении участников."""
+        return await self._cached(self.pages, key, render)
+
+    # Изменение
+
+    async def create_game(self, game_id: int, title: str, admin_id: int) -> bool:
+        try:
+            return await self.database.create_game(game_id, title, admin_id)
+        finally:
+            self.games.invalidate((game_id, "game"))
+            self.users.invalidate((admin_id, "admin", game_id))
+
+    async def add_game_admin(self, game_id: int, user_id: int):
+        try:
+            return await self.database.add_game_admin(game_id, user_id)
+        finally:
+            self.users.invalidate((user_id, "admin", game_id))
+
+    async def set_user_game(self, user_id: int, game_id: int):
+        try:
+            return await self.database.set_user_game(user_id, game_id)
+        finally:
+            self.users.invalidate((user_id, "game"))
+
+    async def register_participant(self, game_id: int, user_id: int, username: str, full_name: str, wish: str) -> bool:
+        try:
+            return await self.database.register_participant(game_id, user_id, username, full_name, wish)
+        finally:
+            self.participants.invalidate((game_id, user_id))
+            self.pages.clear()
+            # Данные участника входят в назначение его Тайного Санты
+            self.assignments.clear()
+            self.games.invalidate((game_id, "count"))
+
+    async def import_participants(self, game_id: int, rows):
+        try:
+            return await self.database.import_participants(game_id, rows)
+        finally:
+            self.clear_game(game_id)
+
+    async def commit_assignment_round(self, game_id: int, assignments) -> bool:
+        try:
+            return await self.database.commit_assignment_round(game_id, assignments)
+        finally:
+            self.assignments.clear()
+            self.games.invalidate((game_id, "assignment_done"))
+
+    async def clear_assignments(self, game_id: int):
+        try:
+            return await self.database.clear_assignments(game_id)
+        finally:
+            self.assignments.clear()
+
+    async def reset_assignment_flag(self, game_id: int):
+        try:
+            return await self.database.reset_assignment_flag(game_id)
+        finally:
+            self.games.invalidate((game_id, "assignment_done"))
+
+    async def clear_all_participants(self, game_id: int):
+        try:
+            return await self.database.clear_all_participants(game_id)
+        finally:
+            self.clear_game(game_id)
+
+    async def reset_all(self, game_id: int):
+        try:
+            return await self.database.reset_all(game_id)
+        finally:
+            self.clear_game(game_id)
+
+    def apply_change(self, change: Optional[str]):
+        """Сбросить кэши по уведомлению об изменении (PostgresDatabase.listen_changes).
+
+        change — «таблица:ключ», ключ — ID через двоеточие или пустой, если
+        изменена вся таблица. None: уведомления могли потеряться, сбрасывается всё.
+        """
+        if change is None:
+            for cache in (self.participants, self.assignments, self.games, self.users, self.pages):
+                cache.clear()
+            return
+        table, _, key = change.partition(":")
+        if table not in ("games", "game_admins", "user_games", "participants", "assignments", "settings"):
+            return
+        ids = [int(part) for part in key.split(":")] if key else []
+        if table == "games":
+            self.games.invalidate((ids[0], "game"))
+        elif table == "game_admins":
+            if len(ids) == 2:
+                self.users.invalidate((ids[1], "admin", ids[0]))
+            else:
+                self.users.clear()
+        elif table == "user_games":
+            if ids:
+                self.users.invalidate((ids[0], "game"))
+            else:
+                self.users.clear()
+        elif table == "participants":
+            if len(ids) == 2:
+                self.participants.invalidate(tuple(ids))
+                self.pages.clear()
+                self.assignments.clear()
+                self.games.invalidate((ids[0], "count"))
+            else:
+                self.clear_game(ids[0])
+        elif table == "assignments":
+            self.assignments.clear()
+        else:
+            self.games.invalidate((ids[0], "assignment_done"))
+
+    def clear_game(self, game_id: int):
+        """Сбросить кэши, относящиеся к данным участников игры."""
+        self.participants.clear()
+        self.assignments.clear()
+        self.pages.clear()
+        self.games.invalidate((game_id, "count"))
+        self.games.invalidate((game_id, "assignment_done"))
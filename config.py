@@ -7,9 +7,53 @@ load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "0"))
 
-if not BOT_TOKEN:
-    raise ValueError("BOT_TOKEN не установлен в переменных окружения")
+# Адрес Bot API (переопределяется для локального тестового стенда)
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "")
 
-if not ADMIN_USER_ID:
-    raise ValueError("ADMIN_USER_ID не установлен в переменных окружения")
+# Режим получения обновлений: polling (long polling) или webhook
+UPDATE_MODE = os.getenv("UPDATE_MODE", "polling").lower()
+# Публичный адрес, на который Telegram будет отправлять обновления (без пути)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+# Адрес и порт встроенного HTTP-сервера
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", os.getenv("PORT", "8443")))
+# Путь вебхука и секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or None
 
+# Хранилище данных: sqlite (файл DB_PATH) или postgres (DATABASE_URL)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite").lower()
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+
+# Участников на странице /status у администратора и длина имени в списке.
+# 50 имён по 64 символа укладываются в лимит сообщения Telegram (4096)
+STATUS_PAGE_SIZE = int(os.getenv("STATUS_PAGE_SIZE", "50"))
+STATUS_NAME_LIMIT = int(os.getenv("STATUS_NAME_LIMIT", "64"))
+
+# Эндпоинт метрик Prometheus (GET /metrics); без METRICS_PORT не запускается
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+
+def validate():
+    """Проверить обязательные настройки (вызывается при запуске бота, а не при импорте)."""
+    if not BOT_TOKEN:
+        raise ValueError("BOT_TOKEN не установлен в переменных окружения")
+
+    if not ADMIN_USER_ID:
+        raise ValueError("ADMIN_USER_ID не установлен в переменных окружения")
+
+    if UPDATE_MODE not in ("polling", "webhook"):
+        raise ValueError("UPDATE_MODE должен быть polling или webhook")
+
+    if UPDATE_MODE == "webhook" and not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL не установлен в переменных окружения")
+
+    if STORAGE_BACKEND not in ("sqlite", "postgres"):
+        raise ValueError("STORAGE_BACKEND должен быть sqlite или postgres")
+
+    if STORAGE_BACKEND == "postgres" and not DATABASE_URL:
+        raise ValueError("DATABASE_URL не установлен в переменных окружения")
+
+    if not 1 <= STATUS_PAGE_SIZE * (STATUS_NAME_LIMIT + 3) <= 3500:
+        raise ValueError("STATUS_PAGE_SIZE и STATUS_NAME_LIMIT: страница /status не поместится в сообщение")
@@ -1,209 +1,1012 @@
 """Работа с базой данных SQLite."""
+import asyncio
+import functools
+import itertools
+import logging
 import sqlite3
 import os
-from typing import Optional, List, Tuple
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Dict, Iterator, Optional, List, Tuple
+
+import metrics
+from models import PARTICIPANT_COLUMNS, Assignment, ExportRow, Participant, row_factory
+
+logger = logging.getLogger(__name__)
 
 DB_PATH = os.getenv("DB_PATH", "secret_santa.db")
 
+# PRAGMA, применяемые к каждому новому соединению.
+# WAL позволяет читать параллельно с записью и убирает fsync журнала отката,
+# synchronous=NORMAL в режиме WAL безопасен и делает fsync только на checkpoint.
+PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", "-16000"),  # ~16 МБ страничного кэша
+    ("mmap_size", str(64 * 1024 * 1024)),
+    ("temp_store", "MEMORY"),
+    ("busy_timeout", "5000"),
+)
+
+# Размер кэша подготовленных выражений на одно соединение
+STATEMENT_CACHE_SIZE = 128
+
+# Строк в одном INSERT при импорте участников (5 параметров на строку,
+# лимит SQLite — 32766 параметров на выражение)
+IMPORT_BATCH_SIZE = 500
+
+# Аудитории /broadcast: условие на участника p и его назначение a
+BROADCAST_AUDIENCES = {
+    "all": "1 = 1",
+    "unassigned": "a.giver_id IS NULL",
+    "unnotified": "a.giver_id IS NOT NULL AND a.notified_at IS NULL",
+}
+
+# Триггеры, которые держат game_stats и registration_stats в актуальном
+# состоянии. Строка игры создаётся первым изменением; пустые часы удаляются
+_STATS_ROW = "INSERT OR IGNORE INTO game_stats (game_id) VALUES ({row}.game_id);"
+_HOUR = "strftime('%Y-%m-%d %H:00', {row}.registered_at)"
+STATS_TRIGGERS = (
+    f"""
+    CREATE TRIGGER stats_participant_insert AFTER INSERT ON participants BEGIN
+        {_STATS_ROW.format(row="NEW")}
+        UPDATE game_stats SET participants = participants + 1 WHERE game_id = NEW.game_id;
+        INSERT INTO registration_stats (game_id, hour, participants)
+        VALUES (NEW.game_id, {_HOUR.format(row="NEW")}, 1)
+        ON CONFLICT (game_id, hour) DO UPDATE SET participants = participants + 1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER stats_participant_delete AFTER DELETE ON participants BEGIN
+        UPDATE game_stats SET participants = participants - 1 WHERE game_id = OLD.game_id;
+        UPDATE registration_stats SET participants = participants - 1
+        WHERE game_id = OLD.game_id AND hour = {_HOUR.format(row="OLD")};
+        DELETE FROM registration_stats
+        WHERE game_id = OLD.game_id AND hour = {_HOUR.format(row="OLD")} AND participants <= 0;
+    END
+    """,
+    f"""
+    CREATE TRIGGER stats_participant_move AFTER UPDATE OF game_id, registered_at ON participants BEGIN
+        UPDATE game_stats SET participants = participants - 1 WHERE game_id = OLD.game_id;
+        {_STATS_ROW.format(row="NEW")}
+        UPDATE game_stats SET participants = participants + 1 WHERE game_id = NEW.game_id;
+        UPDATE registration_stats SET participants = participants - 1
+        WHERE game_id = OLD.game_id AND hour = {_HOUR.format(row="OLD")};
+        DELETE FROM registration_stats
+        WHERE game_id = OLD.game_id AND hour = {_HOUR.format(row="OLD")} AND participants <= 0;
+        INSERT INTO registration_stats (game_id, hour, participants)
+        VALUES (NEW.game_id, {_HOUR.format(row="NEW")}, 1)
+        ON CONFLICT (game_id, hour) DO UPDATE SET participants = participants + 1;
+    END
+    """,
+    f"""
+    CREATE TRIGGER stats_assignment_insert AFTER INSERT ON assignments BEGIN
+        {_STATS_ROW.format(row="NEW")}
+        UPDATE game_stats SET assigned = assigned + 1, notified = notified + (NEW.notified_at IS NOT NULL)
+        WHERE game_id = NEW.game_id;
+    END
+    """,
+    """
+    CREATE TRIGGER stats_assignment_delete AFTER DELETE ON assignments BEGIN
+        UPDATE game_stats SET assigned = assigned - 1, notified = notified - (OLD.notified_at IS NOT NULL)
+        WHERE game_id = OLD.game_id;
+    END
+    """,
+    """
+    CREATE TRIGGER stats_assignment_notified AFTER UPDATE OF notified_at ON assignments
+    WHEN (OLD.notified_at IS NULL) != (NEW.notified_at IS NULL) BEGIN
+        UPDATE game_stats SET notified = notified + (NEW.notified_at IS NOT NULL) - (OLD.notified_at IS NOT NULL)
+        WHERE game_id = NEW.game_id;
+    END
+    """,
+)
+
+# Статусы уведомлений в outbox
+OUTBOX_STATUSES = ("pending", "sending", "sent", "failed")
+
+# Игра по умолчанию: в неё попадают данные баз, созданных до поддержки нескольких игр,
+# и участники, которые пишут боту в личку, не выбрав другую игру
+DEFAULT_GAME_ID = 0
+DEFAULT_GAME_TITLE = "Тайный Санта"
+
 
 class Database:
-    """Класс для работы с базой данных."""
-    
+    """Класс для работы с базой данных.
+
+    Держит одно долгоживущее соединение на поток вместо открытия нового
+    на каждый вызов. Соединения закрываются через close() или при выходе
+    из блока with. Файл базы открывается и миграции применяются при первом
+    обращении, а не в конструкторе: создание объекта при импорте ничего
+    не стоит.
+    """
+
     def __init__(self, db_path: str = DB_PATH):
         self.db_path = db_path
-        self.init_db()
-    
-    def get_connection(self):
-        """Получить соединение с базой данных."""
-        conn = sqlite3.connect(self.db_path)
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._migrate_lock = threading.Lock()
+        self._migrated = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        """Открыть новое соединение и применить PRAGMA."""
+        conn = sqlite3.connect(
+            self.db_path,
+            isolation_level=None,  # транзакциями управляем явно
+            check_same_thread=False,  # нужно, чтобы close() мог закрыть соединения других потоков
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
         conn.row_factory = sqlite3.Row
+        # lower() в SQLite понимает только ASCII — для поиска по имени нужен Unicode
+        conn.create_function("py_lower", 1, str.lower, deterministic=True)
+        for name, value in PRAGMAS:
+            conn.execute(f"PRAGMA {name} = {value}")
         return conn
-    
-    def init_db(self):
-        """Инициализировать базу данных и создать таблицы."""
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Получить соединение текущего потока (создаётся при первом обращении)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+            if not self._migrated:
+                self.init_db()
+        return conn
+
+    def _select(self, model, sql: str, params=()) -> sqlite3.Cursor:
+        """Выполнить запрос; строки курсора — кортежи model (колонки в порядке его полей)."""
+        cursor = self.get_connection().cursor()
+        cursor.row_factory = row_factory(model)
+        return cursor.execute(sql, params)
+
+    @contextmanager
+    def transaction(self, immediate: bool = False):
+        """Выполнить блок в одной транзакции (один commit на весь блок)."""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def close(self):
+        """Закрыть все открытые соединения."""
+        with self._lock:
+            connections, self._connections = self._connections, []
+            self._local = threading.local()
+        for conn in connections:
+            conn.close()
+
+    def init_db(self):
+        """Инициализировать базу данных: применить недостающие миграции схемы (один раз)."""
+        with self._migrate_lock:
+            if not self._migrated:
+                self.migrate()
+                self._migrated = True
+
+    # Миграции схемы
+
+    def schema_version(self) -> int:
+        """Версия схемы базы (PRAGMA user_version)."""
+        return self.get_connection().execute("PRAGMA user_version").fetchone()[0]
+
+    def migrate(self) -> int:
+        """Применить миграции новее текущей версии схемы и вернуть итоговую версию.
+
+        Каждая миграция выполняется в своей транзакции вместе с повышением
+        user_version, поэтому прерванное обновление не оставляет схему
+        в промежуточном состоянии и продолжается при следующем запуске.
+        """
+        if self.schema_version() == SCHEMA_VERSION:
+            return SCHEMA_VERSION
+        for version, migration in enumerate(MIGRATIONS, 1):
+            # BEGIN IMMEDIATE: два процесса не применят одну миграцию дважды
+            with self.transaction(immediate=True) as conn:
+                current = conn.execute("PRAGMA user_version").fetchone()[0]
+                if current > SCHEMA_VERSION:
+                    raise RuntimeError(
+                        f"Схема базы версии {current} новее поддерживаемой ({SCHEMA_VERSION})"
+                    )
+                if current >= version:
+                    continue
+                logger.info(f"Миграция схемы {version}: {migration.__doc__}")
+                migration(self, conn)
+                conn.execute(f"PRAGMA user_version = {version}")
+        return SCHEMA_VERSION
+
+    def _migration_1_base_schema(self, conn: sqlite3.Connection):
+        """базовая схема с несколькими играми"""
+        # Базы, созданные до появления нескольких игр, переводятся в игру по умолчанию
+        self._migrate_single_game_schema(conn)
+        self._create_tables(conn)
+        conn.execute(
+            "INSERT OR IGNORE INTO games (game_id, title) VALUES (?, ?)",
+            (DEFAULT_GAME_ID, DEFAULT_GAME_TITLE),
+        )
+
+    def _migration_2_assignment_indexes(self, conn: sqlite3.Connection):
+        """уникальный даритель в назначениях, индекс по получателю"""
+        # Дубликаты дарителя могли остаться от прерванных распределений — оставить последний
+        conn.execute("""
+            DELETE FROM assignments
+            WHERE id NOT IN (SELECT MAX(id) FROM assignments GROUP BY game_id, giver_id)
+        """)
+        conn.execute("DROP INDEX IF EXISTS idx_assignments_game_giver")
+        conn.execute("""
+            CREATE UNIQUE INDEX idx_assignments_game_giver
+            ON assignments (game_id, giver_id)
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_assignments_game_receiver
+            ON assignments (game_id, receiver_id)
+        """)
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_participants_game_registered
+            ON participants (game_id, registered_at)
+        """)
+
+    def _migration_3_assignment_notified(self, conn: sqlite3.Connection):
+        """отметка доставки уведомления о назначении"""
+        conn.execute("ALTER TABLE assignments ADD COLUMN notified_at TIMESTAMP")
+
+    def _migration_4_participants_keyset_index(self, conn: sqlite3.Connection):
+        """индекс участников для постраничного просмотра по (registered_at, user_id)"""
+        conn.execute("DROP INDEX IF EXISTS idx_participants_game_registered")
+        conn.execute("""
+            CREATE INDEX idx_participants_game_registered
+            ON participants (game_id, registered_at, user_id)
+        """)
+
+    def _migration_5_game_stats(self, conn: sqlite3.Connection):
+        """статистика игр, которую поддерживают триггеры"""
+        # Итоги по игре и число участников по часу регистрации (UTC). Строки
+        # меняются триггерами в той же транзакции, что и сами данные, поэтому
+        # счётчики точны и после reset_all / clear_all_participants
+        conn.execute("""
+            CREATE TABLE game_stats (
+                game_id INTEGER PRIMARY KEY,
+                participants INTEGER NOT NULL DEFAULT 0,
+                assigned INTEGER NOT NULL DEFAULT 0,
+                notified INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.execute("""
+            CREATE TABLE registration_stats (
+                game_id INTEGER NOT NULL,
+                hour TEXT NOT NULL,
+                participants INTEGER NOT NULL,
+                PRIMARY KEY (game_id, hour)
+            ) WITHOUT ROWID
+        """)
+        for trigger in STATS_TRIGGERS:
+            conn.execute(trigger)
+        # Данные, накопленные до появления триггеров
+        conn.execute("""
+            INSERT INTO game_stats (game_id, participants)
+            SELECT game_id, COUNT(*) FROM participants GROUP BY game_id
+        """)
+        conn.execute("""
+            INSERT INTO game_stats (game_id, assigned, notified)
+            SELECT game_id, COUNT(*), COUNT(notified_at) FROM assignments GROUP BY game_id
+            ON CONFLICT (game_id) DO UPDATE SET assigned = excluded.assigned, notified = excluded.notified
+        """)
+        conn.execute("""
+            INSERT INTO registration_stats (game_id, hour, participants)
+            SELECT game_id, strftime('%Y-%m-%d %H:00', registered_at), COUNT(*)
+            FROM participants GROUP BY 1, 2
+        """)
+
+    def _migration_6_outbox(self, conn: sqlite3.Connection):
+        """очередь уведомлений о назначении"""
+        conn.execute("""
+            CREATE TABLE outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                game_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                claimed_at TIMESTAMP,
+                last_error TEXT,
+                UNIQUE (game_id, chat_id)
+            )
+        """)
+        conn.execute("CREATE INDEX idx_outbox_status_next ON outbox (status, next_attempt_at)")
+        conn.execute("CREATE INDEX idx_outbox_game_status ON outbox (game_id, status)")
+
+    def _create_tables(self, conn: sqlite3.Connection):
+        """Создать таблицы схемы версии 1, если их ещё нет.
+
+        Не изменяется: новые таблицы, индексы и ограничения добавляются
+        отдельными миграциями.
+        """
+        # Таблица игр
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS games (
+                game_id INTEGER PRIMARY KEY,
+                title TEXT NOT NULL,
+                created_by INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Администраторы игр
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS game_admins (
+                game_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                PRIMARY KEY (game_id, user_id),
+                FOREIGN KEY (game_id) REFERENCES games(game_id)
+            )
+        """)
+
+        # Текущая игра пользователя в личном чате с ботом
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_games (
+                user_id INTEGER PRIMARY KEY,
+                game_id INTEGER NOT NULL,
+                FOREIGN KEY (game_id) REFERENCES games(game_id)
+            )
+        """)
+
         # Таблица участников
-        cursor.execute("""
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS participants (
-                user_id INTEGER PRIMARY KEY,
+                game_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
                 username TEXT,
                 full_name TEXT NOT NULL,
                 wish TEXT NOT NULL,
-                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (game_id, user_id),
+                FOREIGN KEY (game_id) REFERENCES games(game_id)
             )
         """)
-        
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_participants_game_registered
+            ON participants (game_id, registered_at)
+        """)
+
         # Таблица распределений
-        cursor.execute("""
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS assignments (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
+                game_id INTEGER NOT NULL,
                 giver_id INTEGER NOT NULL,
                 receiver_id INTEGER NOT NULL,
                 assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (giver_id) REFERENCES participants(user_id),
-                FOREIGN KEY (receiver_id) REFERENCES participants(user_id)
+                FOREIGN KEY (game_id, giver_id) REFERENCES participants(game_id, user_id),
+                FOREIGN KEY (game_id, receiver_id) REFERENCES participants(game_id, user_id)
             )
         """)
-        
-        # Флаг завершения распределения
-        cursor.execute("""
+        conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_assignments_game_giver
+            ON assignments (game_id, giver_id)
+        """)
+
+        # Состояния диалогов ConversationHandler (только незавершённые)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_states (
+                name TEXT NOT NULL,
+                conversation_key TEXT NOT NULL,
+                state TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (name, conversation_key)
+            )
+        """)
+
+        # user_data пользователей (только непустые)
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS user_data (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        # Настройки игры (флаг завершения распределения)
+        conn.execute("""
             CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
+                game_id INTEGER NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (game_id, key)
             )
         """)
-        
-        conn.commit()
-        conn.close()
-    
-    def is_registered(self, user_id: int) -> bool:
-        """Проверить, зарегистрирован ли пользователь."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT user_id FROM participants WHERE user_id = ?", (user_id,))
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None
-    
-    def register_participant(self, user_id: int, username: str, full_name: str, wish: str) -> bool:
-        """Зарегистрировать или обновить данные участника."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        if self.is_registered(user_id):
-            # Обновить существующего участника
-            cursor.execute("""
-                UPDATE participants 
-                SET username = ?, full_name = ?, wish = ?
-                WHERE user_id = ?
-            """, (username, full_name, wish, user_id))
-        else:
-            # Добавить нового участника
-            cursor.execute("""
-                INSERT INTO participants (user_id, username, full_name, wish)
-                VALUES (?, ?, ?, ?)
-            """, (user_id, username, full_name, wish))
-        
-        conn.commit()
-        conn.close()
+
+    def _migrate_single_game_schema(self, conn: sqlite3.Connection):
+        """Перенести данные из схемы с одной игрой в игру DEFAULT_GAME_ID."""
+        columns = {row["name"] for row in conn.execute("PRAGMA table_info(participants)")}
+        if not columns or "game_id" in columns:
+            return
+
+        for table in ("participants", "assignments", "settings"):
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_single_game")
+        self._create_tables(conn)
+        conn.execute(
+            "INSERT OR IGNORE INTO games (game_id, title) VALUES (?, ?)",
+            (DEFAULT_GAME_ID, DEFAULT_GAME_TITLE),
+        )
+        conn.execute("""
+            INSERT INTO participants (game_id, user_id, username, full_name, wish, registered_at)
+            SELECT ?, user_id, username, full_name, wish, registered_at FROM participants_single_game
+        """, (DEFAULT_GAME_ID,))
+        conn.execute("""
+            INSERT INTO assignments (game_id, giver_id, receiver_id, assigned_at)
+            SELECT ?, giver_id, receiver_id, assigned_at FROM assignments_single_game
+        """, (DEFAULT_GAME_ID,))
+        conn.execute("""
+            INSERT INTO settings (game_id, key, value)
+            SELECT ?, key, value FROM settings_single_game
+        """, (DEFAULT_GAME_ID,))
+        for table in ("assignments", "participants", "settings"):
+            conn.execute(f"DROP TABLE {table}_single_game")
+
+    # Игры
+
+    def create_game(self, game_id: int, title: str, admin_id: int) -> bool:
+        """Создать игру и назначить её администратора. False, если игра уже есть."""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO games (game_id, title, created_by) VALUES (?, ?, ?)",
+                (game_id, title, admin_id),
+            )
+            if cursor.rowcount == 0:
+                return False
+            conn.execute(
+                "INSERT OR IGNORE INTO game_admins (game_id, user_id) VALUES (?, ?)",
+                (game_id, admin_id),
+            )
         return True
-    
-    def get_participant(self, user_id: int) -> Optional[dict]:
-        """Получить данные участника."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM participants WHERE user_id = ?", (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        
+
+    def get_game(self, game_id: int) -> Optional[dict]:
+        """Получить данные игры."""
+        row = self.get_connection().execute(
+            "SELECT * FROM games WHERE game_id = ?", (game_id,)
+        ).fetchone()
+
         if row:
             return dict(row)
         return None
-    
-    def get_all_participants(self) -> List[dict]:
-        """Получить список всех участников."""
+
+    def add_game_admin(self, game_id: int, user_id: int):
+        """Назначить администратора игры."""
+        self.get_connection().execute(
+            "INSERT OR IGNORE INTO game_admins (game_id, user_id) VALUES (?, ?)",
+            (game_id, user_id),
+        )
+
+    def is_game_admin(self, game_id: int, user_id: int) -> bool:
+        """Проверить, является ли пользователь администратором игры."""
+        row = self.get_connection().execute(
+            "SELECT 1 FROM game_admins WHERE game_id = ? AND user_id = ?", (game_id, user_id)
+        ).fetchone()
+        return row is not None
+
+    def get_admin_ids(self) -> List[int]:
+        """ID всех администраторов игр."""
+        rows = self.get_connection().execute("SELECT DISTINCT user_id FROM game_admins ORDER BY user_id")
+        return [row["user_id"] for row in rows]
+
+    def get_user_game(self, user_id: int) -> int:
+        """Получить игру, выбранную пользователем в личном чате."""
+        row = self.get_connection().execute(
+            "SELECT game_id FROM user_games WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row["game_id"] if row else DEFAULT_GAME_ID
+
+    def set_user_game(self, user_id: int, game_id: int):
+        """Запомнить игру, выбранную пользователем в личном чате."""
+        self.get_connection().execute(
+            "INSERT OR REPLACE INTO user_games (user_id, game_id) VALUES (?, ?)",
+            (user_id, game_id),
+        )
+
+    # Состояние диалогов
+
+    def load_conversations(self, name: str) -> Dict[str, str]:
+        """Получить сохранённые состояния диалога: ключ (JSON) → состояние (JSON)."""
+        rows = self.get_connection().execute(
+            "SELECT conversation_key, state FROM conversation_states WHERE name = ?", (name,)
+        ).fetchall()
+        return {row["conversation_key"]: row["state"] for row in rows}
+
+    def load_conversation(self, name: str, key: str) -> Optional[str]:
+        """Получить сохранённое состояние одного диалога (JSON)."""
+        row = self.get_connection().execute(
+            "SELECT state FROM conversation_states WHERE name = ? AND conversation_key = ?", (name, key)
+        ).fetchone()
+        return row["state"] if row else None
+
+    def get_user_data_ids(self) -> List[int]:
+        """Получить ID пользователей, для которых сохранены user_data."""
+        rows = self.get_connection().execute("SELECT user_id FROM user_data").fetchall()
+        return [row["user_id"] for row in rows]
+
+    def load_user_data(self, user_id: int) -> Optional[str]:
+        """Получить сохранённые user_data пользователя (JSON)."""
+        row = self.get_connection().execute(
+            "SELECT data FROM user_data WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row["data"] if row else None
+
+    def save_persistence_batch(
+        self,
+        conversations: List[Tuple[str, str, Optional[str]]],
+        user_data: List[Tuple[int, Optional[str]]],
+    ):
+        """Записать накопленные изменения одной транзакцией.
+
+        conversations — (имя, ключ, состояние), user_data — (user_id, данные);
+        None вместо состояния или данных удаляет запись.
+        """
+        with self.transaction() as conn:
+            conn.executemany(
+                "DELETE FROM conversation_states WHERE name = ? AND conversation_key = ?",
+                [(name, key) for name, key, state in conversations if state is None],
+            )
+            conn.executemany("""
+                INSERT OR REPLACE INTO conversation_states (name, conversation_key, state)
+                VALUES (?, ?, ?)
+            """, [item for item in conversations if item[2] is not None])
+            conn.executemany(
+                "DELETE FROM user_data WHERE user_id = ?",
+                [(user_id,) for user_id, data in user_data if data is None],
+            )
+            conn.executemany(
+                "INSERT OR REPLACE INTO user_data (user_id, data) VALUES (?, ?)",
+                [item for item in user_data if item[1] is not None],
+            )
+
+    # Участники
+
+    def is_registered(self, game_id: int, user_id: int) -> bool:
+        """Проверить, зарегистрирован ли пользователь."""
+        row = self.get_connection().execute(
+            "SELECT user_id FROM participants WHERE game_id = ? AND user_id = ?", (game_id, user_id)
+        ).fetchone()
+        return row is not None
+
+    def register_participant(self, game_id: int, user_id: int, username: str, full_name: str, wish: str) -> bool:
+        """Зарегистрировать или обновить данные участника одним upsert."""
+        self.get_connection().execute("""
+            INSERT INTO participants (game_id, user_id, username, full_name, wish)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (game_id, user_id) DO UPDATE
+            SET username = excluded.username, full_name = excluded.full_name, wish = excluded.wish
+        """, (game_id, user_id, username, full_name, wish))
+        return True
+
+    def import_participants(self, game_id: int, rows: List[Tuple[int, Optional[str], str, str]]) -> Tuple[int, int]:
+        """Загрузить участников (user_id, username, full_name, wish) одной транзакцией.
+
+        Строки пишутся пачками по IMPORT_BATCH_SIZE в одном многострочном
+        INSERT ... ON CONFLICT DO UPDATE; пустой username не затирает
+        сохранённый. Возвращает (добавлено, обновлено).
+        """
+        with self.transaction(immediate=True) as conn:
+            before = self.get_participant_count(game_id)
+            for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+                batch = rows[start:start + IMPORT_BATCH_SIZE]
+                conn.execute(f"""
+                    INSERT INTO participants (game_id, user_id, username, full_name, wish)
+                    VALUES {", ".join(["(?, ?, ?, ?, ?)"] * len(batch))}
+                    ON CONFLICT (game_id, user_id) DO UPDATE
+                    SET username = COALESCE(excluded.username, participants.username),
+                        full_name = excluded.full_name, wish = excluded.wish
+                """, [value for row in batch for value in (game_id, *row)])
+            inserted = self.get_participant_count(game_id) - before
+        return inserted, len(rows) - inserted
+
+    def get_participant(self, game_id: int, user_id: int) -> Optional[Participant]:
+        """Получить данные участника."""
+        return self._select(
+            Participant,
+            f"SELECT {PARTICIPANT_COLUMNS} FROM participants WHERE game_id = ? AND user_id = ?",
+            (game_id, user_id),
+        ).fetchone()
+
+    def get_participants_page(
+        self,
+        game_id: int,
+        anchor_id: Optional[int] = None,
+        backward: bool = False,
+        limit: int = 50,
+        search: Optional[str] = None,
+    ) -> List[Participant]:
+        """Страница участников в порядке регистрации (keyset по registered_at, user_id).
+
+        Возвращает до limit + 1 строк после участника anchor_id (или до него,
+        если backward) — лишняя строка показывает, что есть следующая
+        страница. Строки всегда в порядке регистрации. search — подстрока
+        имени без учёта регистра. Если участника anchor_id уже нет — пустой список.
+        """
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM participants ORDER BY registered_at")
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
-    
-    def get_participant_count(self) -> int:
-        """Получить количество участников."""
+        conditions = ["game_id = ?"]
+        params: list = [game_id]
+        if anchor_id is not None:
+            # Значения опорной строки передаются параметрами: с подзапросом
+            # SQLite ищет по индексу только по registered_at и перебирает
+            # всех участников, зарегистрированных в ту же секунду
+            anchor = conn.execute(
+                "SELECT registered_at FROM participants WHERE game_id = ? AND user_id = ?", (game_id, anchor_id)
+            ).fetchone()
+            if anchor is None:
+                return []
+            conditions.append(f"(registered_at, user_id) {'<' if backward else '>'} (?, ?)")
+            params += [anchor["registered_at"], anchor_id]
+        if search:
+            conditions.append("instr(py_lower(full_name), ?) > 0")
+            params.append(search.lower())
+        order = "DESC" if backward else "ASC"
+        page = self._select(Participant, f"""
+            SELECT {PARTICIPANT_COLUMNS} FROM participants
+            WHERE {" AND ".join(conditions)}
+            ORDER BY registered_at {order}, user_id {order}
+            LIMIT ?
+        """, (*params, limit + 1)).fetchall()
+        return page[::-1] if backward else page
+
+    @staticmethod
+    def _iter_cursor(cursor: sqlite3.Cursor, batch_size: int) -> Iterator:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+    def get_participant_ids(self, game_id: int) -> List[int]:
+        """Получить ID участников в порядке регистрации (только из индекса, без строк таблицы)."""
+        rows = self.get_connection().execute(
+            "SELECT user_id FROM participants WHERE game_id = ? ORDER BY registered_at, user_id", (game_id,)
+        ).fetchall()
+        return [row["user_id"] for row in rows]
+
+    def get_participant_count(self, game_id: int) -> int:
+        """Получить количество участников (из game_stats, без подсчёта строк)."""
+        row = self.get_connection().execute(
+            "SELECT participants FROM game_stats WHERE game_id = ?", (game_id,)
+        ).fetchone()
+        return row["participants"] if row else 0
+
+    def get_stats(self, game_id: int, hours: int = 24) -> dict:
+        """Счётчики игры и регистрации по часам (последние hours часов с регистрациями)."""
         conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) as count FROM participants")
-        result = cursor.fetchone()
-        conn.close()
-        return result["count"] if result else 0
-    
-    def is_assignment_done(self) -> bool:
+        row = conn.execute(
+            "SELECT participants, assigned, notified FROM game_stats WHERE game_id = ?", (game_id,)
+        ).fetchone()
+        stats = dict(row) if row else {"participants": 0, "assigned": 0, "notified": 0}
+        rows = conn.execute("""
+            SELECT hour, participants FROM registration_stats
+            WHERE game_id = ? ORDER BY hour DESC LIMIT ?
+        """, (game_id, hours)).fetchall()
+        stats["hours"] = [(row["hour"], row["participants"]) for row in reversed(rows)]
+        return stats
+
+    # Распределение
+
+    def is_assignment_done(self, game_id: int) -> bool:
         """Проверить, выполнено ли распределение."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT value FROM settings WHERE key = 'assignment_done'")
-        result = cursor.fetchone()
-        conn.close()
-        return result is not None and result["value"] == "1"
-    
-    def mark_assignment_done(self):
-        """Пометить распределение как выполненное."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT OR REPLACE INTO settings (key, value)
-            VALUES ('assignment_done', '1')
-        """)
-        conn.commit()
-        conn.close()
-    
-    def clear_assignments(self):
-        """Очистить все распределения."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM assignments")
-        conn.commit()
-        conn.close()
-    
-    def save_assignments(self, assignments: List[Tuple[int, int]]):
-        """Сохранить распределения."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        
-        # Очистить старые распределения
-        self.clear_assignments()
-        
-        # Сохранить новые
-        cursor.executemany("""
-            INSERT INTO assignments (giver_id, receiver_id)
-            VALUES (?, ?)
-        """, assignments)
-        
-        conn.commit()
-        conn.close()
-    
-    def get_assignment(self, giver_id: int) -> Optional[dict]:
+        row = self.get_connection().execute(
+            "SELECT value FROM settings WHERE game_id = ? AND key = 'assignment_done'", (game_id,)
+        ).fetchone()
+        return row is not None and row["value"] == "1"
+
+    def clear_assignments(self, game_id: int):
+        """Очистить все распределения и неотправленные уведомления о них."""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM assignments WHERE game_id = ?", (game_id,))
+            conn.execute("DELETE FROM outbox WHERE game_id = ?", (game_id,))
+
+    def commit_assignment_round(self, game_id: int, assignments: List[Tuple[int, int]]) -> bool:
+        """Атомарно сохранить распределение и поднять флаг его выполнения.
+
+        Удаление старых пар, вставка новых, уведомления дарителям в outbox
+        и флаг — одна транзакция BEGIN IMMEDIATE (один commit): после сбоя
+        игра остаётся либо без пар и без флага, либо с парами, очередью
+        уведомлений и флагом. Флаг проверяется под блокировкой записи,
+        поэтому из двух одновременных распределений сохранится одно.
+        Возвращает False, если распределение уже выполнено.
+        """
+        with self.transaction(immediate=True) as conn:
+            row = conn.execute(
+                "SELECT value FROM settings WHERE game_id = ? AND key = 'assignment_done'", (game_id,)
+            ).fetchone()
+            if row is not None and row["value"] == "1":
+                return False
+            conn.execute("DELETE FROM assignments WHERE game_id = ?", (game_id,))
+            conn.executemany("""
+                INSERT INTO assignments (game_id, giver_id, receiver_id)
+                VALUES (?, ?, ?)
+            """, ((game_id, giver_id, receiver_id) for giver_id, receiver_id in assignments))
+            conn.execute("DELETE FROM outbox WHERE game_id = ?", (game_id,))
+            conn.execute("""
+                INSERT INTO outbox (game_id, chat_id)
+                SELECT game_id, giver_id FROM assignments WHERE game_id = ? ORDER BY giver_id
+            """, (game_id,))
+            conn.execute("""
+                INSERT OR REPLACE INTO settings (game_id, key, value)
+                VALUES (?, 'assignment_done', '1')
+            """, (game_id,))
+        return True
+
+    def get_assignment(self, game_id: int, giver_id: int) -> Optional[Assignment]:
         """Получить назначение для дарителя."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT p.* FROM participants p
-            JOIN assignments a ON p.user_id = a.receiver_id
-            WHERE a.giver_id = ?
-        """, (giver_id,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
-            return dict(row)
-        return None
-    
-    def clear_all_participants(self):
+        return self._select(Assignment, """
+            SELECT a.giver_id, a.receiver_id, p.full_name, p.wish FROM assignments a
+            JOIN participants p ON p.game_id = a.game_id AND p.user_id = a.receiver_id
+            WHERE a.game_id = ? AND a.giver_id = ?
+        """, (game_id, giver_id)).fetchone()
+
+    # Очередь уведомлений
+
+    def claim_outbox(self, limit: int) -> List[dict]:
+        """Забрать до limit уведомлений, которым пора уйти, и пометить их 'sending'.
+
+        Вместе с каждым возвращаются данные для текста: название игры, ФИО
+        и пожелание получателя (None, если назначения уже нет).
+        """
+        with self.transaction(immediate=True) as conn:
+            ids = [row["id"] for row in conn.execute("""
+                UPDATE outbox SET status = 'sending', attempts = attempts + 1, claimed_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM outbox
+                    WHERE status = 'pending' AND next_attempt_at <= CURRENT_TIMESTAMP
+                    ORDER BY next_attempt_at, id LIMIT ?
+                )
+                RETURNING id
+            """, (limit,))]
+            if not ids:
+                return []
+            rows = conn.execute(f"""
+                SELECT o.id, o.game_id, o.chat_id, o.attempts, g.title, r.full_name, r.wish
+                FROM outbox o
+                LEFT JOIN games g ON g.game_id = o.game_id
+                LEFT JOIN assignments a ON a.game_id = o.game_id AND a.giver_id = o.chat_id
+                LEFT JOIN participants r ON r.game_id = a.game_id AND r.user_id = a.receiver_id
+                WHERE o.id IN ({", ".join("?" * len(ids))})
+                ORDER BY o.id
+            """, ids).fetchall()
+        return [dict(row) for row in rows]
+
+    def finish_outbox(
+        self,
+        sent: List[int],
+        retry: List[Tuple[int, float, str]] = (),
+        failed: List[Tuple[int, str]] = (),
+    ):
+        """Записать итог отправки забранных уведомлений.
+
+        sent — доставлены (даритель отмечается уведомлённым), retry —
+        (id, через сколько секунд повторить, ошибка), failed — (id, ошибка).
+        """
+        with self.transaction() as conn:
+            conn.executemany(
+                "UPDATE outbox SET status = 'sent', last_error = NULL WHERE id = ?", ((i,) for i in sent)
+            )
+            if sent:
+                conn.execute(f"""
+                    UPDATE assignments SET notified_at = CURRENT_TIMESTAMP
+                    WHERE notified_at IS NULL AND (game_id, giver_id) IN (
+                        SELECT game_id, chat_id FROM outbox WHERE id IN ({", ".join("?" * len(sent))})
+                    )
+                """, list(sent))
+            conn.executemany("""
+                UPDATE outbox SET status = 'pending', last_error = ?,
+                    next_attempt_at = datetime('now', '+' || ? || ' seconds')
+                WHERE id = ?
+            """, ((error, int(round(delay)), i) for i, delay, error in retry))
+            conn.executemany(
+                "UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?",
+                ((error, i) for i, error in failed),
+            )
+
+    def fail_stale_outbox(self, older_than: float = 0) -> int:
+        """Пометить 'failed' уведомления, зависшие в 'sending' дольше older_than секунд.
+
+        Такие уведомления забрал процесс, который упал во время отправки:
+        дошли ли они, неизвестно, поэтому автоматически они не повторяются
+        (повторить можно через /resend). Возвращает их число.
+        """
+        cursor = self.get_connection().execute("""
+            UPDATE outbox SET status = 'failed', last_error = 'отправка прервана'
+            WHERE status = 'sending' AND claimed_at <= datetime('now', '-' || ? || ' seconds')
+        """, (int(older_than),))
+        return cursor.rowcount
+
+    def requeue_failed_outbox(self, game_id: int) -> int:
+        """Вернуть в очередь неотправленные уведомления игры. Возвращает их число."""
+        cursor = self.get_connection().execute("""
+            UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = CURRENT_TIMESTAMP
+            WHERE game_id = ? AND status = 'failed'
+        """, (game_id,))
+        return cursor.rowcount
+
+    def get_outbox_stats(self, game_id: int) -> Dict[str, int]:
+        """Число уведомлений игры по статусам (pending, sending, sent, failed)."""
+        rows = self.get_connection().execute(
+            "SELECT status, COUNT(*) AS count FROM outbox WHERE game_id = ? GROUP BY status", (game_id,)
+        ).fetchall()
+        stats = dict.fromkeys(OUTBOX_STATUSES, 0)
+        stats.update((row["status"], row["count"]) for row in rows)
+        return stats
+
+    def get_broadcast_recipients(self, game_id: int, audience: str) -> List[int]:
+        """Получить ID участников для рассылки в порядке регистрации.
+
+        audience: all — все участники, unassigned — без назначения,
+        unnotified — с назначением, уведомление о котором не доставлено.
+        """
+        rows = self.get_connection().execute(f"""
+            SELECT p.user_id FROM participants p
+            LEFT JOIN assignments a ON a.game_id = p.game_id AND a.giver_id = p.user_id
+            WHERE p.game_id = ? AND {BROADCAST_AUDIENCES[audience]}
+            ORDER BY p.registered_at
+        """, (game_id,)).fetchall()
+        return [row["user_id"] for row in rows]
+
+    def get_export_rows(self, game_id: int) -> List[ExportRow]:
+        """Получить участников вместе с их получателями одним запросом."""
+        return list(self.iter_export_rows(game_id))
+
+    def iter_export_rows(self, game_id: int, batch_size: int = 500) -> Iterator[ExportRow]:
+        """Лениво перебрать строки выгрузки курсором."""
+        cursor = self._select(ExportRow, """
+            SELECT p.user_id, p.username, p.full_name, p.wish,
+                   r.full_name AS receiver_name, r.wish AS receiver_wish
+            FROM participants p
+            LEFT JOIN assignments a ON a.game_id = p.game_id AND a.giver_id = p.user_id
+            LEFT JOIN participants r ON r.game_id = a.game_id AND r.user_id = a.receiver_id
+            WHERE p.game_id = ?
+            ORDER BY p.registered_at, p.user_id
+        """, (game_id,))
+        return self._iter_cursor(cursor, batch_size)
+
+    def clear_all_participants(self, game_id: int):
         """Очистить всех участников."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM participants")
-        conn.commit()
-        conn.close()
-    
-    def reset_assignment_flag(self):
+        self.get_connection().execute("DELETE FROM participants WHERE game_id = ?", (game_id,))
+
+    def get_setting(self, game_id: int, key: str) -> Optional[str]:
+        """Значение настройки игры или None."""
+        row = self.get_connection().execute(
+            "SELECT value FROM settings WHERE game_id = ? AND key = ?", (game_id, key)
+        ).fetchone()
+        return row["value"] if row else None
+
+    def set_setting(self, game_id: int, key: str, value: str):
+        """Записать настройку игры."""
+        self.get_connection().execute(
+            "INSERT OR REPLACE INTO settings (game_id, key, value) VALUES (?, ?, ?)", (game_id, key, value)
+        )
+
+    def reset_assignment_flag(self, game_id: int):
         """Сбросить флаг выполнения распределения."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM settings WHERE key = 'assignment_done'")
-        conn.commit()
-        conn.close()
-    
-    def reset_all(self):
-        """Полный сброс: очистить всех участников, распределения и настройки."""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM participants")
-        cursor.execute("DELETE FROM assignments")
-        cursor.execute("DELETE FROM settings")
-        conn.commit()
-        conn.close()
+        self.get_connection().execute(
+            "DELETE FROM settings WHERE game_id = ? AND key = 'assignment_done'", (game_id,)
+        )
+
+    def reset_all(self, game_id: int):
+        """Полный сброс игры: очистить участников, распределения и настройки."""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM participants WHERE game_id = ?", (game_id,))
+            conn.execute("DELETE FROM assignments WHERE game_id = ?", (game_id,))
+            conn.execute("DELETE FROM outbox WHERE game_id = ?", (game_id,))
+            conn.execute("DELETE FROM settings WHERE game_id = ?", (game_id,))
+
+
+# Миграции по порядку: номер версии схемы — позиция в списке, начиная с 1
+MIGRATIONS = (
+    Database._migration_1_base_schema,
+    Database._migration_2_assignment_indexes,
+    Database._migration_3_assignment_notified,
+    Database._migration_4_participants_keyset_index,
+    Database._migration_5_game_stats,
+    Database._migration_6_outbox,
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+class AsyncDatabase:
+    """Асинхронная обёртка над Database с тем же набором методов.
+
+    Все обращения к SQLite выполняются в одном выделенном потоке, поэтому
+    цикл событий бота не блокируется на диске, а запросы к базе
+    выполняются строго по очереди на одном соединении.
+    """
+
+    def __init__(self, database: Database):
+        self.database = database
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        # Вызовы, которые ждут очереди или выполняются в потоке базы
+        self.pending = 0
+        # Блокировки try_lock по именам
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def run(self, func, *args, **kwargs):
+        """Выполнить синхронную функцию в потоке базы данных."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(func, *args, **kwargs)
+        )
+
+    def __getattr__(self, name: str):
+        attr = getattr(self.database, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def method(*args, **kwargs):
+            started = time.perf_counter()
+            self.pending += 1
+            try:
+                return await self.run(attr, *args, **kwargs)
+            except Exception:
+                metrics.DB_ERRORS.inc(method=name)
+                raise
+            finally:
+                self.pending -= 1
+                metrics.DB_SECONDS.observe(time.perf_counter() - started, method=name)
+
+        # Запомнить обёртку, чтобы не создавать её при каждом вызове
+        setattr(self, name, method)
+        return method
+
+    @asynccontextmanager
+    async def try_lock(self, name: str) -> AsyncIterator[bool]:
+        """Взять блокировку name на время блока, не дожидаясь её: True, если взята.
+
+        С файлом SQLite работает один процесс, поэтому блокировки — в его памяти.
+        """
+        lock = self._locks.setdefault(name, asyncio.Lock())
+        if lock.locked():
+            yield False
+            return
+        async with lock:
+            yield True
+
+    async def _iterate(self, name: str, *args, batch_size: int) -> AsyncIterator:
+        """Перебрать синхронный итератор базы порциями по batch_size.
+
+        Курсор живёт в потоке базы, каждая порция читается отдельным
+        вызовом, поэтому между порциями выполняются запросы других
+        обработчиков. Строки, изменённые за это время, могут попасть или
+        не попасть в перебор.
+        """
+        rows = await self.run(getattr(self.database, name), *args, batch_size=batch_size)
+        try:
+            while True:
+                batch = await self.run(lambda: list(itertools.islice(rows, batch_size)))
+                if not batch:
+                    break
+                for row in batch:
+                    yield row
+        finally:
+            await self.run(rows.close)
+
+    def iter_export_rows(self, game_id: int, batch_size: int = 500) -> AsyncIterator[ExportRow]:
+        """Лениво перебрать строки выгрузки в порядке регистрации."""
+        return self._iterate("iter_export_rows", game_id, batch_size=batch_size)
 
+    async def close(self):
+        """Закрыть соединения и остановить поток базы данных."""
+        await self.run(self.database.close)
+        self._executor.shutdown(wait=True)
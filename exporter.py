@@ -0,0 +1,138 @@
+"""Выгрузка таблицы участников: текстом, в CSV или XLSX."""
+import csv
+import html
+import io
+import os
+from typing import List
+
+from models import ExportRow
+
+try:
+    from openpyxl import Workbook
+except ImportError:  # XLSX-выгрузка необязательна
+    Workbook = None
+
+# До скольких участников выгрузка по умолчанию отправляется текстом
+EXPORT_TEXT_MAX_ROWS = int(os.getenv("EXPORT_TEXT_MAX_ROWS", "30"))
+# Максимальная длина сообщения в Telegram
+MAX_MESSAGE_LENGTH = 4096
+
+FORMAT_TEXT = "text"
+FORMAT_CSV = "csv"
+FORMAT_XLSX = "xlsx"
+FORMATS = (FORMAT_TEXT, FORMAT_CSV, FORMAT_XLSX)
+
+HEADER = ("№", "ID", "Username", "ФИО", "Желаемый подарок", "Получатель", "Подарок получателя")
+
+
+def xlsx_available() -> bool:
+    """Установлен ли openpyxl."""
+    return Workbook is not None
+
+
+def table_row(idx: int, row: ExportRow) -> tuple:
+    """Строка таблицы в порядке колонок HEADER."""
+    return (
+        idx,
+        row.user_id,
+        row.username or "",
+        row.full_name,
+        row.wish,
+        row.receiver_name or "",
+        row.receiver_wish or "",
+    )
+
+
+class CsvBuilder:
+    """CSV-файл, в который строки дописываются по одной (UTF-8 с BOM для Excel)."""
+
+    def __init__(self):
+        self.count = 0
+        self.buffer = io.BytesIO()
+        self.text = io.TextIOWrapper(self.buffer, encoding="utf-8-sig", newline="")
+        self.writer = csv.writer(self.text)
+        self.writer.writerow(HEADER)
+
+    def add(self, row: ExportRow):
+        self.count += 1
+        self.writer.writerow(table_row(self.count, row))
+
+    def finish(self) -> io.BytesIO:
+        self.text.flush()
+        self.text.detach()
+        self.buffer.seek(0)
+        return self.buffer
+
+
+class XlsxBuilder:
+    """XLSX-файл в потоковом режиме openpyxl (write_only), строки дописываются по одной."""
+
+    def __init__(self):
+        if Workbook is None:
+            raise RuntimeError("Для выгрузки в XLSX установите openpyxl")
+        self.count = 0
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("Участники")
+        self.sheet.append(HEADER)
+
+    def add(self, row: ExportRow):
+        self.count += 1
+        self.sheet.append(table_row(self.count, row))
+
+    def finish(self) -> io.BytesIO:
+        buffer = io.BytesIO()
+        self.workbook.save(buffer)
+        buffer.seek(0)
+        return buffer
+
+
+def builder(export_format: str):
+    """Построитель файла выгрузки формата csv или xlsx."""
+    return XlsxBuilder() if export_format == FORMAT_XLSX else CsvBuilder()
+
+
+def _cut(value: str, width: int) -> str:
+    return value[:width - 1] if len(value) > width - 1 else value
+
+
+def build_text_lines(rows: List[ExportRow]) -> List[str]:
+    """Сформировать строки текстовой таблицы (как раньше в /export)."""
+    lines = ["📋 ВЫГРУЗКА УЧАСТНИКОВ", ""]
+    lines.append("┌" + "─" * 58 + "┐")
+    lines.append(f"│ {'№':<3} │ {'ФИО':<25} │ {'Желаемый подарок':<25} │")
+    lines.append("├" + "─" * 58 + "┤")
+    for idx, p in enumerate(rows, 1):
+        lines.append(f"│ {idx:<3} │ {_cut(p.full_name, 25):<25} │ {_cut(p.wish, 25):<25} │")
+    lines.append("└" + "─" * 58 + "┘")
+    lines.append("")
+    lines.append(f"📊 Всего участников: {len(rows)}")
+
+    # Если распределение выполнено, добавляем информацию о парах
+    if any(p.receiver_name for p in rows):
+        lines += ["", "", "🎁 РАСПРЕДЕЛЕНИЕ ПОДАРКОВ:"]
+        lines.append("┌" + "─" * 58 + "┐")
+        lines.append(f"│ {'Даритель':<28} │ {'Получатель':<28} │")
+        lines.append("├" + "─" * 58 + "┤")
+        for p in rows:
+            if p.receiver_name:
+                lines.append(f"│ {_cut(p.full_name, 28):<28} │ {_cut(p.receiver_name, 28):<28} │")
+        lines.append("└" + "─" * 58 + "┘")
+    return lines
+
+
+def split_pre_messages(lines: List[str], limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Разбить строки на HTML-сообщения <pre>…</pre>, не разрывая строки."""
+    overhead = len("<pre></pre>")
+    messages = []
+    chunk: List[str] = []
+    size = overhead
+    for line in lines:
+        line = html.escape(line)
+        if chunk and size + len(line) + 1 > limit:
+            messages.append("<pre>" + "\n".join(chunk) + "</pre>")
+            chunk, size = [], overhead
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        messages.append("<pre>" + "\n".join(chunk) + "</pre>")
+    return messages
@@ -0,0 +1,141 @@
+"""Защита от флуда: ограничение частоты обновлений от одного пользователя."""
+import logging
+import math
+import os
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, ContextTypes
+
+import metrics
+from update_processor import command_name
+
+logger = logging.getLogger(__name__)
+
+HEAVY = "heavy"
+COMMAND = "command"
+BUTTON = "button"
+MESSAGE = "message"
+
+# Лимиты по классам обновлений: класс:обновлений_в_секунду:запас,...
+# Пустая строка отключает защиту
+FLOOD_LIMITS = os.getenv("FLOOD_LIMITS", "heavy:0.2:3,command:1:5,button:1:5,message:1:5")
+# Один раз предупредить о паузе (1) или отбрасывать обновления молча (0)
+FLOOD_NOTICE = os.getenv("FLOOD_NOTICE", "1") == "1"
+
+# Как часто удалять полные (давно не использованные) корзины, проверок
+PRUNE_EVERY = 1024
+
+Limits = Dict[str, Tuple[float, float]]
+
+
+def parse_limits(spec: str) -> Limits:
+    """Разобрать FLOOD_LIMITS в словарь класс → (скорость, запас)."""
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            kind, rate, burst = item.split(":")
+            limits[kind.strip()] = (float(rate), float(burst))
+        except ValueError:
+            raise ValueError(f"FLOOD_LIMITS: ожидается класс:скорость:запас, получено {item!r}") from None
+        if kind.strip() not in (HEAVY, COMMAND, BUTTON, MESSAGE):
+            raise ValueError(f"FLOOD_LIMITS: неизвестный класс {kind!r}")
+        if float(rate) <= 0 or float(burst) < 1:
+            raise ValueError(f"FLOOD_LIMITS: скорость должна быть > 0, запас — не меньше 1 ({item!r})")
+    return limits
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "noticed")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+        self.noticed = False
+
+
+class FloodGuard:
+    """Token bucket на каждого пользователя и класс обновлений.
+
+    Экземпляр — callback для TypeHandler в группе перед основными
+    обработчиками: лишнее обновление останавливается ApplicationHandlerStop
+    и до обработчиков (запросов к базе и ответов) не доходит. За паузу
+    пользователь получает не больше одного предупреждения.
+    """
+
+    def __init__(self, heavy_commands: Iterable[str] = (), limits: Optional[Limits] = None,
+                 notice: bool = FLOOD_NOTICE):
+        self.heavy_commands = frozenset(heavy_commands)
+        self.limits = parse_limits(FLOOD_LIMITS) if limits is None else limits
+        self.notice = notice
+        self._buckets: Dict[Tuple[int, str], _Bucket] = {}
+        self._checks = 0
+        self.dropped: Dict[str, int] = {kind: 0 for kind in self.limits}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.limits)
+
+    def classify(self, update: Update) -> Optional[str]:
+        """Класс обновления для лимитов; None — не ограничивается."""
+        if update.callback_query is not None:
+            return BUTTON
+        if update.message is None:
+            return None
+        command = command_name(update)
+        if command is None:
+            return MESSAGE
+        return HEAVY if command in self.heavy_commands else COMMAND
+
+    def check(self, user_id: int, kind: str, now: Optional[float] = None) -> Tuple[bool, float]:
+        """Забрать токен: (разрешено, сколько секунд ждать следующего)."""
+        rate, burst = self.limits[kind]
+        now = time.monotonic() if now is None else now
+        self._checks += 1
+        if self._checks % PRUNE_EVERY == 0:
+            self._prune(now)
+
+        bucket = self._buckets.get((user_id, kind))
+        if bucket is None:
+            bucket = self._buckets[(user_id, kind)] = _Bucket(burst, now)
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.noticed = False
+            return True, 0.0
+        return False, (1 - bucket.tokens) / rate
+
+    def _prune(self, now: float):
+        # Полная корзина ничем не отличается от отсутствующей
+        for key, bucket in list(self._buckets.items()):
+            rate, burst = self.limits[key[1]]
+            if bucket.tokens + (now - bucket.updated) * rate >= burst:
+                del self._buckets[key]
+
+    async def __call__(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        kind = self.classify(update)
+        if user is None or kind not in self.limits:
+            return
+        allowed, retry_after = self.check(user.id, kind)
+        if allowed:
+            return
+
+        self.dropped[kind] += 1
+        metrics.UPDATES_DROPPED.inc(kind=kind)
+        bucket = self._buckets[(user.id, kind)]
+        if self.notice and not bucket.noticed:
+            bucket.noticed = True
+            logger.info(f"Флуд от пользователя {user.id} ({kind}), пауза {retry_after:.1f} с")
+            text = f"⏳ Слишком много запросов. Попробуй через {math.ceil(retry_after)} с."
+            try:
+                if update.callback_query is not None:
+                    await update.callback_query.answer(text)
+                else:
+                    await update.message.reply_text(text)
+            except TelegramError as e:
+                logger.warning(f"Не удалось отправить предупреждение о флуде: {e}")
+        raise ApplicationHandlerStop
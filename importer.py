@@ -0,0 +1,150 @@
+"""Загрузка участников из CSV или XLSX.
+
+Первая строка файла — заголовок. Нужны колонки user_id, full_name и wish,
+username необязателен; подходят и заголовки выгрузки /export (ID,
+Username, ФИО, Желаемый подарок), остальные колонки пропускаются.
+"""
+import csv
+import io
+import os
+import zipfile
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from openpyxl import load_workbook
+except ImportError:  # XLSX-импорт необязателен
+    load_workbook = None
+
+from validation import full_name_error, wish_error
+
+# Максимальный размер загружаемого файла
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(5 * 1024 * 1024)))
+
+FORMAT_CSV = "csv"
+FORMAT_XLSX = "xlsx"
+FORMATS = (FORMAT_CSV, FORMAT_XLSX)
+
+# Названия колонок (в нижнем регистре) → поле участника
+COLUMNS = {
+    "user_id": "user_id",
+    "id": "user_id",
+    "username": "username",
+    "full_name": "full_name",
+    "фио": "full_name",
+    "wish": "wish",
+    "желаемый подарок": "wish",
+}
+REQUIRED = ("user_id", "full_name", "wish")
+
+# Строка для записи в базу: (user_id, username, full_name, wish)
+ParticipantRow = Tuple[int, Optional[str], str, str]
+
+
+@dataclass
+class ImportResult:
+    """Разобранный файл: строки для записи и отклонённые строки с причиной."""
+
+    rows: List[ParticipantRow] = field(default_factory=list)
+    rejected: List[Tuple[int, str]] = field(default_factory=list)
+    inserted: int = 0
+    updated: int = 0
+
+
+def file_format(filename: Optional[str]) -> Optional[str]:
+    """Формат по расширению имени файла; None — не поддерживается."""
+    extension = (filename or "").rsplit(".", 1)[-1].lower()
+    return extension if extension in FORMATS else None
+
+
+def xlsx_available() -> bool:
+    """Установлен ли openpyxl."""
+    return load_workbook is not None
+
+
+def _csv_rows(data: bytes) -> Iterator[Sequence]:
+    text = data.decode("utf-8-sig")
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    return csv.reader(io.StringIO(text, newline=""), dialect)
+
+
+def _xlsx_rows(data: bytes) -> Iterator[Sequence]:
+    if load_workbook is None:
+        raise RuntimeError("Для импорта из XLSX установите openpyxl")
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        # Excel хранит числа как float: 123456789.0 → 123456789
+        value = int(value)
+    return str(value).strip()
+
+
+def _header(cells: Sequence) -> Dict[str, int]:
+    columns = {}
+    for index, name in enumerate(cells):
+        key = COLUMNS.get(_cell(name).lower())
+        if key is not None and key not in columns:
+            columns[key] = index
+    return columns
+
+
+def parse_rows(table: Iterable[Sequence]) -> ImportResult:
+    """Проверить строки таблицы по правилам регистрации.
+
+    Строки нумеруются как в файле (заголовок — строка 1). Если user_id
+    встречается несколько раз, остаётся последняя строка.
+    """
+    result = ImportResult()
+    table = iter(table)
+    columns = _header(next(table, ()))
+    missing = [name for name in REQUIRED if name not in columns]
+    if missing:
+        raise ValueError(f"В заголовке нет колонок: {', '.join(missing)}")
+
+    width = max(columns.values()) + 1
+    by_user: Dict[int, Tuple[int, ParticipantRow]] = {}
+    for line, cells in enumerate(table, 2):
+        cells = [_cell(value) for value in cells[:width]]
+        if not any(cells):
+            continue
+        cells += [""] * (width - len(cells))
+        user_id, full_name, wish = (cells[columns[name]] for name in REQUIRED)
+        username = cells[columns["username"]].lstrip("@") if "username" in columns else ""
+
+        if not (user_id.isascii() and user_id.isdigit()) or int(user_id) == 0:
+            error = f"неверный user_id {user_id[:20]!r}"
+        else:
+            error = full_name_error(full_name) or wish_error(wish)
+        if error:
+            result.rejected.append((line, error))
+            continue
+        previous = by_user.get(int(user_id))
+        if previous is not None:
+            result.rejected.append((previous[0], f"user_id {user_id} повторяется в строке {line}"))
+        by_user[int(user_id)] = (line, (int(user_id), username or None, full_name, wish))
+
+    result.rows = [row for _, row in by_user.values()]
+    result.rejected.sort()
+    return result
+
+
+def parse_file(data: bytes, file_format: str) -> ImportResult:
+    """Разобрать CSV или XLSX. ValueError — файл нельзя прочитать как таблицу участников."""
+    try:
+        table = _xlsx_rows(data) if file_format == FORMAT_XLSX else _csv_rows(data)
+        return parse_rows(table)
+    except UnicodeDecodeError:
+        raise ValueError("CSV должен быть в кодировке UTF-8") from None
+    except (csv.Error, KeyError, OSError, zipfile.BadZipFile) as e:
+        raise ValueError(f"Не удалось прочитать файл: {e}") from None
@@ -0,0 +1,82 @@
+"""Меню команд бота: публикация только при изменении."""
+import hashlib
+import json
+import logging
+from typing import Iterable, List
+
+from telegram import Bot, BotCommand, BotCommandScopeChat, BotCommandScopeDefault
+from telegram.error import TelegramError
+
+from database import DEFAULT_GAME_ID
+
+logger = logging.getLogger(__name__)
+
+USER_COMMANDS = [
+    BotCommand("start", "Начать работу с ботом"),
+    BotCommand("about", "Описание игры и правил"),
+    BotCommand("register", "Зарегистрироваться в игре"),
+    BotCommand("status", "Показать статус регистрации"),
+    BotCommand("game", "Текущая игра и ссылка-приглашение"),
+    BotCommand("help", "Показать меню с командами"),
+    BotCommand("cancel", "Отменить текущую регистрацию"),
+]
+
+# Меню в личном чате администраторов: команды участника и управление игрой
+ADMIN_COMMANDS = USER_COMMANDS + [
+    BotCommand("assign", "Запустить распределение"),
+    BotCommand("export", "Выгрузить участников"),
+    BotCommand("import", "Загрузить участников из файла"),
+    BotCommand("stats", "Статистика регистраций"),
+    BotCommand("resend", "Повторить неотправленные уведомления"),
+    BotCommand("broadcast", "Разослать сообщение участникам"),
+    BotCommand("addadmin", "Назначить администратора игры"),
+    BotCommand("reset_assignments", "Сбросить распределение"),
+    BotCommand("reset", "Полный сброс игры"),
+]
+
+# Хэши опубликованных меню хранятся в настройках игры по умолчанию.
+# После /reset этой игры меню просто опубликуются заново при запуске
+DEFAULT_MENU_KEY = "commands_hash:default"
+ADMIN_MENU_KEY = "commands_hash:admin"
+
+
+def menu_hash(commands: List[BotCommand], *extra) -> str:
+    """Хэш содержимого меню (и дополнительных параметров, от которых оно зависит)."""
+    payload = [[command.command, command.description] for command in commands] + [list(extra)]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode()).hexdigest()[:16]
+
+
+async def publish_default_menu(bot: Bot, storage) -> bool:
+    """Опубликовать меню участников, если оно изменилось. True — опубликовано."""
+    digest = menu_hash(USER_COMMANDS)
+    if await storage.get_setting(DEFAULT_GAME_ID, DEFAULT_MENU_KEY) == digest:
+        return False
+    await bot.set_my_commands(USER_COMMANDS, scope=BotCommandScopeDefault())
+    await storage.set_setting(DEFAULT_GAME_ID, DEFAULT_MENU_KEY, digest)
+    logger.info("Меню команд участников опубликовано")
+    return True
+
+
+async def publish_admin_menu(bot: Bot, user_id: int) -> bool:
+    """Показать меню администратора в личном чате пользователя."""
+    try:
+        await bot.set_my_commands(ADMIN_COMMANDS, scope=BotCommandScopeChat(user_id))
+        return True
+    except TelegramError as e:
+        # Например, пользователь ещё не писал боту
+        logger.warning(f"Не удалось установить меню администратора {user_id}: {e}")
+        return False
+
+
+async def publish_admin_menus(bot: Bot, storage, admin_ids: Iterable[int]) -> int:
+    """Обновить меню всех администраторов, если оно изменилось. Возвращает число чатов."""
+    admin_ids = sorted(set(admin_ids) | set(await storage.get_admin_ids()))
+    digest = menu_hash(ADMIN_COMMANDS, *admin_ids)
+    if await storage.get_setting(DEFAULT_GAME_ID, ADMIN_MENU_KEY) == digest:
+        return 0
+    published = 0
+    for user_id in admin_ids:
+        published += await publish_admin_menu(bot, user_id)
+    await storage.set_setting(DEFAULT_GAME_ID, ADMIN_MENU_KEY, digest)
+    logger.info(f"Меню администраторов опубликовано: {published} из {len(admin_ids)}")
+    return published
@@ -0,0 +1,238 @@
+"""Метрики бота в текстовом формате Prometheus и HTTP-эндпоинт для них."""
+import asyncio
+import bisect
+import functools
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержек, секунд: от долей миллисекунды
+# (запрос к SQLite) до минут (/assign на большой игре)
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Общая часть метрик: имя, описание и имена меток."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def samples(self) -> Iterable[str]:
+        return ()
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    """Монотонно растущий счётчик."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[str]:
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    """Гистограмма с накопительными корзинами, как в клиентах Prometheus."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # Для каждого набора меток: счётчики корзин, сумма, количество
+        self._values: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+        # Первая корзина с границей le >= value
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return state[2] if state else 0
+
+    def samples(self) -> Iterable[str]:
+        for key, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labels, key)} {count}"
+
+
+class Gauge(Metric):
+    """Текущее значение, которое вычисляется функцией в момент чтения метрик.
+
+    Функция возвращает словарь {кортеж значений меток: значение}.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labels)
+        self.callback = callback
+
+    def samples(self) -> Iterable[str]:
+        if self.callback is None:
+            return
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"Не удалось вычислить метрику {self.name}: {e}")
+            return
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+
+
+class Registry:
+    """Набор метрик, которые отдаёт эндпоинт."""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_SECONDS = REGISTRY.register(Histogram(
+    "santa_handler_seconds", "Время выполнения обработчиков обновлений", ["handler"]
+))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "santa_handler_errors_total", "Исключения в обработчиках обновлений", ["handler"]
+))
+DB_SECONDS = REGISTRY.register(Histogram(
+    "santa_db_seconds", "Время вызова метода базы данных, включая ожидание в очереди потока базы", ["method"]
+))
+DB_ERRORS = REGISTRY.register(Counter(
+    "santa_db_errors_total", "Исключения в методах базы данных", ["method"]
+))
+SEND_TOTAL = REGISTRY.register(Counter(
+    "santa_send_message_total", "Попытки отправки сообщений при рассылке по результату", ["result"]
+))
+OUTBOX_TOTAL = REGISTRY.register(Counter(
+    "santa_outbox_total", "Уведомления о назначении из outbox по итогу попытки", ["result"]
+))
+UPDATES_DROPPED = REGISTRY.register(Counter(
+    "santa_updates_dropped_total", "Обновления, отброшенные защитой от флуда, по классу", ["kind"]
+))
+
+
+def gauge(name: str, documentation: str, callback: Callable[[], Dict[LabelValues, float]],
+          labels: Sequence[str] = ()) -> Gauge:
+    """Зарегистрировать вычисляемую метрику (заменяет прежнюю с тем же именем)."""
+    return REGISTRY.register(Gauge(name, documentation, labels, callback))
+
+
+def timed_handler(callback):
+    """Обернуть callback обработчика: время выполнения и исключения по его имени."""
+    name = getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+
+    return wrapper
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Заголовки запроса не нужны, но их надо дочитать
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host: str, port: int) -> asyncio.AbstractServer:
+    """Запустить HTTP-сервер, отдающий метрики по GET /metrics."""
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,51 @@
+"""Строки хранилища: компактные неизменяемые кортежи вместо dict на строку.
+
+NamedTuple не хранит ни словаря атрибутов, ни ключей — только значения,
+поэтому список из сотни тысяч участников занимает в несколько раз меньше
+памяти, чем такие же словари. Поля читаются как атрибуты: participant.full_name.
+Порядок полей совпадает с порядком колонок в запросах (*_COLUMNS).
+"""
+from typing import NamedTuple, Optional
+
+
+class Participant(NamedTuple):
+    """Участник игры."""
+
+    user_id: int
+    username: Optional[str]
+    full_name: str
+    wish: str
+
+
+class Assignment(NamedTuple):
+    """Назначение дарителя: кому он дарит подарок."""
+
+    giver_id: int
+    receiver_id: int
+    receiver_name: str
+    receiver_wish: str
+
+
+class ExportRow(NamedTuple):
+    """Строка выгрузки: участник и его получатель (None до распределения)."""
+
+    user_id: int
+    username: Optional[str]
+    full_name: str
+    wish: str
+    receiver_name: Optional[str]
+    receiver_wish: Optional[str]
+
+
+PARTICIPANT_COLUMNS = ", ".join(Participant._fields)
+
+_factories = {}
+
+
+def row_factory(model):
+    """row_factory для курсора sqlite3, собирающий строки в кортежи model."""
+    factory = _factories.get(model)
+    if factory is None:
+        make = model._make
+        factory = _factories[model] = lambda cursor, row: make(row)
+    return factory
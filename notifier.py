@@ -0,0 +1,284 @@
+"""Массовая рассылка сообщений с учётом лимитов Telegram."""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Глобальный лимит Telegram — около 30 сообщений в секунду на бота
+SEND_RATE = float(os.getenv("SEND_RATE", "30"))
+# Не чаще одного сообщения в секунду в один чат
+PER_CHAT_INTERVAL = float(os.getenv("SEND_PER_CHAT_INTERVAL", "1.0"))
+# Сколько отправок может одновременно ждать ответа API
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "20"))
+# Сколько раз повторять отправку при сетевых ошибках и RetryAfter
+SEND_MAX_RETRIES = int(os.getenv("SEND_MAX_RETRIES", "5"))
+# Как часто обновлять сообщение с прогрессом (editMessageText тоже лимитирован)
+PROGRESS_INTERVAL = float(os.getenv("SEND_PROGRESS_INTERVAL", "3.0"))
+
+# Исходы одной попытки отправки
+SENT = "sent"
+FAILED = "failed"
+RETRY_AFTER = "retry_after"
+NETWORK_ERROR = "network_error"
+
+ProgressCallback = Callable[["FanOutResult"], Awaitable[None]]
+
+
+class TokenBucket:
+    """Асинхронный token bucket: не более rate операций в секунду."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Остановить выдачу токенов (например, после RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+        # Токены копятся заново с конца паузы, а не с последней выдачи:
+        # иначе сразу после паузы корзина снова полная и уходит целая пачка
+        self._updated = self._paused_until
+
+    async def acquire(self):
+        """Дождаться и забрать один токен."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + max(0.0, now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class SharedTokenBucket(TokenBucket):
+    """Token bucket, общий для реплик бота: токены и пауза хранятся в базе.
+
+    Токены берутся из хранилища (take_send_tokens) порциями примерно на
+    десятую долю секунды и раздаются локально, поэтому к базе идёт не
+    запрос на каждое сообщение. Пауза после RetryAfter записывается в базу
+    (pause_sends) и останавливает отправку всех реплик.
+    """
+
+    def __init__(self, storage, rate: float, capacity: Optional[float] = None):
+        super().__init__(rate, capacity)
+        self.storage = storage
+        self.chunk = max(1, int(rate / 10))
+        # Локальных токенов нет, пока не взяты из базы
+        self._tokens = 0.0
+        self._pause_published = True
+
+    def pause(self, seconds: float):
+        super().pause(seconds)
+        self._pause_published = False
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    if not self._pause_published:
+                        self._pause_published = True
+                        try:
+                            await self.storage.pause_sends(self._paused_until - now)
+                        except Exception as e:
+                            logger.error(f"Не удалось передать паузу рассылки другим репликам: {e}")
+                        continue
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                try:
+                    granted, wait = await self.storage.take_send_tokens(self.chunk, self.rate, self.capacity)
+                except Exception as e:
+                    logger.error(f"Не удалось получить лимит рассылки из базы: {e}")
+                    granted, wait = 0, 1.0
+                self._tokens += granted
+                if not granted:
+                    await asyncio.sleep(wait)
+
+
+@dataclass
+class FanOutResult:
+    """Итог рассылки."""
+
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+
+class Notifier:
+    """Рассылка сообщений с ограниченной параллельностью и повторами.
+
+    Общий token bucket соблюдает глобальный лимит Telegram, а для каждого
+    чата выдерживается минимальный интервал между сообщениями. На RetryAfter
+    вся рассылка приостанавливается на указанное Telegram время. bucket
+    заменяет собственный token bucket (SharedTokenBucket — общий для реплик).
+    """
+
+    def __init__(
+        self,
+        bot,
+        rate: float = SEND_RATE,
+        per_chat_interval: float = PER_CHAT_INTERVAL,
+        concurrency: int = SEND_CONCURRENCY,
+        max_retries: int = SEND_MAX_RETRIES,
+        bucket: Optional[TokenBucket] = None,
+    ):
+        self.bot = bot
+        self.bucket = bucket if bucket is not None else TokenBucket(rate)
+        self.per_chat_interval = per_chat_interval
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        # Время последней отправки в чат, от старых к новым
+        self._chat_last_sent: Dict[int, float] = OrderedDict()
+
+    async def _wait_for_chat(self, chat_id: int):
+        """Выдержать интервал между сообщениями в один чат."""
+        last = self._chat_last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        now = time.monotonic()
+        chats = self._chat_last_sent
+        chats[chat_id] = now
+        chats.move_to_end(chat_id)
+        # Чаты, интервал которых истёк, больше не нужны — словарь не растёт
+        # с каждым чатом, которому бот когда-либо писал
+        while chats and next(iter(chats.values())) + self.per_chat_interval <= now:
+            chats.popitem(last=False)
+
+    async def send_once(self, chat_id: int, text: str, **kwargs) -> Tuple[str, Optional[str]]:
+        """Одна попытка отправки с соблюдением лимитов: (исход, текст ошибки).
+
+        Исход — SENT, FAILED (повтор не поможет), RETRY_AFTER (Telegram
+        просит подождать, рассылка уже приостановлена) или NETWORK_ERROR.
+        """
+        await self._wait_for_chat(chat_id)
+        await self.bucket.acquire()
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            metrics.SEND_TOTAL.inc(result="sent")
+            return SENT, None
+        except RetryAfter as e:
+            metrics.SEND_TOTAL.inc(result="retry_after")
+            logger.warning(f"RetryAfter {e.retry_after} с при отправке в чат {chat_id}")
+            self.bucket.pause(e.retry_after)
+            return RETRY_AFTER, f"RetryAfter {e.retry_after} с"
+        except (Forbidden, BadRequest) as e:
+            # Пользователь заблокировал бота или чат не существует — повтор не поможет
+            metrics.SEND_TOTAL.inc(result="failed")
+            logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+            return FAILED, str(e)
+        except NetworkError as e:
+            metrics.SEND_TOTAL.inc(result="network_error")
+            logger.warning(f"Сетевая ошибка при отправке в чат {chat_id}: {e}")
+            return NETWORK_ERROR, str(e)
+        except Exception as e:
+            metrics.SEND_TOTAL.inc(result="failed")
+            logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: {e}")
+            return FAILED, str(e)
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        """Отправить одно сообщение с повторами. Возвращает True при успехе."""
+        for attempt in range(self.max_retries + 1):
+            outcome, _ = await self.send_once(chat_id, text, **kwargs)
+            if outcome == SENT:
+                return True
+            if outcome == FAILED:
+                return False
+            if outcome == NETWORK_ERROR:
+                await asyncio.sleep(min(2 ** attempt, 30))
+        # Последняя попытка уже посчитана со своим исходом; exhausted — отказ от сообщения
+        metrics.SEND_TOTAL.inc(result="exhausted")
+        logger.error(f"Не удалось отправить сообщение пользователю {chat_id}: исчерпаны повторы")
+        return False
+
+    async def send_all(
+        self,
+        messages: Iterable[Tuple[int, str]],
+        total: int,
+        progress: Optional[ProgressCallback] = None,
+    ) -> FanOutResult:
+        """Разослать сообщения (chat_id, text) и вернуть итог.
+
+        messages читается лениво несколькими воркерами, поэтому может быть
+        генератором. progress вызывается после каждой отправки.
+        """
+        result = FanOutResult(total=total)
+        iterator = iter(messages)
+
+        async def worker():
+            for chat_id, text in iterator:
+                if await self.send(chat_id, text):
+                    result.sent += 1
+                else:
+                    result.failed += 1
+                if progress is not None:
+                    await progress(result)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, min(self.concurrency, total)))))
+        return result
+
+
+def shared_notifier(bot_data: dict, bot) -> Notifier:
+    """Общий Notifier процесса из bot_data.
+
+    Уведомления outbox и /broadcast делят один token bucket и интервалы по
+    чатам, поэтому вместе не превышают SEND_RATE, а RetryAfter от Telegram
+    приостанавливает их обе.
+    """
+    notifier = bot_data.get("notifier")
+    if notifier is None:
+        notifier = bot_data["notifier"] = Notifier(bot)
+    return notifier
+
+
+class ProgressMessage:
+    """Одно сообщение с прогрессом, которое редактируется не чаще interval секунд."""
+
+    def __init__(self, message, title: str, interval: float = PROGRESS_INTERVAL):
+        self.message = message
+        self.title = title
+        self.interval = interval
+        self._last_edit = 0.0
+
+    def render(self, result: FanOutResult) -> str:
+        return (
+            f"{self.title}\n\n"
+            f"Отправлено: {result.sent} из {result.total}\n"
+            f"Ошибок: {result.failed}"
+        )
+
+    async def __call__(self, result: FanOutResult, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_edit < self.interval:
+            return
+        self._last_edit = now
+        try:
+            await self.message.edit_text(self.render(result))
+        except Exception as e:
+            logger.warning(f"Не удалось обновить прогресс рассылки: {e}")
@@ -0,0 +1,166 @@
+"""Доставка уведомлений о назначении из таблицы outbox.
+
+commit_assignment_round ставит уведомления в outbox в одной транзакции с
+парами, а OutboxWorker — повторяющаяся задача JobQueue — забирает их
+порциями, отправляет и записывает итог. Каждое уведомление отправляется,
+только пока оно в статусе pending: после отправки оно становится sent,
+поэтому перезапуск бота продолжает рассылку, не повторяя доставленное.
+Временные ошибки повторяются с растущей паузой, после OUTBOX_MAX_ATTEMPTS
+попыток или при постоянной ошибке уведомление становится failed и ждёт
+/resend.
+"""
+import asyncio
+import logging
+import os
+from typing import Dict, List, Optional, Tuple
+
+from telegram.ext import ContextTypes
+
+import metrics
+from database import DEFAULT_GAME_ID
+from notifier import FAILED, SENT, Notifier, ProgressMessage
+
+logger = logging.getLogger(__name__)
+
+# Как часто воркер проверяет очередь, с
+OUTBOX_INTERVAL = float(os.getenv("OUTBOX_INTERVAL", "5"))
+# Сколько уведомлений забирается за раз; итог порции записывается одним
+# запросом. Уведомления порции, прерванной падением процесса, станут failed
+# и будут ждать /resend
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "30"))
+# Попыток до статуса failed
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+# Пауза перед повтором: OUTBOX_RETRY_BASE, затем вдвое больше, но не дольше OUTBOX_RETRY_MAX, с
+OUTBOX_RETRY_BASE = float(os.getenv("OUTBOX_RETRY_BASE", "10"))
+OUTBOX_RETRY_MAX = float(os.getenv("OUTBOX_RETRY_MAX", "600"))
+# Через сколько секунд уведомление, зависшее в sending, считается прерванным
+OUTBOX_SENDING_TIMEOUT = float(os.getenv("OUTBOX_SENDING_TIMEOUT", "600"))
+
+PROGRESS_TITLE = "⏳ Рассылаю уведомления участникам..."
+DONE_TITLE = "✅ Распределение выполнено!"
+
+
+def assignment_text(game_id: int, title: Optional[str], full_name: str, wish: str) -> str:
+    """Текст уведомления дарителю."""
+    # Участник может играть в нескольких играх — подписываем, о какой речь
+    header = f"🎄 {title}\n\n" if game_id != DEFAULT_GAME_ID and title else ""
+    return (
+        f"{header}"
+        f"🎁 Ты — Тайный Санта для: {full_name}\n\n"
+        f"Он(а) хочет: {wish}\n\n"
+        f"Удачи! 🎁"
+    )
+
+
+def retry_delay(attempts: int) -> float:
+    """Пауза перед следующей попыткой после attempts неудачных."""
+    return min(OUTBOX_RETRY_BASE * 2 ** max(0, attempts - 1), OUTBOX_RETRY_MAX)
+
+
+class OutboxProgress(ProgressMessage):
+    """Сообщение администратору с ходом рассылки уведомлений игры по статусам outbox."""
+
+    def render(self, stats: Dict[str, int]) -> str:
+        text = (
+            f"{self.title}\n\n"
+            f"Уведомлений отправлено: {stats['sent']} из {sum(stats.values())}\n"
+            f"Ошибок: {stats['failed']}"
+        )
+        if stats["pending"]:
+            text += f"\nВ очереди: {stats['pending']}"
+        if stats["failed"]:
+            text += "\n\nНеотправленные можно повторить командой /resend"
+        return text
+
+
+class OutboxWorker:
+    """Воркер очереди уведомлений: вызывается JobQueue и по /assign.
+
+    Одновременно идёт только один проход; реплики с PostgreSQL забирают
+    разные строки и работают параллельно.
+    """
+
+    def __init__(self, storage, bot, notifier: Optional[Notifier] = None, batch_size: int = OUTBOX_BATCH_SIZE,
+                 max_attempts: int = OUTBOX_MAX_ATTEMPTS, sending_timeout: float = OUTBOX_SENDING_TIMEOUT):
+        self.storage = storage
+        # Бот передаёт общий Notifier процесса (notifier.shared_notifier)
+        self.notifier = notifier or Notifier(bot)
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.sending_timeout = sending_timeout
+        self.progress: Dict[int, OutboxProgress] = {}
+        self._running = False
+
+    def watch(self, game_id: int, message):
+        """Показывать ход рассылки игры в сообщении message."""
+        self.progress[game_id] = OutboxProgress(message, PROGRESS_TITLE)
+
+    async def __call__(self, context: ContextTypes.DEFAULT_TYPE):
+        await self.drain()
+
+    async def drain(self) -> int:
+        """Отправить всё, чему пора уйти. Возвращает число обработанных уведомлений."""
+        if self._running:
+            return 0
+        self._running = True
+        try:
+            stale = await self.storage.fail_stale_outbox(self.sending_timeout)
+            if stale:
+                logger.warning(f"Outbox: {stale} уведомлений зависли в отправке и помечены failed")
+            processed = 0
+            while True:
+                batch = await self.storage.claim_outbox(self.batch_size)
+                if not batch:
+                    break
+                await self.send_batch(batch)
+                processed += len(batch)
+                await self.show_progress()
+            await self.show_progress(final=True)
+            return processed
+        finally:
+            self._running = False
+
+    async def send_batch(self, batch: List[dict]):
+        """Отправить забранные уведомления и записать итог порции одним запросом.
+
+        Если процесс упадёт посреди порции, её уведомления останутся в
+        sending и после перезапуска станут failed: под подозрением окажется
+        не больше одной порции (batch_size) отправок.
+        """
+        rows = iter(batch)
+        sent: List[int] = []
+        retry: List[Tuple[int, float, Optional[str]]] = []
+        failed: List[Tuple[int, Optional[str]]] = []
+
+        async def worker():
+            for row in rows:
+                if row["full_name"] is None:
+                    # Назначение или получатель удалены, пока уведомление ждало очереди
+                    outcome, error = FAILED, "назначение не найдено"
+                else:
+                    text = assignment_text(row["game_id"], row["title"], row["full_name"], row["wish"])
+                    outcome, error = await self.notifier.send_once(row["chat_id"], text)
+                # Итог попытки: sent, повтор с паузой или failed
+                if outcome == SENT:
+                    sent.append(row["id"])
+                    result = "sent"
+                elif outcome == FAILED or row["attempts"] >= self.max_attempts:
+                    failed.append((row["id"], error))
+                    result = "failed"
+                else:
+                    retry.append((row["id"], retry_delay(row["attempts"]), error))
+                    result = "retry"
+                metrics.OUTBOX_TOTAL.inc(result=result)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, min(self.notifier.concurrency, len(batch))))))
+        await self.storage.finish_outbox(sent, retry, failed)
+
+    async def show_progress(self, final: bool = False):
+        """Обновить сообщения с прогрессом; игры, где очередь опустела, убрать из списка."""
+        for game_id, progress in list(self.progress.items()):
+            stats = await self.storage.get_outbox_stats(game_id)
+            done = final and not stats["pending"] and not stats["sending"]
+            if done:
+                del self.progress[game_id]
+                progress.title = DONE_TITLE
+            await progress(stats, force=done)
@@ -0,0 +1,246 @@
+"""Хранение состояния диалогов и user_data в хранилище бота (SQLite или PostgreSQL)."""
+import asyncio
+import json
+import logging
+import os
+from typing import Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+# Как часто Application передаёт накопленные изменения в хранилище, секунд
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "30"))
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+class StoragePersistence(BasePersistence):
+    """Persistence для python-telegram-bot поверх хранилища бота (storage.Storage).
+
+    Хранит только незавершённые диалоги и непустые user_data, поэтому после
+    перезапуска продолжаются все начатые регистрации. Изменения копятся в
+    памяти и записываются одной транзакцией за цикл обновления; записи,
+    которые не изменились с прошлого сохранения, не пишутся вовсе.
+    user_data читается из базы лениво — при первом обновлении от пользователя.
+
+    shared=True — с хранилищем работают несколько реплик бота, и обновления
+    одного пользователя может получать любая из них. Тогда и состояние
+    диалога читается лениво (refresh_conversation), перечитывается, если
+    его изменила другая реплика (apply_change), а записывать изменения
+    нужно сразу после обработки обновления.
+    """
+
+    def __init__(self, db, update_interval: float = PERSISTENCE_INTERVAL, shared: bool = False):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self.shared = shared
+        # shared: поколение, в котором прочитана запись. Запись с другим
+        # поколением (или без него) перечитывается; apply_change(None)
+        # меняет поколение — устаревшим считается всё прочитанное
+        self._generation = 0
+        self._loaded_conversations: Dict[Tuple[str, str], int] = {}
+        self._loaded_user_data: Dict[int, int] = {}
+        # Последние сохранённые значения (JSON) — чтобы не писать неизменившееся
+        self._saved_conversations: Dict[Tuple[str, str], str] = {}
+        self._saved_user_data: Dict[int, str] = {}
+        # Изменения, ожидающие записи; None означает удаление
+        self._dirty_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        self._dirty_user_data: Dict[int, Optional[str]] = {}
+        # Пользователи, чьи user_data есть в базе, но ещё не загружены
+        self._unloaded_user_ids: Optional[Set[int]] = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    # Загрузка
+
+    async def get_user_data(self) -> Dict[int, dict]:
+        if self.shared:
+            return {}
+        # Сами данные подгружаются в refresh_user_data, здесь — только список пользователей
+        self._unloaded_user_ids = set(await self.db.get_user_data_ids())
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict) -> None:
+        if self.shared:
+            await self._reload_user_data(user_id, user_data)
+            return
+        if not self._unloaded_user_ids or user_id not in self._unloaded_user_ids:
+            return
+        self._unloaded_user_ids.discard(user_id)
+        data = await self.db.load_user_data(user_id)
+        if data is not None:
+            self._saved_user_data[user_id] = data
+            # Не затирать то, что уже успел записать обработчик
+            for key, value in json.loads(data).items():
+                user_data.setdefault(key, value)
+
+    async def _reload_user_data(self, user_id: int, user_data: dict):
+        # Незаписанные изменения этой реплики новее сохранённых
+        if self._loaded_user_data.get(user_id) == self._generation or user_id in self._dirty_user_data:
+            return
+        # Отметка ставится до чтения: изменение, пришедшее во время него, её снимет
+        self._loaded_user_data[user_id] = self._generation
+        try:
+            data = await self.db.load_user_data(user_id)
+        except Exception:
+            self._loaded_user_data.pop(user_id, None)
+            raise
+        user_data.clear()
+        if data is None:
+            self._saved_user_data.pop(user_id, None)
+        else:
+            self._saved_user_data[user_id] = data
+            user_data.update(json.loads(data))
+
+    async def get_conversations(self, name: str) -> Dict[tuple, object]:
+        if self.shared:
+            return {}
+        stored = await self.db.load_conversations(name)
+        conversations = {}
+        for key, state in stored.items():
+            self._saved_conversations[(name, key)] = state
+            conversations[tuple(json.loads(key))] = json.loads(state)
+        return conversations
+
+    async def refresh_conversation(self, name: str, key: tuple, conversations) -> None:
+        """shared: перечитать состояние диалога key, если его могла изменить другая реплика.
+
+        conversations — диалоги ConversationHandler (TrackingDict): прочитанное
+        состояние попадает в них без отметки об изменении.
+        """
+        conversation = (name, _dumps(list(key)))
+        if (self._loaded_conversations.get(conversation) == self._generation
+                or conversation in self._dirty_conversations):
+            return
+        self._loaded_conversations[conversation] = self._generation
+        try:
+            state = await self.db.load_conversation(*conversation)
+        except Exception:
+            self._loaded_conversations.pop(conversation, None)
+            raise
+        if state is None:
+            self._saved_conversations.pop(conversation, None)
+            conversations.pop(key, None)
+        else:
+            self._saved_conversations[conversation] = state
+            conversations.update_no_track({key: json.loads(state)})
+
+    def apply_change(self, change: Optional[str]):
+        """shared: уведомление об изменении от хранилища (PostgresDatabase.listen_changes).
+
+        Изменённые диалоги и user_data перечитываются при следующем обновлении
+        от пользователя; None — уведомления могли потеряться, перечитывается всё.
+        """
+        table, _, key = (change or "").partition(":")
+        if table == "user_data" and key:
+            self._loaded_user_data.pop(int(key), None)
+        elif table == "conversation_states" and ":" in key:
+            self._loaded_conversations.pop(tuple(key.split(":", 1)), None)
+        elif change is None or table in ("user_data", "conversation_states"):
+            self._generation += 1
+
+    async def get_chat_data(self) -> Dict[int, dict]:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    # Изменения
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        conversation = (name, _dumps(list(key)))
+        state = None if new_state is None else _dumps(new_state)
+        self._mark(self._saved_conversations, self._dirty_conversations, conversation, state)
+
+    async def update_user_data(self, user_id: int, data: dict) -> None:
+        try:
+            value = _dumps(data) if data else None
+        except (TypeError, ValueError):
+            # Сохранить остальные ключи, а об ошибке сообщить: Application передаёт
+            # исключение обработчикам ошибок (или пишет его в лог)
+            storable, failed = {}, []
+            for key, item in data.items():
+                try:
+                    _dumps(item)
+                except (TypeError, ValueError):
+                    failed.append(key)
+                else:
+                    storable[key] = item
+            value = _dumps(storable) if storable else None
+            self._mark(self._saved_user_data, self._dirty_user_data, user_id, value)
+            raise TypeError(
+                f"user_data пользователя {user_id}: ключи {failed} нельзя сохранить в JSON, они не сохранены"
+            )
+        self._mark(self._saved_user_data, self._dirty_user_data, user_id, value)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark(self._saved_user_data, self._dirty_user_data, user_id, None)
+
+    def _mark(self, saved: dict, dirty: dict, key, value: Optional[str]):
+        """Запомнить изменение, если значение отличается от сохранённого."""
+        if saved.get(key) == value:
+            dirty.pop(key, None)
+            return
+        dirty[key] = value
+        if self._flush_task is None or self._flush_task.done():
+            # Application вызывает update_* пачкой через gather — запись делаем
+            # одну, после того как вся пачка попала в буфер
+            self._flush_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self):
+        await asyncio.sleep(0)
+        while self._dirty_conversations or self._dirty_user_data:
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            user_data, self._dirty_user_data = self._dirty_user_data, {}
+            try:
+                await self.db.save_persistence_batch(
+                    [(name, key, state) for (name, key), state in conversations.items()],
+                    list(user_data.items()),
+                )
+            except Exception as e:
+                logger.error(f"Не удалось сохранить состояние диалогов: {e}")
+                # Вернуть изменения в буфер, чтобы записать их в следующий раз
+                for key, value in conversations.items():
+                    self._dirty_conversations.setdefault(key, value)
+                for key, value in user_data.items():
+                    self._dirty_user_data.setdefault(key, value)
+                return
+            for saved, written in ((self._saved_conversations, conversations), (self._saved_user_data, user_data)):
+                for key, value in written.items():
+                    if value is None:
+                        saved.pop(key, None)
+                    else:
+                        saved[key] = value
+
+    async def flush(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            await self._flush_task
+        await self._write_pending()
+
+    # Не используются: chat_data, bot_data и callback_data не сохраняются
+
+    async def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    async def update_bot_data(self, data: dict) -> None:
+        pass
+
+    async def update_callback_data(self, data) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict) -> None:
+        pass
@@ -0,0 +1,964 @@
+"""Хранилище в PostgreSQL: данные переживают перезапуск и смену машины."""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import asyncpg
+
+import metrics
+from database import BROADCAST_AUDIENCES, DEFAULT_GAME_ID, DEFAULT_GAME_TITLE, OUTBOX_STATUSES
+from models import PARTICIPANT_COLUMNS, Assignment, ExportRow, Participant
+
+logger = logging.getLogger(__name__)
+
+# Строк в одном INSERT при импорте участников
+IMPORT_BATCH_SIZE = 5000
+
+# Размер пула соединений процесса
+PG_POOL_MIN_SIZE = int(os.getenv("PG_POOL_MIN_SIZE", "1"))
+PG_POOL_MAX_SIZE = int(os.getenv("PG_POOL_MAX_SIZE", "10"))
+# Как часто проверять соединение, на которое приходят уведомления об изменениях, с
+PG_LISTEN_CHECK_INTERVAL = float(os.getenv("PG_LISTEN_CHECK_INTERVAL", "15"))
+# Пауза перед повторным подключением для уведомлений, с
+PG_LISTEN_RETRY = float(os.getenv("PG_LISTEN_RETRY", "5"))
+
+# Участники вместе с их получателями для выгрузки
+EXPORT_QUERY = """
+    SELECT p.user_id, p.username, p.full_name, p.wish,
+           r.full_name AS receiver_name, r.wish AS receiver_wish
+    FROM participants p
+    LEFT JOIN assignments a ON a.game_id = p.game_id AND a.giver_id = p.user_id
+    LEFT JOIN participants r ON r.game_id = a.game_id AND r.user_id = a.receiver_id
+    WHERE p.game_id = $1
+    ORDER BY p.registered_at, p.user_id
+"""
+
+# Ключ advisory-блокировки: реплики применяют миграции по очереди
+MIGRATION_LOCK_ID = 0x53414E54
+
+# Статистика игр (см. database.STATS_TRIGGERS): триггеры уровня выражения
+# складывают изменения по таблицам переходов, поэтому массовое удаление
+# в reset_all меняет счётчики одним запросом, а не построчно. {rows} —
+# изменённые строки со знаком d: +1 из new_rows, -1 из old_rows
+_PARTICIPANT_ROWS = {
+    "INSERT": "SELECT game_id, registered_at, 1 AS d FROM new_rows",
+    "DELETE": "SELECT game_id, registered_at, -1 AS d FROM old_rows",
+    "UPDATE": """
+        SELECT game_id, registered_at, 1 AS d FROM new_rows
+        UNION ALL SELECT game_id, registered_at, -1 FROM old_rows
+    """,
+}
+_ASSIGNMENT_ROWS = {
+    "INSERT": "SELECT game_id, notified_at, 1 AS d FROM new_rows",
+    "DELETE": "SELECT game_id, notified_at, -1 AS d FROM old_rows",
+    "UPDATE": """
+        SELECT game_id, notified_at, 1 AS d FROM new_rows
+        UNION ALL SELECT game_id, notified_at, -1 FROM old_rows
+    """,
+}
+_PARTICIPANT_STATS = """
+    INSERT INTO game_stats (game_id, participants)
+    SELECT game_id, SUM(d) FROM ({rows}) changed GROUP BY game_id HAVING SUM(d) <> 0
+    ON CONFLICT (game_id) DO UPDATE SET participants = game_stats.participants + EXCLUDED.participants;
+    INSERT INTO registration_stats AS s (game_id, hour, participants)
+    SELECT game_id, date_trunc('hour', registered_at AT TIME ZONE 'UTC'), SUM(d)
+    FROM ({rows}) changed GROUP BY 1, 2 HAVING SUM(d) <> 0
+    ON CONFLICT (game_id, hour) DO UPDATE SET participants = s.participants + EXCLUDED.participants;
+    DELETE FROM registration_stats WHERE participants <= 0
+    AND game_id IN (SELECT game_id FROM ({rows}) changed);
+"""
+_ASSIGNMENT_STATS = """
+    INSERT INTO game_stats (game_id, assigned, notified)
+    SELECT game_id, SUM(d), COALESCE(SUM(d) FILTER (WHERE notified_at IS NOT NULL), 0)
+    FROM ({rows}) changed GROUP BY game_id
+    ON CONFLICT (game_id) DO UPDATE SET
+        assigned = game_stats.assigned + EXCLUDED.assigned,
+        notified = game_stats.notified + EXCLUDED.notified;
+"""
+
+
+def _statement_trigger(kind: str, table: str, operation: str, body: str, rows: Dict[str, str]) -> Tuple[str, ...]:
+    """Функция и триггер уровня выражения kind_table_operation с телом body."""
+    name = f"{kind}_{table}_{operation.lower()}"
+    transition = {
+        "INSERT": "NEW TABLE AS new_rows",
+        "DELETE": "OLD TABLE AS old_rows",
+        "UPDATE": "OLD TABLE AS old_rows NEW TABLE AS new_rows",
+    }[operation]
+    return (
+        f"""
+        CREATE OR REPLACE FUNCTION {name}() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            {body.format(rows=rows[operation])}
+            RETURN NULL;
+        END $$
+        """,
+        f"DROP TRIGGER IF EXISTS {name} ON {table}",
+        f"""
+        CREATE TRIGGER {name} AFTER {operation} ON {table}
+        REFERENCING {transition} FOR EACH STATEMENT EXECUTE FUNCTION {name}()
+        """,
+    )
+
+
+STATS_TRIGGERS = tuple(
+    statement
+    for operation in ("INSERT", "DELETE", "UPDATE")
+    for table, body, rows in (
+        ("participants", _PARTICIPANT_STATS, _PARTICIPANT_ROWS),
+        ("assignments", _ASSIGNMENT_STATS, _ASSIGNMENT_ROWS),
+    )
+    for statement in _statement_trigger("stats", table, operation, body, rows)
+)
+
+# Уведомления других реплик об изменениях (см. PostgresDatabase.listen_changes).
+# Сообщение в канале CHANGES_CHANNEL — «таблица:ключ» изменённой строки, а
+# если строк в выражении больше CHANGES_ROW_LIMIT — «таблица:область» (вся
+# игра, весь диалог или вся таблица, если область пустая). Одинаковые
+# сообщения одной транзакции PostgreSQL доставляет один раз
+CHANGES_CHANNEL = "santa_changes"
+CHANGES_ROW_LIMIT = 100
+# Таблица: (ключ строки, область)
+CHANGE_KEYS = {
+    "games": ("game_id::text", "game_id::text"),
+    "game_admins": ("game_id || ':' || user_id", "game_id::text"),
+    "user_games": ("user_id::text", "''"),
+    "participants": ("game_id || ':' || user_id", "game_id::text"),
+    "assignments": ("game_id::text", "game_id::text"),
+    "settings": ("game_id::text", "game_id::text"),
+    "conversation_states": ("name || ':' || conversation_key", "name"),
+    "user_data": ("user_id::text", "''"),
+}
+_CHANGED_ROWS = {
+    "INSERT": "SELECT * FROM new_rows",
+    "DELETE": "SELECT * FROM old_rows",
+    "UPDATE": "SELECT * FROM new_rows UNION ALL SELECT * FROM old_rows",
+}
+_NOTIFY_CHANGES = """
+    PERFORM pg_notify('{channel}', '{table}:' || change) FROM (
+        SELECT DISTINCT CASE WHEN COUNT(*) OVER () > {limit} THEN {scope} ELSE {key} END AS change
+        FROM ({{rows}}) changed
+    ) changes;
+"""
+CHANGE_TRIGGERS = tuple(
+    statement
+    for operation in ("INSERT", "DELETE", "UPDATE")
+    for table, (key, scope) in CHANGE_KEYS.items()
+    for statement in _statement_trigger(
+        "notify", table, operation,
+        _NOTIFY_CHANGES.format(channel=CHANGES_CHANNEL, table=table, limit=CHANGES_ROW_LIMIT, key=key, scope=scope),
+        _CHANGED_ROWS,
+    )
+)
+
+# Миграции по порядку: номер версии — позиция в списке, начиная с 1.
+# Версии 1–6 совпадают с миграциями SQLite в database.py; 7 нужна только
+# нескольким репликам и есть только здесь. Выражение — строка
+# SQL или кортеж (SQL, параметры...).
+MIGRATIONS = (
+    ("базовая схема с несколькими играми", (
+        """
+        CREATE TABLE IF NOT EXISTS games (
+            game_id BIGINT PRIMARY KEY,
+            title TEXT NOT NULL,
+            created_by BIGINT,
+            created_at TIMESTAMPTZ DEFAULT now()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS game_admins (
+            game_id BIGINT NOT NULL REFERENCES games (game_id),
+            user_id BIGINT NOT NULL,
+            PRIMARY KEY (game_id, user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_games (
+            user_id BIGINT PRIMARY KEY,
+            game_id BIGINT NOT NULL REFERENCES games (game_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS participants (
+            game_id BIGINT NOT NULL REFERENCES games (game_id),
+            user_id BIGINT NOT NULL,
+            username TEXT,
+            full_name TEXT NOT NULL,
+            wish TEXT NOT NULL,
+            registered_at TIMESTAMPTZ DEFAULT now(),
+            PRIMARY KEY (game_id, user_id)
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_participants_game_registered
+        ON participants (game_id, registered_at)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS assignments (
+            id BIGSERIAL PRIMARY KEY,
+            game_id BIGINT NOT NULL,
+            giver_id BIGINT NOT NULL,
+            receiver_id BIGINT NOT NULL,
+            assigned_at TIMESTAMPTZ DEFAULT now()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS conversation_states (
+            name TEXT NOT NULL,
+            conversation_key TEXT NOT NULL,
+            state TEXT NOT NULL,
+            updated_at TIMESTAMPTZ DEFAULT now(),
+            PRIMARY KEY (name, conversation_key)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_data (
+            user_id BIGINT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TIMESTAMPTZ DEFAULT now()
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS settings (
+            game_id BIGINT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            PRIMARY KEY (game_id, key)
+        )
+        """,
+        (
+            "INSERT INTO games (game_id, title) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+            DEFAULT_GAME_ID, DEFAULT_GAME_TITLE,
+        ),
+    )),
+    ("уникальный даритель в назначениях, индекс по получателю", (
+        """
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_assignments_game_giver
+        ON assignments (game_id, giver_id)
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_assignments_game_receiver
+        ON assignments (game_id, receiver_id)
+        """,
+    )),
+    ("отметка доставки уведомления о назначении", (
+        "ALTER TABLE assignments ADD COLUMN IF NOT EXISTS notified_at TIMESTAMPTZ",
+    )),
+    ("индекс участников для постраничного просмотра по (registered_at, user_id)", (
+        "DROP INDEX IF EXISTS idx_participants_game_registered",
+        """
+        CREATE INDEX idx_participants_game_registered
+        ON participants (game_id, registered_at, user_id)
+        """,
+    )),
+    ("статистика игр, которую поддерживают триггеры", (
+        """
+        CREATE TABLE IF NOT EXISTS game_stats (
+            game_id BIGINT PRIMARY KEY,
+            participants BIGINT NOT NULL DEFAULT 0,
+            assigned BIGINT NOT NULL DEFAULT 0,
+            notified BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS registration_stats (
+            game_id BIGINT NOT NULL,
+            hour TIMESTAMP NOT NULL,
+            participants BIGINT NOT NULL,
+            PRIMARY KEY (game_id, hour)
+        )
+        """,
+        # Триггеры создаются под блокировкой таблиц: данные, записанные
+        # между подсчётом ниже и созданием триггеров, не потеряются
+        "LOCK TABLE participants, assignments IN SHARE ROW EXCLUSIVE MODE",
+        *STATS_TRIGGERS,
+        """
+        INSERT INTO game_stats (game_id, participants)
+        SELECT game_id, COUNT(*) FROM participants GROUP BY game_id
+        ON CONFLICT (game_id) DO UPDATE SET participants = EXCLUDED.participants
+        """,
+        """
+        INSERT INTO game_stats (game_id, assigned, notified)
+        SELECT game_id, COUNT(*), COUNT(notified_at) FROM assignments GROUP BY game_id
+        ON CONFLICT (game_id) DO UPDATE SET assigned = EXCLUDED.assigned, notified = EXCLUDED.notified
+        """,
+        """
+        INSERT INTO registration_stats (game_id, hour, participants)
+        SELECT game_id, date_trunc('hour', registered_at AT TIME ZONE 'UTC'), COUNT(*)
+        FROM participants GROUP BY 1, 2
+        ON CONFLICT (game_id, hour) DO UPDATE SET participants = EXCLUDED.participants
+        """,
+    )),
+    ("очередь уведомлений о назначении", (
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGSERIAL PRIMARY KEY,
+            game_id BIGINT NOT NULL,
+            chat_id BIGINT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            claimed_at TIMESTAMPTZ,
+            last_error TEXT,
+            UNIQUE (game_id, chat_id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox (status, next_attempt_at)",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_game_status ON outbox (game_id, status)",
+    )),
+    ("уведомления реплик об изменениях и общий лимит отправки", (
+        *CHANGE_TRIGGERS,
+        # Token bucket всех реплик (см. take_send_tokens): одна строка
+        """
+        CREATE TABLE IF NOT EXISTS send_limit (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            tokens DOUBLE PRECISION NOT NULL DEFAULT 0,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            paused_until TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """,
+        "INSERT INTO send_limit (id) VALUES (1) ON CONFLICT DO NOTHING",
+    )),
+)
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+class PostgresDatabase:
+    """Хранилище в PostgreSQL с тем же набором методов, что и AsyncDatabase.
+
+    Соединения берутся из пула asyncpg, который создаётся при первом
+    обращении; тогда же применяются недостающие миграции схемы.
+    Атомарность распределения обеспечивается транзакцией с блокировкой
+    строки игры. С одной базой могут работать несколько реплик бота:
+    блокировки (try_lock) и лимит отправки (take_send_tokens) общие для
+    всех, а об изменённых строках реплики узнают через listen_changes.
+    """
+
+    def __init__(self, dsn: str, min_size: int = PG_POOL_MIN_SIZE, max_size: int = PG_POOL_MAX_SIZE):
+        self.dsn = dsn
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool = None
+        self.pending = 0
+        # Создаётся в работающем цикле событий при первом обращении
+        self._pool_lock: Optional[asyncio.Lock] = None
+        # Задача, слушающая уведомления об изменениях
+        self._listen_task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _get_pool(self):
+        if self.pool is None:
+            if self._pool_lock is None:
+                self._pool_lock = asyncio.Lock()
+            async with self._pool_lock:
+                if self.pool is None:
+                    pool = await asyncpg.create_pool(self.dsn, min_size=self.min_size, max_size=self.max_size)
+                    async with pool.acquire() as conn:
+                        await self._migrate(conn)
+                    self.pool = pool
+        return self.pool
+
+    @asynccontextmanager
+    async def _connection(self, method: str):
+        """Соединение из пула; время вызова и ошибки попадают в метрики."""
+        started = time.perf_counter()
+        self.pending += 1
+        try:
+            pool = await self._get_pool()
+            async with pool.acquire() as conn:
+                yield conn
+        except Exception:
+            metrics.DB_ERRORS.inc(method=method)
+            raise
+        finally:
+            self.pending -= 1
+            metrics.DB_SECONDS.observe(time.perf_counter() - started, method=method)
+
+    async def close(self):
+        """Перестать слушать уведомления и закрыть пул соединений."""
+        task, self._listen_task = self._listen_task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    # Несколько реплик
+
+    @asynccontextmanager
+    async def try_lock(self, name: str) -> AsyncIterator[bool]:
+        """Взять блокировку name на время блока, не дожидаясь её: True, если взята.
+
+        Сессионная advisory-блокировка общая для всех реплик. Соединение
+        занято, пока блокировка взята; если оно разорвётся, сервер отпустит
+        блокировку сам.
+        """
+        pool = await self._get_pool()
+        async with pool.acquire() as conn:
+            acquired = await conn.fetchval("SELECT pg_try_advisory_lock(hashtextextended($1, 0))", name)
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    await conn.execute("SELECT pg_advisory_unlock(hashtextextended($1, 0))", name)
+
+    async def listen_changes(self, callback: Callable[[Optional[str]], None]):
+        """Передавать в callback уведомления об изменениях от всех реплик (см. CHANGE_KEYS).
+
+        Уведомления приходят на отдельное соединение. Пока его нет, они
+        теряются, поэтому при разрыве и после каждого подключения callback
+        получает None: всё прочитанное до этого могло устареть.
+        """
+        # Триггеры уведомлений создаются миграциями
+        await self._get_pool()
+        self._listen_task = asyncio.create_task(self._listen(callback))
+
+    async def _listen(self, callback: Callable[[Optional[str]], None]):
+        while True:
+            try:
+                conn = await asyncpg.connect(self.dsn)
+            except (OSError, asyncpg.PostgresError, asyncio.TimeoutError) as e:
+                logger.warning(f"Нет соединения для уведомлений об изменениях: {e}")
+                await asyncio.sleep(PG_LISTEN_RETRY)
+                continue
+            closed = asyncio.Event()
+            conn.add_termination_listener(lambda connection: closed.set())
+            try:
+                await conn.add_listener(CHANGES_CHANNEL, lambda connection, pid, channel, payload: callback(payload))
+                callback(None)
+                while not closed.is_set():
+                    try:
+                        await asyncio.wait_for(closed.wait(), PG_LISTEN_CHECK_INTERVAL)
+                    except asyncio.TimeoutError:
+                        # Разрыв без закрытия сокета виден только по запросу
+                        await conn.fetchval("SELECT 1", timeout=PG_LISTEN_CHECK_INTERVAL)
+                logger.warning("Соединение для уведомлений об изменениях закрыто")
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError, asyncio.TimeoutError) as e:
+                logger.warning(f"Соединение для уведомлений об изменениях разорвано: {e}")
+            finally:
+                conn.terminate()
+            callback(None)
+            await asyncio.sleep(PG_LISTEN_RETRY)
+
+    async def take_send_tokens(self, count: int, rate: float, capacity: float) -> Tuple[int, float]:
+        """Взять до count токенов общего для реплик лимита отправки: (взято, сколько ждать).
+
+        Токены копятся со скоростью rate в секунду, но не больше capacity.
+        Если не взято ни одного, второе значение — через сколько секунд
+        появится следующий (или кончится пауза pause_sends).
+        """
+        async with self._connection("take_send_tokens") as conn:
+            async with conn.transaction():
+                row = await conn.fetchrow("""
+                    SELECT tokens, updated_at, paused_until, clock_timestamp() AS now
+                    FROM send_limit WHERE id = 1 FOR UPDATE
+                """)
+                if row["paused_until"] > row["now"]:
+                    return 0, (row["paused_until"] - row["now"]).total_seconds()
+                elapsed = max(0.0, (row["now"] - row["updated_at"]).total_seconds())
+                tokens = min(capacity, row["tokens"] + elapsed * rate)
+                granted = min(count, int(tokens))
+                await conn.execute(
+                    "UPDATE send_limit SET tokens = $1, updated_at = $2 WHERE id = 1",
+                    tokens - granted, row["now"],
+                )
+        return granted, 0.0 if granted else (1 - tokens) / rate
+
+    async def pause_sends(self, seconds: float):
+        """Остановить выдачу токенов всем репликам (после RetryAfter).
+
+        Как и TokenBucket.pause: токены копятся заново с конца паузы.
+        """
+        async with self._connection("pause_sends") as conn:
+            await conn.execute("""
+                UPDATE send_limit SET
+                    paused_until = GREATEST(paused_until, now() + make_interval(secs => $1)),
+                    updated_at = GREATEST(paused_until, now() + make_interval(secs => $1)),
+                    tokens = 0
+                WHERE id = 1
+            """, seconds)
+
+    # Миграции схемы
+
+    async def _migrate(self, conn):
+        for version, (description, statements) in enumerate(MIGRATIONS, 1):
+            async with conn.transaction():
+                await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK_ID)
+                await conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+                current = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+                if current > SCHEMA_VERSION:
+                    raise RuntimeError(
+                        f"Схема базы версии {current} новее поддерживаемой ({SCHEMA_VERSION})"
+                    )
+                if current >= version:
+                    continue
+                logger.info(f"Миграция схемы {version}: {description}")
+                for statement in statements:
+                    if isinstance(statement, str):
+                        statement = (statement,)
+                    await conn.execute(*statement)
+                await conn.execute("INSERT INTO schema_version (version) VALUES ($1)", version)
+
+    async def schema_version(self) -> int:
+        """Версия схемы базы."""
+        async with self._connection("schema_version") as conn:
+            return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+
+    # Игры
+
+    async def create_game(self, game_id: int, title: str, admin_id: int) -> bool:
+        """Создать игру и назначить её администратора. False, если игра уже есть."""
+        async with self._connection("create_game") as conn:
+            async with conn.transaction():
+                created = await conn.fetchval("""
+                    INSERT INTO games (game_id, title, created_by) VALUES ($1, $2, $3)
+                    ON CONFLICT DO NOTHING RETURNING game_id
+                """, game_id, title, admin_id)
+                if created is None:
+                    return False
+                await conn.execute("""
+                    INSERT INTO game_admins (game_id, user_id) VALUES ($1, $2)
+                    ON CONFLICT DO NOTHING
+                """, game_id, admin_id)
+        return True
+
+    async def get_game(self, game_id: int) -> Optional[dict]:
+        """Получить данные игры."""
+        async with self._connection("get_game") as conn:
+            row = await conn.fetchrow("SELECT * FROM games WHERE game_id = $1", game_id)
+        return dict(row) if row else None
+
+    async def add_game_admin(self, game_id: int, user_id: int):
+        """Назначить администратора игры."""
+        async with self._connection("add_game_admin") as conn:
+            await conn.execute("""
+                INSERT INTO game_admins (game_id, user_id) VALUES ($1, $2)
+                ON CONFLICT DO NOTHING
+            """, game_id, user_id)
+
+    async def is_game_admin(self, game_id: int, user_id: int) -> bool:
+        """Проверить, является ли пользователь администратором игры."""
+        async with self._connection("is_game_admin") as conn:
+            row = await conn.fetchrow(
+                "SELECT 1 FROM game_admins WHERE game_id = $1 AND user_id = $2", game_id, user_id
+            )
+        return row is not None
+
+    async def get_admin_ids(self) -> List[int]:
+        """ID всех администраторов игр."""
+        async with self._connection("get_admin_ids") as conn:
+            rows = await conn.fetch("SELECT DISTINCT user_id FROM game_admins ORDER BY user_id")
+        return [row["user_id"] for row in rows]
+
+    async def get_user_game(self, user_id: int) -> int:
+        """Получить игру, выбранную пользователем в личном чате."""
+        async with self._connection("get_user_game") as conn:
+            game_id = await conn.fetchval("SELECT game_id FROM user_games WHERE user_id = $1", user_id)
+        return game_id if game_id is not None else DEFAULT_GAME_ID
+
+    async def set_user_game(self, user_id: int, game_id: int):
+        """Запомнить игру, выбранную пользователем в личном чате."""
+        async with self._connection("set_user_game") as conn:
+            await conn.execute("""
+                INSERT INTO user_games (user_id, game_id) VALUES ($1, $2)
+                ON CONFLICT (user_id) DO UPDATE SET game_id = EXCLUDED.game_id
+            """, user_id, game_id)
+
+    # Состояние диалогов
+
+    async def load_conversations(self, name: str) -> Dict[str, str]:
+        """Получить сохранённые состояния диалога: ключ (JSON) → состояние (JSON)."""
+        async with self._connection("load_conversations") as conn:
+            rows = await conn.fetch(
+                "SELECT conversation_key, state FROM conversation_states WHERE name = $1", name
+            )
+        return {row["conversation_key"]: row["state"] for row in rows}
+
+    async def load_conversation(self, name: str, key: str) -> Optional[str]:
+        """Получить сохранённое состояние одного диалога (JSON)."""
+        async with self._connection("load_conversation") as conn:
+            return await conn.fetchval(
+                "SELECT state FROM conversation_states WHERE name = $1 AND conversation_key = $2", name, key
+            )
+
+    async def get_user_data_ids(self) -> List[int]:
+        """Получить ID пользователей, для которых сохранены user_data."""
+        async with self._connection("get_user_data_ids") as conn:
+            rows = await conn.fetch("SELECT user_id FROM user_data")
+        return [row["user_id"] for row in rows]
+
+    async def load_user_data(self, user_id: int) -> Optional[str]:
+        """Получить сохранённые user_data пользователя (JSON)."""
+        async with self._connection("load_user_data") as conn:
+            return await conn.fetchval("SELECT data FROM user_data WHERE user_id = $1", user_id)
+
+    async def save_persistence_batch(
+        self,
+        conversations: List[Tuple[str, str, Optional[str]]],
+        user_data: List[Tuple[int, Optional[str]]],
+    ):
+        """Записать накопленные изменения одной транзакцией (None удаляет запись)."""
+        async with self._connection("save_persistence_batch") as conn:
+            async with conn.transaction():
+                await conn.executemany(
+                    "DELETE FROM conversation_states WHERE name = $1 AND conversation_key = $2",
+                    [(name, key) for name, key, state in conversations if state is None],
+                )
+                await conn.executemany("""
+                    INSERT INTO conversation_states (name, conversation_key, state) VALUES ($1, $2, $3)
+                    ON CONFLICT (name, conversation_key)
+                    DO UPDATE SET state = EXCLUDED.state, updated_at = now()
+                """, [item for item in conversations if item[2] is not None])
+                await conn.executemany(
+                    "DELETE FROM user_data WHERE user_id = $1",
+                    [(user_id,) for user_id, data in user_data if data is None],
+                )
+                await conn.executemany("""
+                    INSERT INTO user_data (user_id, data) VALUES ($1, $2)
+                    ON CONFLICT (user_id) DO UPDATE SET data = EXCLUDED.data, updated_at = now()
+                """, [item for item in user_data if item[1] is not None])
+
+    # Участники
+
+    async def is_registered(self, game_id: int, user_id: int) -> bool:
+        """Проверить, зарегистрирован ли пользователь."""
+        async with self._connection("is_registered") as conn:
+            row = await conn.fetchrow(
+                "SELECT 1 FROM participants WHERE game_id = $1 AND user_id = $2", game_id, user_id
+            )
+        return row is not None
+
+    async def register_participant(self, game_id: int, user_id: int, username: str, full_name: str, wish: str) -> bool:
+        """Зарегистрировать или обновить данные участника одним upsert."""
+        async with self._connection("register_participant") as conn:
+            await conn.execute("""
+                INSERT INTO participants (game_id, user_id, username, full_name, wish)
+                VALUES ($1, $2, $3, $4, $5)
+                ON CONFLICT (game_id, user_id) DO UPDATE
+                SET username = EXCLUDED.username, full_name = EXCLUDED.full_name, wish = EXCLUDED.wish
+            """, game_id, user_id, username, full_name, wish)
+        return True
+
+    async def import_participants(self, game_id: int, rows: List[Tuple[int, Optional[str], str, str]]) -> Tuple[int, int]:
+        """Загрузить участников одной транзакцией (см. Database.import_participants).
+
+        Пачка передаётся массивами колонок в один INSERT ... SELECT FROM
+        unnest — одно выражение вместо строки на участника.
+        """
+        inserted = 0
+        async with self._connection("import_participants") as conn:
+            async with conn.transaction():
+                for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+                    user_ids, usernames, full_names, wishes = zip(*rows[start:start + IMPORT_BATCH_SIZE])
+                    # xmax = 0 только у строк, вставленных этим выражением
+                    inserted += await conn.fetchval("""
+                        WITH upserted AS (
+                            INSERT INTO participants (game_id, user_id, username, full_name, wish)
+                            SELECT $1, * FROM unnest($2::BIGINT[], $3::TEXT[], $4::TEXT[], $5::TEXT[])
+                            ON CONFLICT (game_id, user_id) DO UPDATE
+                            SET username = COALESCE(EXCLUDED.username, participants.username),
+                                full_name = EXCLUDED.full_name, wish = EXCLUDED.wish
+                            RETURNING xmax = 0 AS inserted
+                        )
+                        SELECT COUNT(*) FILTER (WHERE inserted) FROM upserted
+                    """, game_id, user_ids, usernames, full_names, wishes)
+        return inserted, len(rows) - inserted
+
+    async def get_participant(self, game_id: int, user_id: int) -> Optional[Participant]:
+        """Получить данные участника."""
+        async with self._connection("get_participant") as conn:
+            row = await conn.fetchrow(
+                f"SELECT {PARTICIPANT_COLUMNS} FROM participants WHERE game_id = $1 AND user_id = $2",
+                game_id, user_id,
+            )
+        return Participant._make(row) if row else None
+
+    async def get_participants_page(
+        self,
+        game_id: int,
+        anchor_id: Optional[int] = None,
+        backward: bool = False,
+        limit: int = 50,
+        search: Optional[str] = None,
+    ) -> List[Participant]:
+        """Страница участников в порядке регистрации (см. Database.get_participants_page)."""
+        conditions = ["game_id = $1"]
+        params: list = [game_id]
+        order = "DESC" if backward else "ASC"
+        async with self._connection("get_participants_page") as conn:
+            if anchor_id is not None:
+                registered_at = await conn.fetchval(
+                    "SELECT registered_at FROM participants WHERE game_id = $1 AND user_id = $2", game_id, anchor_id
+                )
+                if registered_at is None:
+                    return []
+                params += [registered_at, anchor_id]
+                conditions.append(
+                    f"(registered_at, user_id) {'<' if backward else '>'} (${len(params) - 1}, ${len(params)})"
+                )
+            if search:
+                params.append(search.lower())
+                conditions.append(f"strpos(lower(full_name), ${len(params)}) > 0")
+            params.append(limit + 1)
+            rows = await conn.fetch(f"""
+                SELECT {PARTICIPANT_COLUMNS} FROM participants
+                WHERE {" AND ".join(conditions)}
+                ORDER BY registered_at {order}, user_id {order}
+                LIMIT ${len(params)}
+            """, *params)
+        page = [Participant._make(row) for row in rows]
+        return page[::-1] if backward else page
+
+    async def _iterate(self, model, method: str, query: str, *args, batch_size: int) -> AsyncIterator:
+        """Перебрать строки запроса серверным курсором, по batch_size за раз.
+
+        На время перебора занято одно соединение пула.
+        """
+        async with self._connection(method) as conn:
+            async with conn.transaction():
+                async for row in conn.cursor(query, *args, prefetch=batch_size):
+                    yield model._make(row)
+
+    async def get_participant_ids(self, game_id: int) -> List[int]:
+        """Получить ID участников в порядке регистрации (только из индекса, без строк таблицы)."""
+        async with self._connection("get_participant_ids") as conn:
+            rows = await conn.fetch(
+                "SELECT user_id FROM participants WHERE game_id = $1 ORDER BY registered_at, user_id", game_id
+            )
+        return [row["user_id"] for row in rows]
+
+    async def get_participant_count(self, game_id: int) -> int:
+        """Получить количество участников (из game_stats, без подсчёта строк)."""
+        async with self._connection("get_participant_count") as conn:
+            count = await conn.fetchval("SELECT participants FROM game_stats WHERE game_id = $1", game_id)
+        return count or 0
+
+    async def get_stats(self, game_id: int, hours: int = 24) -> dict:
+        """Счётчики игры и регистрации по часам (см. Database.get_stats)."""
+        async with self._connection("get_stats") as conn:
+            row = await conn.fetchrow(
+                "SELECT participants, assigned, notified FROM game_stats WHERE game_id = $1", game_id
+            )
+            rows = await conn.fetch("""
+                SELECT to_char(hour, 'YYYY-MM-DD HH24:00') AS hour, participants FROM registration_stats
+                WHERE game_id = $1 ORDER BY registration_stats.hour DESC LIMIT $2
+            """, game_id, hours)
+        stats = dict(row) if row else {"participants": 0, "assigned": 0, "notified": 0}
+        stats["hours"] = [(row["hour"], row["participants"]) for row in reversed(rows)]
+        return stats
+
+    async def clear_all_participants(self, game_id: int):
+        """Очистить всех участников."""
+        async with self._connection("clear_all_participants") as conn:
+            await conn.execute("DELETE FROM participants WHERE game_id = $1", game_id)
+
+    # Распределение
+
+    async def is_assignment_done(self, game_id: int) -> bool:
+        """Проверить, выполнено ли распределение."""
+        async with self._connection("is_assignment_done") as conn:
+            value = await conn.fetchval(
+                "SELECT value FROM settings WHERE game_id = $1 AND key = 'assignment_done'", game_id
+            )
+        return value == "1"
+
+    async def clear_assignments(self, game_id: int):
+        """Очистить все распределения и неотправленные уведомления о них."""
+        async with self._connection("clear_assignments") as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM assignments WHERE game_id = $1", game_id)
+                await conn.execute("DELETE FROM outbox WHERE game_id = $1", game_id)
+
+    async def commit_assignment_round(self, game_id: int, assignments: List[Tuple[int, int]]) -> bool:
+        """Атомарно сохранить распределение и поднять флаг его выполнения.
+
+        Строка игры блокируется FOR UPDATE, поэтому распределения одной игры
+        с разных реплик выполняются по очереди и второе увидит флаг.
+        Пары загружаются через COPY, уведомления дарителям ставятся в outbox
+        в той же транзакции. Возвращает False, если распределение уже
+        выполнено.
+        """
+        async with self._connection("commit_assignment_round") as conn:
+            async with conn.transaction():
+                await conn.execute("SELECT 1 FROM games WHERE game_id = $1 FOR UPDATE", game_id)
+                value = await conn.fetchval(
+                    "SELECT value FROM settings WHERE game_id = $1 AND key = 'assignment_done'", game_id
+                )
+                if value == "1":
+                    return False
+                await conn.execute("DELETE FROM assignments WHERE game_id = $1", game_id)
+                await conn.copy_records_to_table(
+                    "assignments",
+                    records=((game_id, giver_id, receiver_id) for giver_id, receiver_id in assignments),
+                    columns=("game_id", "giver_id", "receiver_id"),
+                )
+                await conn.execute("DELETE FROM outbox WHERE game_id = $1", game_id)
+                await conn.execute("""
+                    INSERT INTO outbox (game_id, chat_id)
+                    SELECT game_id, giver_id FROM assignments WHERE game_id = $1 ORDER BY giver_id
+                """, game_id)
+                await conn.execute("""
+                    INSERT INTO settings (game_id, key, value) VALUES ($1, 'assignment_done', '1')
+                    ON CONFLICT (game_id, key) DO UPDATE SET value = EXCLUDED.value
+                """, game_id)
+        return True
+
+    async def get_assignment(self, game_id: int, giver_id: int) -> Optional[Assignment]:
+        """Получить назначение для дарителя."""
+        async with self._connection("get_assignment") as conn:
+            row = await conn.fetchrow("""
+                SELECT a.giver_id, a.receiver_id, p.full_name, p.wish FROM assignments a
+                JOIN participants p ON p.game_id = a.game_id AND p.user_id = a.receiver_id
+                WHERE a.game_id = $1 AND a.giver_id = $2
+            """, game_id, giver_id)
+        return Assignment._make(row) if row else None
+
+    # Очередь уведомлений
+
+    async def claim_outbox(self, limit: int) -> List[dict]:
+        """Забрать до limit уведомлений, которым пора уйти, и пометить их 'sending'.
+
+        FOR UPDATE SKIP LOCKED: реплики забирают разные строки и не ждут
+        друг друга.
+        """
+        async with self._connection("claim_outbox") as conn:
+            rows = await conn.fetch("""
+                WITH claimed AS (
+                    UPDATE outbox SET status = 'sending', attempts = attempts + 1, claimed_at = now()
+                    WHERE id IN (
+                        SELECT id FROM outbox
+                        WHERE status = 'pending' AND next_attempt_at <= now()
+                        ORDER BY next_attempt_at, id LIMIT $1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, game_id, chat_id, attempts
+                )
+                SELECT c.id, c.game_id, c.chat_id, c.attempts, g.title, r.full_name, r.wish
+                FROM claimed c
+                LEFT JOIN games g ON g.game_id = c.game_id
+                LEFT JOIN assignments a ON a.game_id = c.game_id AND a.giver_id = c.chat_id
+                LEFT JOIN participants r ON r.game_id = a.game_id AND r.user_id = a.receiver_id
+                ORDER BY c.id
+            """, limit)
+        return [dict(row) for row in rows]
+
+    async def finish_outbox(
+        self,
+        sent: List[int],
+        retry: List[Tuple[int, float, str]] = (),
+        failed: List[Tuple[int, str]] = (),
+    ):
+        """Записать итог отправки забранных уведомлений."""
+        async with self._connection("finish_outbox") as conn:
+            async with conn.transaction():
+                if sent:
+                    await conn.execute("""
+                        WITH done AS (
+                            UPDATE outbox SET status = 'sent', last_error = NULL
+                            WHERE id = ANY($1::BIGINT[])
+                            RETURNING game_id, chat_id
+                        )
+                        UPDATE assignments a SET notified_at = now()
+                        FROM done d
+                        WHERE a.game_id = d.game_id AND a.giver_id = d.chat_id AND a.notified_at IS NULL
+                    """, list(sent))
+                if retry:
+                    await conn.executemany("""
+                        UPDATE outbox SET status = 'pending', last_error = $3,
+                            next_attempt_at = now() + make_interval(secs => $2)
+                        WHERE id = $1
+                    """, [(i, float(delay), error) for i, delay, error in retry])
+                if failed:
+                    await conn.executemany(
+                        "UPDATE outbox SET status = 'failed', last_error = $2 WHERE id = $1", list(failed)
+                    )
+
+    async def fail_stale_outbox(self, older_than: float = 0) -> int:
+        """Пометить 'failed' уведомления, зависшие в 'sending' дольше older_than секунд."""
+        async with self._connection("fail_stale_outbox") as conn:
+            status = await conn.execute("""
+                UPDATE outbox SET status = 'failed', last_error = 'отправка прервана'
+                WHERE status = 'sending' AND claimed_at <= now() - make_interval(secs => $1)
+            """, float(older_than))
+        return int(status.split()[-1])
+
+    async def requeue_failed_outbox(self, game_id: int) -> int:
+        """Вернуть в очередь неотправленные уведомления игры. Возвращает их число."""
+        async with self._connection("requeue_failed_outbox") as conn:
+            status = await conn.execute("""
+                UPDATE outbox SET status = 'pending', attempts = 0, next_attempt_at = now()
+                WHERE game_id = $1 AND status = 'failed'
+            """, game_id)
+        return int(status.split()[-1])
+
+    async def get_outbox_stats(self, game_id: int) -> Dict[str, int]:
+        """Число уведомлений игры по статусам (pending, sending, sent, failed)."""
+        async with self._connection("get_outbox_stats") as conn:
+            rows = await conn.fetch(
+                "SELECT status, COUNT(*) AS count FROM outbox WHERE game_id = $1 GROUP BY status", game_id
+            )
+        stats = dict.fromkeys(OUTBOX_STATUSES, 0)
+        stats.update((row["status"], row["count"]) for row in rows)
+        return stats
+
+    async def get_broadcast_recipients(self, game_id: int, audience: str) -> List[int]:
+        """Получить ID участников для рассылки в порядке регистрации."""
+        async with self._connection("get_broadcast_recipients") as conn:
+            rows = await conn.fetch(f"""
+                SELECT p.user_id FROM participants p
+                LEFT JOIN assignments a ON a.game_id = p.game_id AND a.giver_id = p.user_id
+                WHERE p.game_id = $1 AND {BROADCAST_AUDIENCES[audience]}
+                ORDER BY p.registered_at, p.user_id
+            """, game_id)
+        return [row["user_id"] for row in rows]
+
+    async def get_export_rows(self, game_id: int) -> List[ExportRow]:
+        """Получить участников вместе с их получателями одним запросом."""
+        async with self._connection("get_export_rows") as conn:
+            rows = await conn.fetch(EXPORT_QUERY, game_id)
+        return [ExportRow._make(row) for row in rows]
+
+    def iter_export_rows(self, game_id: int, batch_size: int = 500) -> AsyncIterator[ExportRow]:
+        """Лениво перебрать строки выгрузки в порядке регистрации."""
+        return self._iterate(ExportRow, "iter_export_rows", EXPORT_QUERY, game_id, batch_size=batch_size)
+
+    async def get_setting(self, game_id: int, key: str) -> Optional[str]:
+        """Значение настройки игры или None."""
+        async with self._connection("get_setting") as conn:
+            return await conn.fetchval("SELECT value FROM settings WHERE game_id = $1 AND key = $2", game_id, key)
+
+    async def set_setting(self, game_id: int, key: str, value: str):
+        """Записать настройку игры."""
+        async with self._connection("set_setting") as conn:
+            await conn.execute("""
+                INSERT INTO settings (game_id, key, value) VALUES ($1, $2, $3)
+                ON CONFLICT (game_id, key) DO UPDATE SET value = EXCLUDED.value
+            """, game_id, key, value)
+
+    async def reset_assignment_flag(self, game_id: int):
+        """Сбросить флаг выполнения распределения."""
+        async with self._connection("reset_assignment_flag") as conn:
+            await conn.execute(
+                "DELETE FROM settings WHERE game_id = $1 AND key = 'assignment_done'", game_id
+            )
+
+    async def reset_all(self, game_id: int):
+        """Полный сброс игры: очистить участников, распределения и настройки."""
+        async with self._connection("reset_all") as conn:
+            async with conn.transaction():
+                await conn.execute("DELETE FROM participants WHERE game_id = $1", game_id)
+                await conn.execute("DELETE FROM assignments WHERE game_id = $1", game_id)
+                await conn.execute("DELETE FROM outbox WHERE game_id = $1", game_id)
+                await conn.execute("DELETE FROM settings WHERE game_id = $1", game_id)
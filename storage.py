@@ -0,0 +1,160 @@
+"""Интерфейс хранилища данных бота и выбор его реализации."""
+from typing import AsyncContextManager, AsyncIterator, Dict, List, Optional, Protocol, Tuple
+
+from config import DATABASE_URL, STORAGE_BACKEND
+from models import Assignment, ExportRow, Participant
+
+STORAGE_SQLITE = "sqlite"
+STORAGE_POSTGRES = "postgres"
+
+
+class Storage(Protocol):
+    """Асинхронное хранилище: общий набор методов всех бэкендов.
+
+    Реализации — AsyncDatabase (SQLite, database.py) и PostgresDatabase
+    (postgres_database.py); CachedDatabase оборачивает любую из них.
+    Методы с одинаковым именем ведут себя одинаково во всех бэкендах.
+    """
+
+    # Сколько вызовов ждут очереди или выполняются (для метрик)
+    pending: int
+
+    async def close(self) -> None: ...
+
+    def try_lock(self, name: str) -> AsyncContextManager[bool]:
+        """Блокировка name на время блока, без ожидания: True, если взята.
+
+        С PostgreSQL блокировка общая для всех реплик бота.
+        """
+
+    # Игры
+
+    async def create_game(self, game_id: int, title: str, admin_id: int) -> bool:
+        """Создать игру с администратором. False, если игра уже есть."""
+
+    async def get_game(self, game_id: int) -> Optional[dict]: ...
+
+    async def add_game_admin(self, game_id: int, user_id: int) -> None: ...
+
+    async def is_game_admin(self, game_id: int, user_id: int) -> bool: ...
+
+    async def get_admin_ids(self) -> List[int]:
+        """ID всех администраторов игр."""
+
+    async def get_user_game(self, user_id: int) -> int: ...
+
+    async def set_user_game(self, user_id: int, game_id: int) -> None: ...
+
+    # Состояние диалогов
+
+    async def load_conversations(self, name: str) -> Dict[str, str]: ...
+
+    async def load_conversation(self, name: str, key: str) -> Optional[str]: ...
+
+    async def get_user_data_ids(self) -> List[int]: ...
+
+    async def load_user_data(self, user_id: int) -> Optional[str]: ...
+
+    async def save_persistence_batch(
+        self,
+        conversations: List[Tuple[str, str, Optional[str]]],
+        user_data: List[Tuple[int, Optional[str]]],
+    ) -> None:
+        """Записать изменения одной транзакцией; None удаляет запись."""
+
+    # Участники
+
+    async def is_registered(self, game_id: int, user_id: int) -> bool: ...
+
+    async def register_participant(
+        self, game_id: int, user_id: int, username: str, full_name: str, wish: str
+    ) -> bool:
+        """Зарегистрировать участника или обновить его данные."""
+
+    async def import_participants(self, game_id: int, rows: List[Tuple[int, Optional[str], str, str]]) -> Tuple[int, int]:
+        """Загрузить участников (user_id, username, full_name, wish); (добавлено, обновлено)."""
+
+    async def get_participant(self, game_id: int, user_id: int) -> Optional[Participant]: ...
+
+    async def get_participants_page(
+        self,
+        game_id: int,
+        anchor_id: Optional[int] = None,
+        backward: bool = False,
+        limit: int = 50,
+        search: Optional[str] = None,
+    ) -> List[Participant]:
+        """До limit + 1 участников после (или до) anchor_id в порядке регистрации."""
+
+    async def get_participant_ids(self, game_id: int) -> List[int]:
+        """ID участников в порядке регистрации."""
+
+    async def get_participant_count(self, game_id: int) -> int: ...
+
+    async def get_stats(self, game_id: int, hours: int = 24) -> dict:
+        """Участники, назначения, уведомления и регистрации по последним hours часам."""
+
+    async def clear_all_participants(self, game_id: int) -> None: ...
+
+    # Распределение
+
+    async def is_assignment_done(self, game_id: int) -> bool: ...
+
+    async def clear_assignments(self, game_id: int) -> None: ...
+
+    async def commit_assignment_round(self, game_id: int, assignments: List[Tuple[int, int]]) -> bool:
+        """Атомарно заменить пары, поставить уведомления в outbox и поднять флаг.
+
+        False, если флаг уже поднят.
+        """
+
+    async def get_assignment(self, game_id: int, giver_id: int) -> Optional[Assignment]: ...
+
+    async def get_broadcast_recipients(self, game_id: int, audience: str) -> List[int]:
+        """ID участников для рассылки: all, unassigned или unnotified."""
+
+    async def get_export_rows(self, game_id: int) -> List[ExportRow]: ...
+
+    def iter_export_rows(self, game_id: int, batch_size: int = 500) -> AsyncIterator[ExportRow]:
+        """Строки выгрузки в порядке регистрации, читаются порциями по batch_size."""
+
+    async def reset_assignment_flag(self, game_id: int) -> None: ...
+
+    # Очередь уведомлений
+
+    async def claim_outbox(self, limit: int) -> List[dict]:
+        """Забрать уведомления, которым пора уйти, пометив их 'sending'."""
+
+    async def finish_outbox(
+        self,
+        sent: List[int],
+        retry: List[Tuple[int, float, str]] = (),
+        failed: List[Tuple[int, str]] = (),
+    ) -> None: ...
+
+    async def fail_stale_outbox(self, older_than: float = 0) -> int:
+        """Пометить 'failed' зависшие в 'sending' уведомления."""
+
+    async def requeue_failed_outbox(self, game_id: int) -> int: ...
+
+    async def get_outbox_stats(self, game_id: int) -> Dict[str, int]: ...
+
+    # Настройки
+
+    async def get_setting(self, game_id: int, key: str) -> Optional[str]: ...
+
+    async def set_setting(self, game_id: int, key: str, value: str) -> None: ...
+
+    async def reset_all(self, game_id: int) -> None: ...
+
+
+def create_storage() -> Storage:
+    """Создать хранилище, выбранное в STORAGE_BACKEND."""
+    if STORAGE_BACKEND == STORAGE_POSTGRES:
+        from postgres_database import PostgresDatabase
+
+        return PostgresDatabase(DATABASE_URL)
+
+    from database import AsyncDatabase, Database
+
+    return AsyncDatabase(Database())
@@ -0,0 +1,77 @@
+"""Общие фикстуры тестов.
+
+Тесты хранилища выполняются на SQLite и, если задан TEST_DATABASE_URL, на
+PostgreSQL. База PostgreSQL должна быть отдельной тестовой: таблицы бота в
+ней очищаются перед каждым тестом.
+
+pytest-asyncio не нужен: корутины-тесты запускаются через asyncio.run.
+"""
+import asyncio
+import inspect
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# До импорта outbox и notifier: без лимитов рассылки и пауз перед повтором
+os.environ.update({"SEND_RATE": "1000000000", "SEND_PER_CHAT_INTERVAL": "0", "OUTBOX_RETRY_BASE": "0"})
+
+from database import AsyncDatabase, Database  # noqa: E402
+
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+TABLES = ("assignments", "participants", "settings", "game_admins", "user_games",
+          "conversation_states", "user_data", "games", "game_stats", "registration_stats", "outbox", "send_limit")
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_pyfunc_call(pyfuncitem):
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    funcargs = pyfuncitem.funcargs
+    asyncio.run(pyfuncitem.obj(**{name: funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}))
+    return True
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "santa.db")
+
+
+@pytest.fixture
+def database(db_path):
+    """Синхронная Database на временном файле."""
+    with Database(db_path) as database:
+        yield database
+
+
+async def _truncate_postgres(dsn: str):
+    from postgres_database import PostgresDatabase
+
+    async with PostgresDatabase(dsn) as db:
+        pool = await db._get_pool()
+        await pool.execute(f"TRUNCATE {', '.join(TABLES)}")
+        await pool.execute("DELETE FROM schema_version")
+
+
+@pytest.fixture(params=["sqlite", "postgres"])
+def backend(request):
+    return request.param
+
+
+@pytest.fixture
+def open_storage(backend, db_path):
+    """Фабрика хранилища: каждый вызов открывает новое подключение к одной и той же базе.
+
+    Хранилище открывается внутри теста: пул asyncpg привязан к циклу событий.
+    """
+    if backend == "sqlite":
+        return lambda: AsyncDatabase(Database(db_path))
+    if not TEST_DATABASE_URL:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    from postgres_database import PostgresDatabase
+
+    # Миграции применяются заново на очищенной схеме
+    asyncio.run(_truncate_postgres(TEST_DATABASE_URL))
+    return lambda: PostgresDatabase(TEST_DATABASE_URL)
@@ -0,0 +1,72 @@
+"""Онлайн-копирование базы SQLite, восстановление и ротация копий."""
+import asyncio
+import gzip
+import shutil
+import sqlite3
+
+import backup
+from database import DEFAULT_GAME_ID, AsyncDatabase, Database
+
+PARTICIPANTS = 20_000
+USER_ID_OFFSET = 1_000_000
+
+
+def snapshot_counts(path: str, workdir):
+    """Число участников по таблице и по game_stats в копии и результат quick_check."""
+    if path.endswith(".gz"):
+        unpacked = str(workdir / "unpacked.db")
+        with gzip.open(path, "rb") as packed, open(unpacked, "wb") as raw:
+            shutil.copyfileobj(packed, raw)
+        path = unpacked
+    conn = sqlite3.connect(path)
+    try:
+        rows = conn.execute("SELECT COUNT(*) FROM participants").fetchone()[0]
+        counted = conn.execute("SELECT COALESCE(SUM(participants), 0) FROM game_stats").fetchone()[0]
+        check = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    return rows, counted, check
+
+
+async def test_backup_during_writes(db_path, tmp_path):
+    directory = str(tmp_path / "backups")
+    async with AsyncDatabase(Database(db_path)) as db:
+        await db.import_participants(DEFAULT_GAME_ID, [
+            (USER_ID_OFFSET + i, None, f"Участник {USER_ID_OFFSET + i}", "Подарок для участника " * 4)
+            for i in range(PARTICIPANTS)
+        ])
+        before = await db.get_participant_count(DEFAULT_GAME_ID)
+        # Мелкие шаги с паузами: копия снимается дольше, чем идут регистрации
+        task = asyncio.ensure_future(backup.backup_now(
+            db_path=db_path, directory=directory, pages=16, sleep=0.001, compress=True,
+        ))
+        user_id = USER_ID_OFFSET * 10
+        while not task.done():
+            user_id += 1
+            await db.register_participant(DEFAULT_GAME_ID, user_id, None, f"Участник {user_id}", "Подарок")
+            await asyncio.sleep(0)
+        result = await task
+        after = await db.get_participant_count(DEFAULT_GAME_ID)
+
+    assert after > before, "регистрации шли во время копии"
+    # Между шагами копирования — пауза sleep
+    assert result.steps > 1 and result.seconds >= (result.steps - 1) * 0.001
+    rows, counted, integrity = snapshot_counts(result.path, tmp_path)
+    assert integrity == "ok"
+    # Копия — согласованный снимок на время копирования
+    assert before <= rows <= after
+    assert rows == counted
+
+    restored = str(tmp_path / "restored.db")
+    Database(restored).close()
+    backup.restore_backup(result.path, restored)
+    with Database(restored) as database:
+        assert database.get_participant_count(DEFAULT_GAME_ID) == rows
+
+
+def test_rotation_keeps_latest(database, db_path, tmp_path):
+    directory = str(tmp_path / "backups")
+    # Копии одной секунды различаются номером: …-2.db, …-3.db
+    paths = [backup.make_backup(db_path, directory, compress=False, keep=3).path for _ in range(4)]
+    assert backup.list_backups(directory) == paths[:0:-1]
+    assert backup.latest_backup(directory) == paths[-1]
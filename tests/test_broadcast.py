@@ -0,0 +1,59 @@
+"""Рассылка /broadcast: одна на игру, кнопки других реплик управляют ею через хранилище."""
+from contextlib import AsyncExitStack
+from types import SimpleNamespace
+
+from broadcast import CANCELLED, PAUSED, RUNNING, Broadcast, apply_control, request_control
+
+GAME_ID = -100123
+
+
+class FakeJob:
+    def schedule_removal(self):
+        pass
+
+
+class FakeJobQueue:
+    def run_once(self, callback, when, data=None, name=None):
+        return FakeJob()
+
+
+class FakeMessage:
+    text = None
+
+    async def edit_text(self, text: str, reply_markup=None):
+        self.text = text
+
+
+async def test_control_from_other_replica(backend, open_storage):
+    async with AsyncExitStack() as stack:
+        db = await stack.enter_async_context(open_storage())
+        # С SQLite работает один процесс: «другая реплика» — то же хранилище
+        replica = await stack.enter_async_context(open_storage()) if backend == "postgres" else db
+        context = SimpleNamespace(job_queue=FakeJobQueue(), bot_data={})
+        message = FakeMessage()
+        job = Broadcast(GAME_ID, "текст", [1, 2, 3], message, db)
+        assert await job.acquire()
+        context.bot_data["broadcasts"] = {GAME_ID: job}
+        # Вторую рассылку в игре не запустить
+        assert not await Broadcast(GAME_ID, "другой текст", [1], FakeMessage(), replica).acquire()
+
+        assert await request_control(replica, GAME_ID, "pause")
+        await apply_control(context, job)
+        assert job.status == PAUSED
+        assert await request_control(replica, GAME_ID, "resume")
+        await apply_control(context, job)
+        assert job.status == RUNNING
+        # Команда выполняется один раз
+        await apply_control(context, job)
+        assert job.status == RUNNING
+
+        assert await request_control(replica, GAME_ID, "cancel")
+        await apply_control(context, job)
+        assert job.status == CANCELLED
+        assert context.bot_data["broadcasts"] == {}
+        assert message.text.startswith("⛔")
+        # Рассылка закончилась: игра свободна, команду передать некому
+        assert not await request_control(replica, GAME_ID, "resume")
+        next_job = Broadcast(GAME_ID, "текст", [1], FakeMessage(), replica)
+        assert await next_job.acquire()
+        await next_job.release()
@@ -0,0 +1,50 @@
+"""Защита от флуда: классы обновлений и лимиты по умолчанию."""
+import time
+
+import pytest
+from telegram import Update
+
+from flood import BUTTON, COMMAND, HEAVY, MESSAGE, FloodGuard, parse_limits
+from update_processor import HEAVY_COMMANDS
+
+DEFAULT_LIMITS = "heavy:0.2:3,command:1:5,button:1:5,message:1:5"
+
+
+def update(text=None, callback_data=None) -> Update:
+    user = {"id": 1, "is_bot": False, "first_name": "User"}
+    message = {"message_id": 1, "date": int(time.time()), "chat": {"id": 1, "type": "private"}, "from": user}
+    if callback_data is not None:
+        return Update.de_json({"update_id": 1, "callback_query": {
+            "id": "1", "from": user, "chat_instance": "1", "data": callback_data, "message": message,
+        }}, None)
+    return Update.de_json({"update_id": 1, "message": dict(message, text=text)}, None)
+
+
+@pytest.fixture
+def guard():
+    return FloodGuard(HEAVY_COMMANDS, parse_limits(DEFAULT_LIMITS))
+
+
+@pytest.mark.parametrize("text, kind", [
+    ("/assign", HEAVY),
+    ("/export", HEAVY),
+    ("/reset_assignments", HEAVY),
+    ("/status", COMMAND),
+    ("/status@fake_santa_bot Анна", COMMAND),
+    ("/start", COMMAND),
+    ("Анна", MESSAGE),
+])
+def test_classify(guard, text, kind):
+    assert guard.classify(update(text)) == kind
+
+
+def test_classify_button(guard):
+    assert guard.classify(update(callback_data="stp:0:1")) == BUTTON
+
+
+def test_status_pages_use_command_limit(guard):
+    # Пять /status подряд укладываются в запас обычных команд, тяжёлых — только три
+    assert [guard.check(1, guard.classify(update("/status")), now=0)[0] for _ in range(6)] == [True] * 5 + [False]
+    assert [guard.check(1, guard.classify(update("/export")), now=0)[0] for _ in range(4)] == [True] * 3 + [False]
+    # Запас восстанавливается со скоростью класса
+    assert guard.check(1, COMMAND, now=1)[0]
@@ -0,0 +1,104 @@
+"""Лимиты рассылки: token bucket, интервалы по чатам и общий Notifier процесса."""
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+import metrics
+from notifier import Notifier, SharedTokenBucket, TokenBucket, shared_notifier
+from outbox import OutboxWorker
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent.append(chat_id)
+
+
+async def test_bucket_resumes_empty_after_pause():
+    bucket = TokenBucket(rate=100)
+    bucket.pause(0.2)
+    started = time.monotonic()
+    for _ in range(10):
+        await bucket.acquire()
+    # После паузы корзина пуста: 10 токенов копятся ещё ~0.1 с, а не выдаются сразу
+    assert time.monotonic() - started >= 0.28
+
+
+class FakeSendLimit:
+    """Общий лимит отправки в хранилище: выдаёт не больше tokens токенов."""
+
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.requests = 0
+        self.pauses = []
+
+    async def take_send_tokens(self, count: int, rate: float, capacity: float):
+        self.requests += 1
+        granted = min(count, self.tokens)
+        self.tokens -= granted
+        return granted, 0.01
+
+    async def pause_sends(self, seconds: float):
+        self.pauses.append(seconds)
+
+
+async def test_shared_bucket_takes_tokens_in_chunks():
+    storage = FakeSendLimit(tokens=25)
+    bucket = SharedTokenBucket(storage, rate=100)
+    for _ in range(25):
+        await bucket.acquire()
+    # Порции по 10 токенов: три запроса к базе, а не 25
+    assert storage.requests == 3
+
+    # Пауза после RetryAfter передаётся другим репликам
+    bucket.pause(0.05)
+    storage.tokens = 1
+    await bucket.acquire()
+    assert len(storage.pauses) == 1 and 0 < storage.pauses[0] <= 0.05
+
+
+async def test_chat_send_times_pruned():
+    notifier = Notifier(FakeBot(), rate=1_000_000, per_chat_interval=0.01)
+    for chat_id in range(100):
+        await notifier.send_once(chat_id, "текст")
+    await asyncio.sleep(0.02)
+    await notifier.send_once(100, "текст")
+    # Чаты, интервал которых истёк, не хранятся
+    assert list(notifier._chat_last_sent) == [100]
+
+
+async def test_senders_share_rate_limit():
+    bot = FakeBot()
+    bot_data = {"notifier": Notifier(bot, rate=200, per_chat_interval=0)}
+    notifier = shared_notifier(bot_data, bot)
+    assert shared_notifier(bot_data, bot) is notifier
+    assert OutboxWorker(None, bot, notifier).notifier is notifier
+
+    started = time.monotonic()
+    # Уведомления и /broadcast одновременно: вместе не быстрее общего лимита
+    await asyncio.gather(
+        notifier.send_all(((chat_id, "уведомление") for chat_id in range(150)), total=150),
+        shared_notifier(bot_data, bot).send_all(((chat_id, "рассылка") for chat_id in range(150, 300)), total=150),
+    )
+    assert len(bot.sent) == 300
+    # 200 токенов в корзине сразу, остальные 100 — со скоростью 200 в секунду
+    assert time.monotonic() - started >= 0.45
+
+
+class FloodedBot:
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        raise RetryAfter(0)
+
+
+async def test_exhausted_retries_not_counted_as_failed():
+    notifier = Notifier(FloodedBot(), rate=1_000_000, per_chat_interval=0, max_retries=2)
+    results = ("retry_after", "failed", "exhausted")
+    before = {result: metrics.SEND_TOTAL.value(result=result) for result in results}
+    assert not await notifier.send(1, "текст")
+    # Каждая попытка посчитана один раз, отказ от сообщения — отдельно
+    assert {result: metrics.SEND_TOTAL.value(result=result) - before[result] for result in results} == {
+        "retry_after": 3, "failed": 0, "exhausted": 1,
+    }
@@ -0,0 +1,95 @@
+"""Доставка уведомлений о назначении через outbox.
+
+Воркер рассылает уведомления через заглушку бота с временными и
+постоянными ошибками и «падает» посреди рассылки. После перезапуска на той
+же базе рассылка продолжается сама: ни одно уведомление не пропадает молча
+и не уходит дважды, а /resend досылает то, что осталось failed.
+
+Заглушка засчитывает сообщение доставленным до паузы, изображающей ответ
+Telegram, поэтому отправки, прерванные падением, — неоднозначные: дошли,
+но бот об этом не узнал. Только они могут прийти повторно после /resend.
+"""
+import asyncio
+import collections
+
+from telegram.error import Forbidden, NetworkError
+
+from outbox import OutboxWorker
+
+GAME_ID = -100300
+PARTICIPANTS = 200
+USER_ID_OFFSET = 1_000_000
+# Даритель с двумя сетевыми ошибками подряд и даритель, заблокировавший бота
+FLAKY_ID = USER_ID_OFFSET + 5
+BLOCKED_ID = USER_ID_OFFSET + 7
+
+
+class FakeBot:
+    """Заглушка бота: считает доставленные сообщения и выдаёт заданные ошибки."""
+
+    def __init__(self, latency: float = 0.002):
+        self.latency = latency
+        self.delivered = collections.Counter()
+        self.errors = {FLAKY_ID: [NetworkError("timeout"), NetworkError("timeout")]}
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        if chat_id == BLOCKED_ID:
+            raise Forbidden("bot was blocked by the user")
+        errors = self.errors.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.delivered[chat_id] += 1
+        await asyncio.sleep(self.latency)
+
+
+async def drain_all(worker: OutboxWorker):
+    """Прогнать воркер, пока в очереди есть уведомления (повторы приходят без паузы)."""
+    while await worker.drain():
+        pass
+
+
+async def test_resume_after_crash(open_storage):
+    bot = FakeBot()
+    givers = [USER_ID_OFFSET + i for i in range(PARTICIPANTS)]
+
+    async with open_storage() as db:
+        await db.create_game(GAME_ID, "Outbox", 1)
+        await db.import_participants(
+            GAME_ID, [(user_id, None, f"Участник {user_id}", "Подарок") for user_id in givers]
+        )
+        await db.commit_assignment_round(GAME_ID, list(zip(givers, givers[1:] + givers[:1])))
+
+        # Воркер «падает», когда отправлена половина уведомлений
+        task = asyncio.create_task(drain_all(OutboxWorker(db, bot)))
+        while sum(bot.delivered.values()) < PARTICIPANTS // 2:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        crashed = await db.get_outbox_stats(GAME_ID)
+    assert crashed["sending"] > 0
+
+    async with open_storage() as db:
+        # Перезапуск: post_init бота с SQLite делает то же; с PostgreSQL зависшие
+        # уведомления помечает воркер через OUTBOX_SENDING_TIMEOUT
+        assert await db.fail_stale_outbox(0) >= crashed["sending"]
+        await drain_all(OutboxWorker(db, bot))
+        stats = await db.get_outbox_stats(GAME_ID)
+        # Прерванные отправки помечены failed, а не отправлены заново; кроме них failed — только заблокировавший бота
+        assert crashed["sending"] <= stats["failed"] <= crashed["sending"] + 1
+        assert stats["pending"] == 0 and stats["sending"] == 0
+        assert max(bot.delivered.values()) == 1
+        assert bot.delivered[FLAKY_ID] == 1
+        delivered = sum(1 for user_id in givers if bot.delivered[user_id])
+        assert stats["sent"] <= delivered
+        assert stats["sent"] + stats["failed"] == PARTICIPANTS
+        # Дошли, но не записаны как sent: ответ потерян при падении
+        unknown = delivered - stats["sent"]
+
+        await db.requeue_failed_outbox(GAME_ID)
+        await drain_all(OutboxWorker(db, bot))
+        assert await db.get_outbox_stats(GAME_ID) == {
+            "pending": 0, "sending": 0, "sent": PARTICIPANTS - 1, "failed": 1,
+        }
+        assert all(bot.delivered[user_id] for user_id in givers if user_id != BLOCKED_ID)
+        assert sum(1 for count in bot.delivered.values() if count > 1) <= unknown
+        assert (await db.get_stats(GAME_ID))["notified"] == PARTICIPANTS - 1
@@ -0,0 +1,76 @@
+"""Сохранение user_data и состояния диалогов в хранилище."""
+import pytest
+from telegram.ext._utils.trackingdict import TrackingDict
+
+from persistence import StoragePersistence
+
+
+async def reload_user_data(db, user_id: int) -> dict:
+    """user_data пользователя так, как его увидит бот после перезапуска."""
+    persistence = StoragePersistence(db)
+    await persistence.get_user_data()
+    user_data = {}
+    await persistence.refresh_user_data(user_id, user_data)
+    return user_data
+
+
+async def test_user_data_survives_restart(open_storage):
+    async with open_storage() as db:
+        persistence = StoragePersistence(db)
+        await persistence.get_user_data()
+        user_data = {"game_id": -100, "status_search": {"-100": "Анна"}}
+        await persistence.update_user_data(1, user_data)
+        await persistence.flush()
+
+        restored = await reload_user_data(db, 1)
+        assert restored == user_data
+        # После перезапуска данные продолжают сохраняться
+        restored["status_search"]["-200"] = "Борис"
+        await persistence.update_user_data(1, restored)
+        await persistence.flush()
+        assert (await reload_user_data(db, 1))["status_search"] == {"-100": "Анна", "-200": "Борис"}
+
+
+async def test_unserializable_key_fails_loudly(open_storage):
+    async with open_storage() as db:
+        persistence = StoragePersistence(db)
+        await persistence.get_user_data()
+        # Ключи int и str вперемешку не сортируются при записи в JSON
+        user_data = {"game_id": -100, "status_search": {-100: "Анна", "-200": "Борис"}}
+        with pytest.raises(TypeError, match="status_search"):
+            await persistence.update_user_data(1, user_data)
+        await persistence.flush()
+        # Остальные данные пользователя сохранены
+        assert await reload_user_data(db, 1) == {"game_id": -100}
+
+
+async def test_shared_state_follows_other_replica(open_storage):
+    async with open_storage() as db:
+        first, second = StoragePersistence(db, shared=True), StoragePersistence(db, shared=True)
+        key = (1, 1)
+        conversations, user_data = TrackingDict(), {}
+        await second.refresh_conversation("registration", key, conversations)
+        await second.refresh_user_data(1, user_data)
+
+        # Регистрацию продолжила другая реплика
+        await first.update_conversation("registration", key, 1)
+        await first.update_user_data(1, {"full_name": "Анна"})
+        await first.flush()
+        second.apply_change("conversation_states:registration:[1, 1]")
+        second.apply_change("user_data:1")
+        await second.refresh_conversation("registration", key, conversations)
+        await second.refresh_user_data(1, user_data)
+        assert conversations == {key: 1}
+        assert user_data == {"full_name": "Анна"}
+        # Прочитанное состояние не записывается обратно как изменение этой реплики
+        assert conversations.pop_accessed_write_items() == []
+
+        # Регистрация закончена, а уведомления потерялись: перечитывается всё
+        await first.update_conversation("registration", key, None)
+        await first.drop_user_data(1)
+        await first.flush()
+        second.apply_change(None)
+        await second.refresh_conversation("registration", key, conversations)
+        await second.refresh_user_data(1, user_data)
+        assert conversations == {}
+        assert user_data == {}
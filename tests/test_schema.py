@@ -0,0 +1,151 @@
+"""Миграции схемы SQLite и планы горячих запросов."""
+import sqlite3
+
+import pytest
+
+from database import DEFAULT_GAME_ID, SCHEMA_VERSION, Database
+
+GAME_ID = -100123
+PARTICIPANTS = 500
+
+# Схема до появления нескольких игр
+SINGLE_GAME_SCHEMA = """
+    CREATE TABLE participants (
+        user_id INTEGER PRIMARY KEY,
+        username TEXT,
+        full_name TEXT NOT NULL,
+        wish TEXT NOT NULL,
+        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE assignments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        giver_id INTEGER NOT NULL,
+        receiver_id INTEGER NOT NULL,
+        assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE settings (key TEXT PRIMARY KEY, value TEXT);
+    INSERT INTO participants (user_id, username, full_name, wish) VALUES
+        (1, 'a', 'Анна', 'Книга'), (2, 'b', 'Борис', 'Шарф'), (3, NULL, 'Вера', 'Чай');
+    INSERT INTO assignments (giver_id, receiver_id) VALUES (1, 2), (2, 3), (3, 1);
+    INSERT INTO settings (key, value) VALUES ('assignment_done', '1');
+"""
+
+# Несколько игр, но версия схемы ещё не записана и даритель не уникален
+UNVERSIONED_SCHEMA = """
+    CREATE TABLE games (
+        game_id INTEGER PRIMARY KEY, title TEXT NOT NULL, created_by INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE participants (
+        game_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        username TEXT,
+        full_name TEXT NOT NULL,
+        wish TEXT NOT NULL,
+        registered_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (game_id, user_id)
+    );
+    CREATE TABLE assignments (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        game_id INTEGER NOT NULL,
+        giver_id INTEGER NOT NULL,
+        receiver_id INTEGER NOT NULL,
+        assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE INDEX idx_assignments_game_giver ON assignments (game_id, giver_id);
+    CREATE TABLE settings (game_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT, PRIMARY KEY (game_id, key));
+    INSERT INTO games (game_id, title) VALUES (0, 'Тайный Санта');
+    INSERT INTO participants (game_id, user_id, username, full_name, wish) VALUES
+        (0, 1, 'a', 'Анна', 'Книга'), (0, 2, 'b', 'Борис', 'Шарф');
+    INSERT INTO assignments (game_id, giver_id, receiver_id) VALUES (0, 1, 1), (0, 1, 2), (0, 2, 1);
+"""
+
+
+
+def create_legacy(path: str, schema: str):
+    conn = sqlite3.connect(path)
+    conn.executescript(schema)
+    conn.close()
+
+
+def test_single_game_upgrade(db_path):
+    create_legacy(db_path, SINGLE_GAME_SCHEMA)
+    with Database(db_path) as database:
+        assert database.schema_version() == SCHEMA_VERSION
+        assert database.get_participant_count(DEFAULT_GAME_ID) == 3
+        assert database.get_assignment(DEFAULT_GAME_ID, 1).receiver_name == "Борис"
+        assert database.is_assignment_done(DEFAULT_GAME_ID)
+
+
+def test_unversioned_upgrade(db_path):
+    create_legacy(db_path, UNVERSIONED_SCHEMA)
+    with Database(db_path) as database:
+        conn = database.get_connection()
+        assert database.schema_version() == SCHEMA_VERSION
+        # Из дубликатов дарителя оставлено последнее назначение
+        assert conn.execute("SELECT COUNT(*) FROM assignments WHERE giver_id = 1").fetchone()[0] == 1
+        assert database.get_assignment(DEFAULT_GAME_ID, 1).receiver_name == "Борис"
+        with pytest.raises(sqlite3.IntegrityError):
+            conn.execute(
+                "INSERT INTO assignments (game_id, giver_id, receiver_id) VALUES (?, ?, ?)",
+                (DEFAULT_GAME_ID, 2, 2),
+            )
+        # Повторный запуск миграций ничего не меняет
+        assert database.migrate() == SCHEMA_VERSION
+
+
+HOT_CALLS = {
+    "get_game": lambda database: database.get_game(GAME_ID),
+    "is_game_admin": lambda database: database.is_game_admin(GAME_ID, 1),
+    "get_user_game": lambda database: database.get_user_game(1),
+    "is_registered": lambda database: database.is_registered(GAME_ID, 7),
+    "get_participant": lambda database: database.get_participant(GAME_ID, 7),
+    "get_participant_ids": lambda database: database.get_participant_ids(GAME_ID),
+    "get_participants_page": lambda database: database.get_participants_page(GAME_ID, 7),
+    "get_participants_page назад": lambda database: database.get_participants_page(GAME_ID, 7, backward=True),
+    "get_participants_page поиск": lambda database: database.get_participants_page(GAME_ID, search="номер"),
+    "get_participant_count": lambda database: database.get_participant_count(GAME_ID),
+    "is_assignment_done": lambda database: database.is_assignment_done(GAME_ID),
+    "get_assignment": lambda database: database.get_assignment(GAME_ID, 7),
+    "get_export_rows": lambda database: database.get_export_rows(GAME_ID),
+    "load_user_data": lambda database: database.load_user_data(1),
+    "load_conversations": lambda database: database.load_conversations("registration"),
+    "get_outbox_stats": lambda database: database.get_outbox_stats(GAME_ID),
+    "claim_outbox": lambda database: database.claim_outbox(50),
+}
+
+
+@pytest.fixture(scope="module")
+def filled_database(tmp_path_factory):
+    """База с двумя играми по PARTICIPANTS участников и распределением."""
+    with Database(str(tmp_path_factory.mktemp("plans") / "plans.db")) as database:
+        database.create_game(GAME_ID, "Отдел", 1)
+        for game_id in (DEFAULT_GAME_ID, GAME_ID):
+            with database.transaction() as conn:
+                conn.executemany(
+                    "INSERT INTO participants (game_id, user_id, full_name, wish) VALUES (?, ?, ?, ?)",
+                    ((game_id, user_id, f"Участник {user_id}", "Подарок") for user_id in range(PARTICIPANTS)),
+                )
+            database.commit_assignment_round(
+                game_id, [(user_id, (user_id + 1) % PARTICIPANTS) for user_id in range(PARTICIPANTS)]
+            )
+        database.get_connection().execute("ANALYZE")
+        yield database
+
+
+@pytest.mark.parametrize("name", HOT_CALLS)
+def test_hot_queries_use_indexes(filled_database, name):
+    """SELECT горячих методов читают таблицы по индексу, без полного просмотра и сортировки во временном B-дереве."""
+    statements = []
+    conn = filled_database.get_connection()
+    conn.set_trace_callback(
+        lambda statement: statements.append(statement) if statement.lstrip().upper().startswith("SELECT") else None
+    )
+    try:
+        HOT_CALLS[name](filled_database)
+    finally:
+        conn.set_trace_callback(None)
+    assert statements
+    for statement in statements:
+        plan = [row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {statement}")]
+        assert not [step for step in plan if step.startswith("SCAN") or "TEMP B-TREE" in step], plan
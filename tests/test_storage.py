@@ -0,0 +1,299 @@
+"""Бэкенды хранилища ведут себя одинаково.
+
+Каждый тест выполняется на SQLite и, если задан TEST_DATABASE_URL, на
+PostgreSQL (фикстура open_storage).
+"""
+import asyncio
+
+import pytest
+
+from cache import CachedDatabase
+from database import DEFAULT_GAME_ID
+from models import ExportRow
+
+GAME_ID = -100123
+
+
+async def register(db, *user_ids):
+    for user_id in user_ids:
+        await db.register_participant(GAME_ID, user_id, f"user{user_id}", f"Участник {user_id}", "Книга")
+
+
+async def create_game(db):
+    await db.create_game(GAME_ID, "Отдел", 10)
+    await register(db, 20, 21, 22)
+    await db.register_participant(GAME_ID, 21, None, "Новое имя", "Шарф")
+
+
+async def test_games_and_admins(open_storage):
+    async with open_storage() as db:
+        assert await db.get_game(DEFAULT_GAME_ID) is not None
+        assert await db.create_game(GAME_ID, "Отдел", 10)
+        assert not await db.create_game(GAME_ID, "Отдел", 11)
+        assert await db.is_game_admin(GAME_ID, 10)
+        await db.add_game_admin(GAME_ID, 12)
+        await db.add_game_admin(GAME_ID, 12)
+        assert await db.is_game_admin(GAME_ID, 12)
+        assert await db.get_admin_ids() == [10, 12]
+
+        assert await db.get_user_game(20) == DEFAULT_GAME_ID
+        await db.set_user_game(20, GAME_ID)
+        await db.set_user_game(20, GAME_ID)
+        assert await db.get_user_game(20) == GAME_ID
+
+
+async def test_registration_updates_participant(open_storage):
+    async with open_storage() as db:
+        await create_game(db)
+        assert await db.get_participant_count(GAME_ID) == 3
+        participant = await db.get_participant(GAME_ID, 21)
+        assert (participant.username, participant.full_name, participant.wish) == (None, "Новое имя", "Шарф")
+        assert await db.is_registered(GAME_ID, 22)
+        assert not await db.is_registered(DEFAULT_GAME_ID, 22)
+
+        stats = await db.get_stats(GAME_ID)
+        assert (stats["participants"], stats["assigned"], sum(count for _, count in stats["hours"])) == (3, 0, 3)
+
+
+async def test_participants_in_registration_order(open_storage):
+    async with open_storage() as db:
+        await create_game(db)
+        assert await db.get_participant_ids(GAME_ID) == [20, 21, 22]
+
+        rows = []
+        async for row in db.iter_export_rows(GAME_ID, batch_size=2):
+            # Запись между порциями не мешает перебору
+            await db.register_participant(GAME_ID, row.user_id, row.username, row.full_name, row.wish)
+            rows.append(row)
+        assert rows == await db.get_export_rows(GAME_ID)
+        assert isinstance(rows[1], ExportRow)
+        assert rows[1].full_name == "Новое имя"
+
+
+async def test_participants_page(open_storage):
+    async with open_storage() as db:
+        await create_game(db)
+        # Первая страница — limit + 1 строк, чтобы понять, есть ли следующая
+        assert [p.user_id for p in await db.get_participants_page(GAME_ID, limit=2)] == [20, 21, 22]
+        assert [p.user_id for p in await db.get_participants_page(GAME_ID, 21, limit=2)] == [22]
+        page = await db.get_participants_page(GAME_ID, 22, backward=True, limit=1)
+        assert [p.user_id for p in page] == [20, 21]
+        page = await db.get_participants_page(GAME_ID, search="НОВОЕ")
+        assert [p.full_name for p in page] == ["Новое имя"]
+
+
+async def test_assignment_round(open_storage):
+    async with open_storage() as db:
+        await create_game(db)
+        assert not await db.is_assignment_done(GAME_ID)
+        assert await db.commit_assignment_round(GAME_ID, [(20, 21), (21, 22), (22, 20)])
+        assert await db.is_assignment_done(GAME_ID)
+        assert not await db.commit_assignment_round(GAME_ID, [(20, 22)])
+        assignment = await db.get_assignment(GAME_ID, 20)
+        assert assignment is not None and assignment.receiver_name == "Новое имя"
+
+        rows = await db.get_export_rows(GAME_ID)
+        assert [(r.user_id, r.receiver_name) for r in rows] == [
+            (20, "Новое имя"), (21, "Участник 22"), (22, "Участник 20"),
+        ]
+        assert [row async for row in db.iter_export_rows(GAME_ID, batch_size=2)] == rows
+
+        # После сброса флага распределение заменяет пары
+        await db.reset_assignment_flag(GAME_ID)
+        assert await db.commit_assignment_round(GAME_ID, [(20, 22), (22, 21), (21, 20)])
+        assert (await db.get_assignment(GAME_ID, 20)).receiver_name == "Участник 22"
+
+
+async def test_broadcast_recipients(open_storage):
+    async with open_storage() as db:
+        await create_game(db)
+        await db.commit_assignment_round(GAME_ID, [(20, 21), (21, 22), (22, 20)])
+        # Уведомление доставлено только первому дарителю
+        claimed = await db.claim_outbox(1)
+        assert [row["chat_id"] for row in claimed] == [20]
+        await db.finish_outbox([claimed[0]["id"]])
+        await register(db, 23)
+        assert await db.get_broadcast_recipients(GAME_ID, "all") == [20, 21, 22, 23]
+        assert await db.get_broadcast_recipients(GAME_ID, "unassigned") == [23]
+        assert await db.get_broadcast_recipients(GAME_ID, "unnotified") == [21, 22]
+        stats = await db.get_stats(GAME_ID)
+        assert (stats["participants"], stats["assigned"], stats["notified"]) == (4, 3, 1)
+
+        await db.clear_assignments(GAME_ID)
+        assert await db.get_assignment(GAME_ID, 20) is None
+        stats = await db.get_stats(GAME_ID)
+        assert (stats["assigned"], stats["notified"]) == (0, 0)
+
+
+async def test_outbox(open_storage):
+    async with open_storage() as db:
+        await create_game(db)
+        await db.commit_assignment_round(GAME_ID, [(20, 21), (21, 22), (22, 20)])
+        assert await db.get_outbox_stats(GAME_ID) == {"pending": 3, "sending": 0, "sent": 0, "failed": 0}
+        claimed = await db.claim_outbox(2)
+        assert [(r["chat_id"], r["full_name"], r["wish"], r["attempts"]) for r in claimed] == [
+            (20, "Новое имя", "Шарф", 1), (21, "Участник 22", "Книга", 1),
+        ]
+        rest = await db.claim_outbox(10)
+        assert [r["chat_id"] for r in rest] == [22]
+
+        await db.finish_outbox([claimed[0]["id"]], [(claimed[1]["id"], 0, "сеть")], [(rest[0]["id"], "Forbidden")])
+        assert await db.get_outbox_stats(GAME_ID) == {"pending": 1, "sending": 0, "sent": 1, "failed": 1}
+        assert (await db.get_stats(GAME_ID))["notified"] == 1
+        retried = await db.claim_outbox(10)
+        assert [(r["chat_id"], r["attempts"]) for r in retried] == [(21, 2)]
+
+        # Процесс «упал», не записав итог: уведомление не отправляется само, а ждёт /resend
+        assert await db.fail_stale_outbox(0) == 1
+        assert await db.claim_outbox(10) == []
+        assert await db.requeue_failed_outbox(GAME_ID) == 2
+        claimed = await db.claim_outbox(10)
+        assert [(r["chat_id"], r["attempts"]) for r in claimed] == [(21, 1), (22, 1)]
+        await db.finish_outbox([r["id"] for r in claimed])
+        assert (await db.get_stats(GAME_ID))["notified"] == 3
+        assert await db.claim_outbox(10) == []
+
+        await db.clear_assignments(GAME_ID)
+        assert sum((await db.get_outbox_stats(GAME_ID)).values()) == 0
+
+
+async def test_persistence_batch(open_storage):
+    async with open_storage() as db:
+        await db.save_persistence_batch(
+            [("registration", "[1, 1]", "0"), ("registration", "[2, 2]", "1")],
+            [(1, '{"full_name": "А"}'), (2, '{"game_id": 0}')],
+        )
+        await db.save_persistence_batch([("registration", "[1, 1]", None)], [(1, None), (2, '{"game_id": 5}')])
+        assert await db.load_conversations("registration") == {"[2, 2]": "1"}
+        assert await db.get_user_data_ids() == [2]
+        assert await db.load_user_data(2) == '{"game_id": 5}'
+
+
+async def test_settings(open_storage):
+    async with open_storage() as db:
+        assert await db.get_setting(GAME_ID, "commands") is None
+        await db.set_setting(GAME_ID, "commands", "a")
+        await db.set_setting(GAME_ID, "commands", "b")
+        assert await db.get_setting(GAME_ID, "commands") == "b"
+
+
+async def test_reset(open_storage):
+    async with open_storage() as db:
+        await create_game(db)
+        await db.commit_assignment_round(GAME_ID, [(20, 21), (21, 22), (22, 20)])
+        await db.reset_all(GAME_ID)
+        assert await db.get_participant_count(GAME_ID) == 0
+        assert not await db.is_assignment_done(GAME_ID)
+        assert await db.get_stats(GAME_ID) == {"participants": 0, "assigned": 0, "notified": 0, "hours": []}
+        assert await db.get_game(GAME_ID) is not None
+
+        await register(db, 40)
+        await db.register_participant(DEFAULT_GAME_ID, 40, None, "Участник 40", "Чай")
+        await db.clear_all_participants(GAME_ID)
+        assert await db.get_participant_count(GAME_ID) == 0
+        assert await db.get_participant_count(DEFAULT_GAME_ID) == 1
+
+
+async def test_import_participants(open_storage):
+    async with open_storage() as db:
+        await db.create_game(GAME_ID, "Отдел", 10)
+        rows = [(50, "user50", "Участник 50", "Подарок"), (51, None, "Участник 51", "Подарок")]
+        assert await db.import_participants(GAME_ID, rows) == (2, 0)
+        rows = [(50, None, "Новое имя 50", "Другой подарок"), (52, None, "Участник 52", "Подарок")]
+        assert await db.import_participants(GAME_ID, rows) == (1, 1)
+        participant = await db.get_participant(GAME_ID, 50)
+        # Пустой username не затирает сохранённый
+        assert (participant.username, participant.full_name) == ("user50", "Новое имя 50")
+        stats = await db.get_stats(GAME_ID)
+        assert stats["participants"] == 3
+        assert sum(count for _, count in stats["hours"]) == 3
+
+
+@pytest.mark.parametrize("backend", ["postgres"])
+async def test_concurrent_replicas(open_storage):
+    async with open_storage() as db, open_storage() as replica:
+        await db.create_game(GAME_ID, "Отдел", 10)
+        await register(db, 30, 31)
+        # Из двух одновременных распределений сохраняется одно, без дублей пар
+        results = await asyncio.gather(
+            db.commit_assignment_round(GAME_ID, [(30, 31), (31, 30)]),
+            replica.commit_assignment_round(GAME_ID, [(31, 30), (30, 31)]),
+        )
+        assert sorted(results) == [False, True]
+        pool = await db._get_pool()
+        assert await pool.fetchval("SELECT COUNT(*) FROM assignments WHERE game_id = $1", GAME_ID) == 2
+
+        # Воркеры двух подключений забирают разные уведомления
+        claimed = await asyncio.gather(db.claim_outbox(1), replica.claim_outbox(1))
+        assert sorted(row["chat_id"] for rows in claimed for row in rows) == [30, 31]
+
+
+async def test_try_lock(open_storage):
+    async with open_storage() as db:
+        async with db.try_lock("assign:1") as acquired:
+            assert acquired
+            # Занятая блокировка не ждёт освобождения, а сразу отказывает
+            async with db.try_lock("assign:1") as again:
+                assert not again
+            async with db.try_lock("assign:2") as other:
+                assert other
+        async with db.try_lock("assign:1") as acquired:
+            assert acquired
+
+
+@pytest.mark.parametrize("backend", ["postgres"])
+async def test_replicas_share_locks_and_send_limit(open_storage):
+    async with open_storage() as db, open_storage() as replica:
+        async with db.try_lock("assign:1") as acquired:
+            assert acquired
+            async with replica.try_lock("assign:1") as other:
+                assert not other
+
+        # Корзина успевает наполниться до capacity, вторая реплика получает остаток
+        await asyncio.sleep(0.3)
+        assert await db.take_send_tokens(8, rate=50, capacity=10) == (8, 0.0)
+        assert (await replica.take_send_tokens(8, rate=50, capacity=10))[0] == 2
+        granted, wait = await replica.take_send_tokens(8, rate=50, capacity=10)
+        assert granted == 0 and 0 < wait <= 0.02
+        # Пауза после RetryAfter на одной реплике останавливает все
+        await db.pause_sends(0.5)
+        granted, wait = await replica.take_send_tokens(1, rate=50, capacity=10)
+        assert granted == 0 and 0.4 < wait <= 0.5
+
+
+@pytest.mark.parametrize("backend", ["postgres"])
+async def test_replica_caches_follow_changes(open_storage):
+    async with open_storage() as db, open_storage() as storage:
+        replica = CachedDatabase(storage)
+        changes = asyncio.Queue()
+
+        def apply_change(change):
+            replica.apply_change(change)
+            changes.put_nowait(change)
+
+        async def wait_for(*expected):
+            expected = set(expected)
+            while expected:
+                expected.discard(await asyncio.wait_for(changes.get(), 5))
+
+        await storage.listen_changes(apply_change)
+        # После подключения всё прочитанное раньше считается устаревшим
+        await wait_for(None)
+
+        await db.create_game(GAME_ID, "Отдел", 10)
+        await register(db, 20)
+        await wait_for(f"participants:{GAME_ID}:20")
+        assert (await replica.get_participant(GAME_ID, 20)).wish == "Книга"
+        assert await replica.get_participant_count(GAME_ID) == 1
+        await db.register_participant(GAME_ID, 20, None, "Участник 20", "Шарф")
+        await wait_for(f"participants:{GAME_ID}:20")
+        assert (await replica.get_participant(GAME_ID, 20)).wish == "Шарф"
+
+        # Массовое изменение — одно уведомление на всю игру
+        rows = [(user_id, None, f"Участник {user_id}", "Книга") for user_id in range(100, 300)]
+        await db.import_participants(GAME_ID, rows)
+        await wait_for(f"participants:{GAME_ID}")
+        assert await replica.get_participant_count(GAME_ID) == 201
+
+        await db.save_persistence_batch([("registration", "[1, 1]", "0")], [(1, '{"game_id": 1}')])
+        await wait_for("conversation_states:registration:[1, 1]", "user_data:1")
@@ -0,0 +1,81 @@
+"""Параллельная обработка обновлений с очередями по пользователю."""
+import asyncio
+import collections
+import random
+import time
+
+from telegram import Update
+
+from update_processor import OrderedUpdateProcessor
+
+
+def message(update_id: int, user_id: int, text: str) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "text": text,
+        },
+    }, None)
+
+
+async def process_all(processor: OrderedUpdateProcessor, updates, handle):
+    """Запустить обработку, как Application: задача на каждое обновление в порядке получения."""
+    await asyncio.gather(*(
+        asyncio.create_task(processor.process_update(update, handle(update))) for update in updates
+    ))
+
+
+async def test_updates_of_one_user_keep_order():
+    rng = random.Random(1)
+    # Шаги регистрации небольших групп пользователей вперемешку, как их присылает Telegram
+    users = list(range(1000, 1040))
+    steps = ("/register", "Имя", "Подарок", "/start")
+    payloads = [
+        (user_id, step) for first in range(0, len(users), 8) for step in steps for user_id in users[first:first + 8]
+    ]
+    updates = [message(update_id, user_id, text) for update_id, (user_id, text) in enumerate(payloads, 1)]
+    seen = collections.defaultdict(list)
+    running = peak = 0
+
+    async def handle(update: Update):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        # Случайная задержка перемешала бы шаги без очереди по пользователю
+        await asyncio.sleep(rng.random() * 0.005)
+        seen[update.effective_user.id].append(update.update_id)
+        running -= 1
+
+    processor = OrderedUpdateProcessor(concurrency=8)
+    await process_all(processor, updates, handle)
+    assert all(ids == sorted(ids) and len(ids) == len(steps) for ids in seen.values())
+    assert len(seen) == len(users)
+    # Разные пользователи обрабатывались параллельно, но не больше concurrency
+    assert 1 < peak <= 8
+    assert processor.accepted == 0 and not processor._locks
+
+
+async def test_heavy_commands_use_own_pool():
+    finished = []
+    release = asyncio.Event()
+
+    async def handle(update: Update):
+        if update.message.text == "/export":
+            await release.wait()
+        finished.append(update.update_id)
+
+    processor = OrderedUpdateProcessor(["export"], concurrency=2, heavy_concurrency=1)
+    updates = [message(1, 1, "/export"), message(2, 2, "/export")]
+    updates += [message(update_id, update_id, "/status") for update_id in range(3, 13)]
+    task = asyncio.ensure_future(process_all(processor, updates, handle))
+    await asyncio.sleep(0.05)
+    # Лёгкие обновления не ждут тяжёлых; вторая тяжёлая команда ждёт места в пуле
+    assert finished == list(range(3, 13))
+    assert processor.running_heavy == 1
+    release.set()
+    await task
+    assert sorted(finished[-2:]) == [1, 2]
@@ -0,0 +1,194 @@
+"""Локальный стенд «фальшивого Telegram» для проверки режима webhook.
+
+Поднимает заглушку Bot API, на которую бот отправляет запросы, и
+присылает боту обновления на вебхук так же, как это делает Telegram.
+Сеть и настоящий токен не нужны.
+
+1. Запустить стенд (он ждёт, пока бот поднимется):
+    python tools/fake_telegram.py --users 50
+
+2. В другом терминале запустить бота против стенда:
+    BOT_TOKEN=123:fake ADMIN_USER_ID=1 DB_PATH=/tmp/fake.db \\
+    BOT_API_BASE_URL=http://127.0.0.1:8081/bot \\
+    UPDATE_MODE=webhook WEBHOOK_URL=http://127.0.0.1:8443 WEBHOOK_SECRET=secret \\
+    python bot.py
+
+Стенд проводит каждого пользователя через /start и регистрацию и выводит
+задержку от отправки обновления до ответа бота.
+"""
+import argparse
+import itertools
+import json
+import statistics
+import sys
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+BOT_USER = {"id": 100000, "is_bot": True, "first_name": "Santa", "username": "fake_santa_bot"}
+
+
+class FakeBotApi:
+    """Заглушка Bot API: отвечает на запросы бота и запоминает отправленные сообщения."""
+
+    def __init__(self):
+        self.message_ids = itertools.count(1)
+        self.calls = {}
+        self.webhook_url = None
+        self._lock = threading.Lock()
+        self._waiters = {}
+        self.webhook_ready = threading.Event()
+
+    def wait_for_reply(self, chat_id: int) -> threading.Event:
+        event = threading.Event()
+        with self._lock:
+            self._waiters[chat_id] = event
+        return event
+
+    def _message(self, params: dict) -> dict:
+        chat_id = int(params.get("chat_id", 0))
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    def handle(self, method: str, params: dict):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return BOT_USER
+        if method == "setWebhook":
+            self.webhook_url = params.get("url")
+            self.webhook_ready.set()
+            return True
+        if method in ("sendMessage", "editMessageText", "sendDocument"):
+            message = self._message(params)
+            with self._lock:
+                event = self._waiters.pop(message["chat"]["id"], None)
+            if event is not None:
+                event.set()
+            return message
+        if method == "getChatMember":
+            return {"status": "creator", "user": {"id": int(params["user_id"]), "is_bot": False,
+                                                   "first_name": "User"}, "is_anonymous": False}
+        if method == "getWebhookInfo":
+            return {"url": self.webhook_url or "", "has_custom_certificate": False, "pending_update_count": 0}
+        return True
+
+
+def make_handler(api: FakeBotApi):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            method = self.path.rstrip("/").rsplit("/", 1)[-1]
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                params = json.loads(body or b"{}")
+            else:
+                # Бот отправляет параметры формой, сложные значения — в виде JSON
+                params = dict(parse_qsl(body.decode("utf-8", "replace")))
+            payload = json.dumps({"ok": True, "result": api.handle(method, params)}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        do_GET = do_POST
+
+    return Handler
+
+
+class UpdateFactory:
+    """Собирает JSON обновлений в формате Bot API."""
+
+    def __init__(self):
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+
+    def text(self, user_id: int, text: str) -> dict:
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}",
+                     "username": f"user{user_id}"},
+            "text": text,
+        }
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return {"update_id": next(self.update_ids), "message": message}
+
+
+def post_update(url: str, secret: str, update: dict):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret},
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        response.read()
+
+
+def run_user(api: FakeBotApi, factory: UpdateFactory, url: str, secret: str, user_id: int, timeout: float):
+    """Провести пользователя через /start и регистрацию, вернуть задержки ответов."""
+    latencies = []
+    for text in ("/start", "/register", f"Участник {user_id}", "Хочу тёплые носки"):
+        replied = api.wait_for_reply(user_id)
+        started = time.perf_counter()
+        post_update(url, secret, factory.text(user_id, text))
+        if not replied.wait(timeout):
+            raise TimeoutError(f"Бот не ответил пользователю {user_id} на {text!r}")
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api-host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--secret", default="secret", help="значение WEBHOOK_SECRET бота")
+    parser.add_argument("--users", type=int, default=20, help="сколько пользователей зарегистрировать")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--first-user-id", type=int, default=1_000_000)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    api = FakeBotApi()
+    server = ThreadingHTTPServer((args.api_host, args.api_port), make_handler(api))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Заглушка Bot API: http://{args.api_host}:{args.api_port}/bot")
+    print("Жду, пока бот установит вебхук...")
+    api.webhook_ready.wait()
+    print(f"Вебхук: {api.webhook_url}")
+
+    factory = UpdateFactory()
+    user_ids = range(args.first_user_id, args.first_user_id + args.users)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda user_id: run_user(api, factory, api.webhook_url, args.secret, user_id, args.timeout),
+            user_ids,
+        ))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for user_latencies in results for latency in user_latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"Обновлений: {len(latencies)} за {elapsed:.2f} с")
+    print(f"Задержка ответа: p50 {statistics.median(latencies) * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс")
+    print(f"Вызовы Bot API: {json.dumps(api.calls, ensure_ascii=False)}")
+    server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
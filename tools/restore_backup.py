@@ -0,0 +1,56 @@
+"""Восстановление базы SQLite из резервной копии.
+
+Перед восстановлением текущая база сохраняется ещё одной копией с
+пометкой before-restore, поэтому восстановление можно откатить тем же
+способом.
+
+Бота нужно остановить до запуска и запускать снова только после
+восстановления: работающий бот держит соединение, кэш и состояние
+диалогов и при следующей записи перезапишет восстановленные данные.
+
+Запуск из корня репозитория:
+    python tools/restore_backup.py --list                 # копии от новых к старым
+    python tools/restore_backup.py latest                 # восстановить последнюю
+    python tools/restore_backup.py backups/secret_santa-20241201-120000.db.gz --db secret_santa.db
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import backup  # noqa: E402
+from database import DB_PATH  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("snapshot", nargs="?", help="файл копии или latest")
+    parser.add_argument("--db", default=DB_PATH, help="файл базы бота")
+    parser.add_argument("--dir", default=backup.BACKUP_DIR, help="каталог копий")
+    parser.add_argument("--list", action="store_true", help="показать копии и выйти")
+    args = parser.parse_args()
+
+    if args.list or not args.snapshot:
+        for path in backup.list_backups(args.dir):
+            print(f"{path}  {os.path.getsize(path) // 1024} КБ")
+        return 0
+
+    snapshot = backup.latest_backup(args.dir) if args.snapshot == "latest" else args.snapshot
+    if snapshot is None or not os.path.exists(snapshot):
+        print(f"❌ Копия не найдена: {snapshot or args.dir}")
+        return 1
+    if os.path.exists(args.db):
+        saved = backup.make_backup(args.db, args.dir, keep=backup.BACKUP_KEEP + 1, label="-before-restore")
+        print(f"Текущая база сохранена: {saved.path}")
+    try:
+        pages = backup.restore_backup(snapshot, args.db)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+    print(f"✅ База {args.db} восстановлена из {snapshot} ({pages} страниц)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
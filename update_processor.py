@@ -0,0 +1,134 @@
+"""Параллельная обработка обновлений с сохранением порядка для каждого пользователя."""
+import asyncio
+import os
+from typing import Any, Awaitable, Dict, Iterable, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Сколько лёгких обновлений обрабатывается одновременно
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+# Команды, которые обходят всех участников игры: выполняются в отдельном
+# небольшом пуле и не занимают места лёгких обновлений, а защита от флуда
+# ограничивает их строже. /status читает одну страницу по индексу — лёгкая
+HEAVY_COMMANDS = ("assign", "export", "reset", "reset_assignments", "backup")
+# Сколько тяжёлых команд (/assign, /export, ...) выполняется одновременно
+HEAVY_UPDATE_CONCURRENCY = int(os.getenv("HEAVY_UPDATE_CONCURRENCY", "2"))
+# Сколько обновлений принято в работу, включая ждущие своей очереди
+UPDATE_MAX_PENDING = int(os.getenv("UPDATE_MAX_PENDING", "256"))
+
+OrderingKey = Tuple[Optional[int], Optional[int]]
+
+
+def command_name(update: object) -> Optional[str]:
+    """Имя команды из текста сообщения без / и @имени_бота; None — не команда."""
+    if not isinstance(update, Update) or update.message is None or not update.message.text:
+        return None
+    text = update.message.text
+    if not text.startswith("/"):
+        return None
+    return text.split(maxsplit=1)[0][1:].split("@", 1)[0].lower()
+
+
+class _KeyLock:
+    __slots__ = ("lock", "users")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0
+
+
+class OrderedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных пользователей параллельно.
+
+    Обновления одного пользователя в одном чате выполняются строго по
+    очереди, в порядке получения: шаги ConversationHandler не обгоняют
+    друг друга. Application запускает задачу на каждое обновление в порядке
+    поступления, а семафор базового класса и asyncio.Lock будят ожидающих
+    в порядке очереди — поэтому очередь ключа совпадает с порядком update_id.
+
+    Тяжёлые команды занимают отдельный небольшой пул и не отнимают места
+    у лёгких обновлений; обновление, ждущее своего пользователя, не
+    занимает место ни в одном из пулов.
+    """
+
+    def __init__(
+        self,
+        heavy_commands: Iterable[str] = (),
+        concurrency: int = UPDATE_CONCURRENCY,
+        heavy_concurrency: int = HEAVY_UPDATE_CONCURRENCY,
+        max_pending: int = UPDATE_MAX_PENDING,
+    ):
+        super().__init__(max_pending)
+        self.heavy_commands = frozenset(heavy_commands)
+        self.concurrency = concurrency
+        self.heavy_concurrency = heavy_concurrency
+        self._light = asyncio.BoundedSemaphore(concurrency)
+        self._heavy = asyncio.BoundedSemaphore(heavy_concurrency)
+        self._locks: Dict[OrderingKey, _KeyLock] = {}
+        self.accepted = 0
+        self.running = 0
+        self.running_heavy = 0
+
+    @property
+    def waiting(self) -> int:
+        """Сколько обновлений ждут своей очереди или свободного места."""
+        return self.accepted - self.running - self.running_heavy
+
+    @staticmethod
+    def ordering_key(update: object) -> Optional[OrderingKey]:
+        """Ключ очереди: (чат, пользователь); None — порядок не важен."""
+        if not isinstance(update, Update):
+            return None
+        chat, user = update.effective_chat, update.effective_user
+        if chat is None and user is None:
+            return None
+        return (chat.id if chat else None, user.id if user else None)
+
+    def is_heavy(self, update: object) -> bool:
+        """Команда из heavy_commands (с упоминанием бота или без)."""
+        return command_name(update) in self.heavy_commands
+
+    async def _run(self, update: object, coroutine: Awaitable[Any]):
+        if self.is_heavy(update):
+            async with self._heavy:
+                self.running_heavy += 1
+                try:
+                    await coroutine
+                finally:
+                    self.running_heavy -= 1
+        else:
+            async with self._light:
+                self.running += 1
+                try:
+                    await coroutine
+                finally:
+                    self.running -= 1
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        self.accepted += 1
+        try:
+            key = self.ordering_key(update)
+            if key is None:
+                await self._run(update, coroutine)
+                return
+
+            key_lock = self._locks.get(key)
+            if key_lock is None:
+                key_lock = self._locks[key] = _KeyLock()
+            key_lock.users += 1
+            try:
+                async with key_lock.lock:
+                    await self._run(update, coroutine)
+            finally:
+                key_lock.users -= 1
+                if not key_lock.users:
+                    del self._locks[key]
+        finally:
+            self.accepted -= 1
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
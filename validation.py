@@ -0,0 +1,19 @@
+"""Правила проверки данных участника: общие для /register и импорта из файла."""
+from typing import Optional
+
+FULL_NAME_MIN_LENGTH = 3
+WISH_MIN_LENGTH = 5
+
+
+def full_name_error(full_name: str) -> Optional[str]:
+    """Почему ФИО не подходит; None — подходит. Ожидается строка без пробелов по краям."""
+    if len(full_name) < FULL_NAME_MIN_LENGTH:
+        return f"ФИО слишком короткое (минимум {FULL_NAME_MIN_LENGTH} символа)"
+    return None
+
+
+def wish_error(wish: str) -> Optional[str]:
+    """Почему описание подарка не подходит; None — подходит."""
+    if len(wish) < WISH_MIN_LENGTH:
+        return f"описание подарка слишком короткое (минимум {WISH_MIN_LENGTH} символов)"
+    return None